@@ -0,0 +1,200 @@
+# Copyright (C) 2021-2023 tiksan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Replay Torn API responses captured by the workers through the tasks linked to the calls.
+
+Usage: python -m benchmarks.replay CAPTURE [CAPTURE ...] [--speed 10] [--database URL] [--reset] [--limit N]
+    [--latency 0] [--json results.json]
+
+Responses are captured by setting `tornium_torn_capture_path` (see tornium_celery.tasks.capture). The captures of all
+worker processes are replayed in the order the responses were received, `--speed` times faster than they were received
+(or as fast as possible with `--speed 0`). Each response is passed to the tasks linked to its call, which are run
+eagerly against the database, a fake Redis, and the fake Torn and Discord APIs like in benchmarks/pipelines.py. Most
+handlers skip responses of factions and users not in the database, so `--database` should be a copy of the production
+database; the tables are only dropped with `--reset`. API keys passed to the handlers are captured as pseudonyms and
+replayed as fake keys, so handlers looking up the owner of a key in the database skip the response.
+
+For each handler, the number of responses handled, the wall time, the queries, and the Redis commands of the handler
+(including the tasks run by the handler) and the errors raised by the handler are reported. Responses of calls without
+linked tasks (e.g. calls made directly by a task) are skipped. Responses of merged calls (tasks.merge) are passed to
+every handler of the merged call without being sliced.
+"""
+
+import argparse
+import collections
+import heapq
+import json
+import statistics
+import time
+import typing
+
+import celery
+
+from benchmarks.pipelines import QueryCounter, setup_celery, setup_database, setup_redis
+from tests.fakes import FakeDiscordServer, FakeTornServer, serve_in_thread
+from tornium_celery.tasks.capture import CapturedResponse, fake_keys, read_capture
+
+
+class HandlerStats:
+    def __init__(self):
+        self.wall_ms: typing.List[float] = []
+        self.queries = 0
+        self.redis_commands = 0
+        self.errors: typing.Counter[str] = collections.Counter()
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": len(self.wall_ms),
+            "wall_ms": self.wall_ms,
+            "queries": self.queries,
+            "redis_commands": self.redis_commands,
+            "errors": dict(self.errors),
+        }
+
+
+def captured_responses(paths: typing.List[str]) -> typing.Iterator[CapturedResponse]:
+    # The capture of each worker process is in the order the responses were received
+    return heapq.merge(*(read_capture(path) for path in paths), key=lambda response: response.timestamp)
+
+
+def replay(
+    responses: typing.Iterable[CapturedResponse],
+    speed: float,
+    limit: typing.Optional[int],
+    redis_client,
+    queries: QueryCounter,
+) -> typing.Tuple[typing.Dict[str, HandlerStats], typing.Counter[str]]:
+    handlers: typing.Dict[str, HandlerStats] = collections.defaultdict(HandlerStats)
+    totals: typing.Counter[str] = collections.Counter()
+    start = time.monotonic()
+    first_timestamp = None
+    max_lag = 0.0
+
+    for response in responses:
+        if limit is not None and totals["responses"] >= limit:
+            break
+
+        totals["responses"] += 1
+
+        if first_timestamp is None:
+            first_timestamp = response.timestamp
+
+        if speed > 0:
+            scheduled = start + (response.timestamp - first_timestamp) / speed
+            lag = time.monotonic() - scheduled
+
+            if lag < 0:
+                time.sleep(-lag)
+
+            max_lag = max(max_lag, lag)
+
+        if len(response.links) == 0:
+            totals["unlinked"] += 1
+            continue
+
+        for link in response.links:
+            # API keys are captured as pseudonyms which are replaced with fake keys of the fake Torn API
+            signature = celery.signature(fake_keys(link))
+            stats = handlers[signature.task]
+            query_count = queries.count
+            redis_commands = redis_client.stats["commands"]
+            handler_start = time.perf_counter()
+
+            try:
+                # Every handler is passed its own copy of the response as some handlers modify the response
+                signature.clone(args=(json.loads(response.content),)).apply_async()
+            except Exception as e:
+                stats.errors[type(e).__name__] += 1
+
+            stats.wall_ms.append((time.perf_counter() - handler_start) * 1000)
+            stats.queries += queries.count - query_count
+            stats.redis_commands += redis_client.stats["commands"] - redis_commands
+
+    totals["duration_ms"] = int((time.monotonic() - start) * 1000)
+    totals["max_lag_ms"] = int(max_lag * 1000)
+    return handlers, totals
+
+
+def report(handlers: typing.Dict[str, HandlerStats], totals: typing.Counter[str]):
+    columns = ("handler", "calls", "total ms", "median ms", "p95 ms", "queries/call", "redis cmds/call", "errors")
+    rows = []
+
+    for name, stats in sorted(handlers.items(), key=lambda item: -sum(item[1].wall_ms)):
+        calls = len(stats.wall_ms)
+        rows.append(
+            (
+                name,
+                str(calls),
+                f"{sum(stats.wall_ms):.0f}",
+                f"{statistics.median(stats.wall_ms):.1f}",
+                f"{sorted(stats.wall_ms)[int(calls * 0.95) - 1 if calls >= 20 else -1]:.1f}",
+                f"{stats.queries / calls:.1f}",
+                f"{stats.redis_commands / calls:.1f}",
+                ", ".join(f"{error} x{count}" for error, count in stats.errors.most_common()),
+            )
+        )
+
+    widths = [max(len(row[index]) for row in [columns] + rows) for index in range(len(columns))]
+
+    for row in [columns] + rows:
+        print("  ".join(value.ljust(width) for value, width in zip(row, widths)).rstrip())
+
+    print(
+        f"\n{totals['responses']} responses ({totals['unlinked']} without linked tasks) replayed in "
+        f"{totals['duration_ms'] / 1000:.1f}s with a maximum lag of {totals['max_lag_ms'] / 1000:.1f}s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("captures", nargs="+")
+    parser.add_argument("--speed", type=float, default=10, help="Replay speed relative to the capture (0 for no delay)")
+    parser.add_argument("--database", default="sqlite:///:memory:")
+    parser.add_argument("--reset", action="store_true", help="Drop and re-create the tables of the database")
+    parser.add_argument("--limit", type=int, help="Number of responses to replay")
+    parser.add_argument("--latency", type=float, default=0, help="Latency of the fake APIs in seconds")
+    parser.add_argument("--json", help="File to save the results to")
+    args = parser.parse_args()
+
+    torn_server = FakeTornServer(("127.0.0.1", 0), latency=args.latency, jitter=0, key_ratelimit=1_000_000)
+    discord_server = FakeDiscordServer(
+        ("127.0.0.1", 0), latency=args.latency, jitter=0, global_ratelimit=1_000_000, bucket_limit=1_000_000
+    )
+    serve_in_thread(torn_server)
+    serve_in_thread(discord_server)
+
+    database = setup_database(args.database, reset=args.reset)
+    queries = QueryCounter(database)
+    redis_client = setup_redis()
+    setup_celery(torn_server, discord_server)
+
+    handlers, totals = replay(captured_responses(args.captures), args.speed, args.limit, redis_client, queries)
+    report(handlers, totals)
+
+    if args.json is not None:
+        with open(args.json, "w") as results_file:
+            json.dump(
+                {"totals": dict(totals), "handlers": {name: stats.as_dict() for name, stats in handlers.items()}},
+                results_file,
+                indent=4,
+            )
+
+    torn_server.shutdown()
+    discord_server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+# Copyright (C) 2021-2023 tiksan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Compare the size and CPU time of Celery's JSON serializer against the tornium serializer for Torn API responses.
+
+Usage: python benchmarks/serializers.py [--iterations N]
+"""
+
+import argparse
+import base64
+import importlib.util
+import pathlib
+import random
+import string
+import time
+
+from kombu.utils import json as kombu_json
+
+# The serializer is imported by path so that the benchmark doesn't need the configuration of the workers
+_spec = importlib.util.spec_from_file_location(
+    "tornium_serializers", pathlib.Path(__file__).parent.parent / "tornium_celery" / "serializers.py"
+)
+serializers = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(serializers)
+
+
+def _name():
+    return "".join(random.choices(string.ascii_letters, k=random.randint(4, 14)))
+
+
+def attacks_payload(attack_count: int = 100) -> dict:
+    now = int(time.time())
+
+    return {
+        "ID": 1,
+        "name": _name(),
+        "attacks": {
+            str(code): {
+                "code": "".join(random.choices(string.hexdigits, k=32)),
+                "timestamp_started": now - 300 - code,
+                "timestamp_ended": now - code,
+                "attacker_id": random.randint(1, 3_000_000),
+                "attacker_name": _name(),
+                "attacker_faction": random.randint(1, 50_000),
+                "attacker_factionname": _name(),
+                "defender_id": random.randint(1, 3_000_000),
+                "defender_name": _name(),
+                "defender_faction": random.randint(1, 50_000),
+                "defender_factionname": _name(),
+                "result": random.choice(("Attacked", "Mugged", "Hospitalized", "Lost")),
+                "stealthed": random.randint(0, 1),
+                "respect": round(random.uniform(0, 10), 2),
+                "chain": random.randint(0, 1000),
+                "raid": 0,
+                "ranked_war": 0,
+                "respect_gain": round(random.uniform(0, 10), 2),
+                "respect_loss": 0,
+                "modifiers": {
+                    "fair_fight": round(random.uniform(1, 3), 2),
+                    "war": 1,
+                    "retaliation": 1,
+                    "group_attack": 1,
+                    "overseas": 1,
+                    "chain_bonus": 1,
+                },
+            }
+            for code in range(attack_count)
+        },
+    }
+
+
+def members_payload(member_count: int = 100) -> dict:
+    return {
+        "ID": 1,
+        "name": _name(),
+        "tag": "TAG",
+        "respect": random.randint(0, 10_000_000),
+        "capacity": member_count,
+        "leader": 1,
+        "co-leader": 2,
+        "members": {
+            str(random.randint(1, 3_000_000)): {
+                "name": _name(),
+                "level": random.randint(1, 100),
+                "days_in_faction": random.randint(0, 3000),
+                "last_action": {"status": "Offline", "timestamp": int(time.time()), "relative": "1 hour ago"},
+                "status": {"description": "Okay", "details": "", "state": "Okay", "color": "green", "until": 0},
+                "position": _name(),
+            }
+            for _ in range(member_count)
+        },
+    }
+
+
+def _message(payload: dict) -> tuple:
+    # Celery's task protocol 2 body: args, kwargs, and embedded options
+    return (payload,), {"last_attacks": int(time.time())}, {"callbacks": None, "errbacks": None, "chain": None}
+
+
+def _time(function, iterations: int) -> float:
+    start = time.perf_counter()
+
+    for _ in range(iterations):
+        function()
+
+    return (time.perf_counter() - start) / iterations * 1_000_000
+
+
+def benchmark(name: str, dumps, loads, message, iterations: int):
+    serialized = dumps(message)
+    encode_us = _time(lambda: dumps(message), iterations)
+    decode_us = _time(lambda: loads(serialized), iterations)
+
+    if isinstance(serialized, str):
+        serialized = serialized.encode("utf-8")
+    else:
+        # The Redis transport stores binary message bodies in base64
+        serialized = base64.b64encode(serialized)
+
+    print(f"  {name:<28} {len(serialized):>9} B {encode_us:>10.1f} us {decode_us:>10.1f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--iterations", type=int, default=200)
+    args = parser.parse_args()
+
+    payloads = {
+        "faction/?selections=basic": {"ID": 1, "name": _name(), "tag": "TAG", "respect": 1000},
+        "faction/?selections=basic,attacks": attacks_payload(),
+        "faction/?selections=basic,positions": members_payload(),
+    }
+
+    variants = []
+
+    for serializer_format in ("json", "msgpack"):
+        if serializer_format == "msgpack" and not vars(serializers).get("msgpack:loaded"):
+            continue
+
+        for compression in ("zlib", "zstd"):
+            if compression == "zstd" and not vars(serializers).get("zstandard:loaded"):
+                continue
+
+            variants.append((serializer_format, compression))
+
+    print(f"orjson: {vars(serializers).get('orjson:loaded')} :: msgpack: {vars(serializers).get('msgpack:loaded')}")
+    print(f"zstandard: {vars(serializers).get('zstandard:loaded')} :: {args.iterations} iterations\n")
+
+    for endpoint, payload in payloads.items():
+        message = _message(payload)
+        print(f"{endpoint}\n  {'serializer':<28} {'size':>11} {'encode':>13} {'decode':>13}")
+        benchmark("json (celery)", kombu_json.dumps, kombu_json.loads, message, args.iterations)
+
+        for serializer_format, compression in variants:
+            serializers.configure(serializer_format=serializer_format, compression=compression)
+            benchmark(
+                f"tornium ({serializer_format}, {compression})",
+                serializers.dumps,
+                serializers.loads,
+                message,
+                args.iterations,
+            )
+
+        print()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+# Copyright (C) 2021-2023 tiksan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import fakeredis
+import pytest
+
+from tornium_celery.tasks import cache, ratelimit
+from tornium_celery.tasks.cache import (
+    cache_entry,
+    cache_get,
+    cache_metrics,
+    cache_set,
+    normalize_endpoint,
+)
+
+
+@pytest.fixture
+def redis_client(monkeypatch):
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(cache, "rds", lambda: client)
+    monkeypatch.setattr(ratelimit, "_scripts", {})
+    return client
+
+
+def test_selection_order():
+    assert cache_entry("faction/1?selections=positions,basic", "a") == cache_entry(
+        "faction/1?selections=basic,positions", "b"
+    )
+
+
+def test_key_scoped_target():
+    assert cache_entry("faction/?selections=basic", "a") != cache_entry("faction/?selections=basic", "b")
+    assert normalize_endpoint("torn/?selections=stocks", "a")[1] == ""
+
+
+def test_extra_params():
+    assert cache_entry("user/1?selections=personalstats", "a", stat="xantaken") != cache_entry(
+        "user/1?selections=personalstats", "a"
+    )
+
+
+def test_uncached_selection():
+    assert cache_entry("faction/?selections=basic,attacks", "a") is None
+    assert cache_entry("user/1?selections=profile", "a").ttl == 60
+
+
+def test_metrics(redis_client):
+    entry = cache_entry("faction/1?selections=basic", "a")
+
+    # The first call fails upstream, so nothing is stored
+    assert cache_get(entry) is None
+    assert cache_get(entry) is None
+    cache_set(entry, b'{"ID": 1}')
+    assert cache_get(entry) == b'{"ID": 1}'
+
+    assert cache_metrics()["faction"] == {"lookup": 3, "miss": 2, "hit": 1}
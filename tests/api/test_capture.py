@@ -0,0 +1,87 @@
+# Copyright (C) 2021-2023 tiksan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import gzip
+
+import celery
+
+from tornium_celery.tasks.capture import capture_response, fake_keys, read_capture
+
+API_KEY = "AbCdEfGh12345678"
+ADMIN_KEY = "ZyXwVuTs87654321"
+
+
+def test_captured_keys(tmp_path, monkeypatch):
+    path = tmp_path / "capture.gz"
+    monkeypatch.setitem(celery.current_app.conf, "tornium_torn_capture_path", str(path))
+
+    links = [
+        celery.signature("tasks.user.update_user_self", kwargs={"key": API_KEY}),
+        celery.signature(
+            "tasks.user.fetch_attacks_user",
+            kwargs={"handler_kwargs": {"key": API_KEY}, "admin_keys": [API_KEY, ADMIN_KEY]},
+            link=celery.signature("tasks.user.update_user_self", kwargs={"key": ADMIN_KEY}),
+        ),
+    ]
+    capture_response("user/?selections=basic", b'{"player_id": 1}', links)
+
+    with gzip.open(path, "rb") as capture_file:
+        captured = capture_file.read()
+
+    assert API_KEY.encode("utf-8") not in captured
+    assert ADMIN_KEY.encode("utf-8") not in captured
+
+    (response,) = read_capture(str(path))
+    links = fake_keys(response.links)
+
+    assert response.content == b'{"player_id": 1}'
+    # Calls made with the same key are replayed with the same fake key
+    assert links[0]["kwargs"]["key"] == links[1]["kwargs"]["handler_kwargs"]["key"]
+    assert links[1]["kwargs"]["admin_keys"][1] == links[1]["options"]["link"]["kwargs"]["key"]
+    assert links[0]["kwargs"]["key"] != links[1]["kwargs"]["admin_keys"][1]
+    assert len(links[0]["kwargs"]["key"]) == 16
+
+
+def test_captured_positional_keys(tmp_path, monkeypatch):
+    path = tmp_path / "capture.gz"
+    monkeypatch.setitem(celery.current_app.conf, "tornium_torn_capture_path", str(path))
+
+    links = [
+        celery.signature(
+            "tasks.faction.update_faction",
+            args=(1,),
+            link=celery.signature(
+                "tasks.faction.check_faction_ods",
+                args=(API_KEY, [ADMIN_KEY]),
+                kwargs={"handler_kwargs": {"token": ADMIN_KEY}},
+            ),
+        ),
+    ]
+    capture_response("faction/?selections=basic", b'{"ID": 1}', links)
+
+    with gzip.open(path, "rb") as capture_file:
+        captured = capture_file.read()
+
+    assert API_KEY.encode("utf-8") not in captured
+    assert ADMIN_KEY.encode("utf-8") not in captured
+
+    (response,) = read_capture(str(path))
+    link = fake_keys(response.links)[0]["options"]["link"]
+
+    assert link["args"][1][0] == link["kwargs"]["handler_kwargs"]["token"]
+    assert link["args"][0] != link["args"][1][0]
+    assert len(link["args"][0]) == 16
+    # Values that aren't key-shaped are kept
+    assert response.links[0]["args"] == [1]
@@ -0,0 +1,178 @@
+# Copyright (C) 2021-2023 tiksan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import time
+
+import celery
+import fakeredis
+import pytest
+
+from tornium_celery.tasks import circuit, ratelimit
+from tornium_celery.tasks.circuit import (
+    CIRCUIT_KEY,
+    CIRCUIT_PROBE_KEY,
+    OUTCOME_FAILURE,
+    OUTCOME_RELEASE,
+    OUTCOME_SUCCESS,
+    OUTCOME_TRIP,
+    STATE_CLOSED,
+    STATE_HALF_OPEN,
+    STATE_OPEN,
+    torn_circuit_allow,
+    torn_circuit_open,
+    torn_circuit_record,
+    torn_circuit_state,
+)
+from tornium_celery.tasks.keys import key_health_key
+
+
+@pytest.fixture(autouse=True)
+def redis_client(monkeypatch):
+    client = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(circuit, "rds", lambda: client)
+    monkeypatch.setattr(ratelimit, "_scripts", {})
+
+    for name, value in (
+        ("tornium_torn_circuit_window", 30),
+        ("tornium_torn_circuit_min_calls", 4),
+        ("tornium_torn_circuit_error_rate", 0.5),
+        ("tornium_torn_circuit_cooldown", 30),
+        ("tornium_torn_circuit_max_cooldown", 90),
+        ("tornium_torn_circuit_probe_timeout", 10),
+    ):
+        monkeypatch.setitem(celery.current_app.conf, name, value)
+
+    return client
+
+
+def end_cooldown(redis_client):
+    redis_client.hset(CIRCUIT_KEY, "open_until", 0)
+
+
+def test_closed():
+    permit = torn_circuit_allow()
+
+    assert permit.allowed
+    assert permit.probe is None
+    assert torn_circuit_record(OUTCOME_SUCCESS) == STATE_CLOSED
+    assert not torn_circuit_open()
+
+
+def test_trip():
+    assert torn_circuit_record(OUTCOME_TRIP, reason="9") == STATE_OPEN
+
+    permit = torn_circuit_allow()
+
+    assert not permit.allowed
+    assert not permit.wait
+    assert 29 < permit.retry_after <= 30
+    assert torn_circuit_open()
+
+
+def test_error_rate():
+    # The error rate isn't checked until the windows have the minimum number of calls
+    assert torn_circuit_record(OUTCOME_FAILURE) == STATE_CLOSED
+    assert torn_circuit_record(OUTCOME_FAILURE) == STATE_CLOSED
+    assert torn_circuit_record(OUTCOME_SUCCESS) == STATE_CLOSED
+    # Released calls weren't made so they aren't counted
+    assert torn_circuit_record(OUTCOME_RELEASE) == STATE_CLOSED
+    assert torn_circuit_record(OUTCOME_FAILURE) == STATE_OPEN
+
+
+def test_error_rate_below_threshold():
+    for _ in range(3):
+        assert torn_circuit_record(OUTCOME_SUCCESS) == STATE_CLOSED
+
+    assert torn_circuit_record(OUTCOME_FAILURE) == STATE_CLOSED
+
+
+def test_single_probe(redis_client):
+    torn_circuit_record(OUTCOME_TRIP)
+    end_cooldown(redis_client)
+
+    # Once the cooldown has passed, runners enqueue calls again so that one of them is made as the probe
+    assert not torn_circuit_open()
+
+    probe = torn_circuit_allow()
+    waiting = torn_circuit_allow()
+
+    assert probe.allowed and probe.probe is not None
+    assert torn_circuit_state().state == STATE_HALF_OPEN
+    assert not waiting.allowed and waiting.wait
+    assert 0 < waiting.retry_after <= 10
+    assert torn_circuit_open()
+
+    # Calls started before the circuit was opened don't change the state
+    assert torn_circuit_record(OUTCOME_SUCCESS) == STATE_HALF_OPEN
+    assert torn_circuit_record(OUTCOME_SUCCESS, probe.probe) == STATE_CLOSED
+    assert torn_circuit_allow().allowed
+
+
+def test_released_probe(redis_client):
+    torn_circuit_record(OUTCOME_TRIP)
+    end_cooldown(redis_client)
+    probe = torn_circuit_allow()
+
+    assert torn_circuit_record(OUTCOME_RELEASE, probe.probe) == STATE_HALF_OPEN
+    # The next call is made as the probe instead
+    assert torn_circuit_allow().probe is not None
+
+
+def test_failed_probe_cooldown(redis_client):
+    torn_circuit_record(OUTCOME_TRIP)
+
+    # The cooldown is doubled after each failed probe up to the maximum cooldown
+    for cooldown in (60, 90, 90):
+        end_cooldown(redis_client)
+        probe = torn_circuit_allow()
+
+        assert torn_circuit_record(OUTCOME_FAILURE, probe.probe) == STATE_OPEN
+        assert int(redis_client.hget(CIRCUIT_KEY, "cooldown")) == cooldown * 1000
+        assert cooldown - 1 < torn_circuit_state().open_for <= cooldown
+
+
+def test_probe_expiry(redis_client, monkeypatch):
+    monkeypatch.setitem(celery.current_app.conf, "tornium_torn_circuit_probe_timeout", 0.05)
+    torn_circuit_record(OUTCOME_TRIP)
+    end_cooldown(redis_client)
+
+    abandoned = torn_circuit_allow()
+
+    assert 0 < redis_client.pttl(CIRCUIT_PROBE_KEY) <= 50
+    assert torn_circuit_allow().wait
+
+    time.sleep(0.1)
+
+    # The unfinished probe is abandoned so that another call is made as the probe
+    probe = torn_circuit_allow()
+
+    assert probe.probe not in (None, abandoned.probe)
+    # The outcome of the abandoned probe doesn't close the circuit
+    assert torn_circuit_record(OUTCOME_SUCCESS, abandoned.probe) == STATE_HALF_OPEN
+    assert torn_circuit_record(OUTCOME_SUCCESS, probe.probe) == STATE_CLOSED
+
+
+def test_key_health(redis_client):
+    # The health of the call's API key is checked in the same round trip in every state of the circuit
+    redis_client.hset(key_health_key("a"), mapping={"status": "paused"})
+
+    assert torn_circuit_allow(key_health_key("a")).key_unhealthy
+    assert not torn_circuit_allow(key_health_key("b")).key_unhealthy
+    assert not torn_circuit_allow().key_unhealthy
+
+    torn_circuit_record(OUTCOME_TRIP)
+
+    assert torn_circuit_allow(key_health_key("a")).key_unhealthy
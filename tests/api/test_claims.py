@@ -0,0 +1,78 @@
+# Copyright (C) 2021-2023 tiksan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import json
+
+import celery
+import fakeredis
+import pytest
+
+from tornium_celery.tasks import claims
+from tornium_celery.tasks.claims import is_claim, load_payload, store_payload
+
+PAYLOAD = {"members": {str(tid): {"name": f"Member{tid}", "level": 1} for tid in range(20)}}
+
+
+@pytest.fixture(autouse=True)
+def redis_client(monkeypatch):
+    client = fakeredis.FakeRedis()
+    monkeypatch.setattr(claims, "rds", lambda: client)
+    monkeypatch.setitem(celery.current_app.conf, "tornium_claim_check_min_size", 256)
+    monkeypatch.setitem(celery.current_app.conf, "tornium_claim_check_ttl", 300)
+    return client
+
+
+def test_small_payload(redis_client):
+    payload = {"ID": 1}
+
+    assert store_payload(payload) is payload
+    assert load_payload(payload) is payload
+    assert redis_client.dbsize() == 0
+
+
+def test_claim():
+    claim = store_payload(PAYLOAD)
+
+    assert is_claim(claim)
+    assert load_payload(claim) == PAYLOAD
+
+
+def test_serialized_payload(redis_client):
+    serialized_payload = json.dumps(PAYLOAD)
+    claim = store_payload(PAYLOAD, serialized_payload)
+
+    # Identical payloads share a single key
+    assert store_payload(PAYLOAD, serialized_payload.encode("utf-8")) == claim
+    assert redis_client.dbsize() == 1
+    assert load_payload(claim) == PAYLOAD
+
+
+def test_claim_ttl(redis_client):
+    claim = store_payload(PAYLOAD, json.dumps(PAYLOAD))
+    redis_client.expire(f"tornium:claim:{claim['__claim__']}", 5)
+
+    # Storing an identical payload again extends the TTL of the stored payload for the new claim
+    store_payload(PAYLOAD, json.dumps(PAYLOAD))
+
+    assert redis_client.ttl(f"tornium:claim:{claim['__claim__']}") > 5
+
+
+def test_expired_claim(redis_client):
+    claim = store_payload(PAYLOAD)
+    redis_client.delete(f"tornium:claim:{claim['__claim__']}")
+
+    # Handlers skip the payload of an expired claim
+    assert load_payload(claim) == {}
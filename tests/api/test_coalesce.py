@@ -0,0 +1,107 @@
+# Copyright (C) 2021-2023 tiksan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import time
+
+import celery
+import fakeredis
+import pytest
+
+from tornium_celery.tasks import coalesce
+from tornium_celery.tasks.coalesce import flight_key, join_flight, land_flight, wait_for_flight
+
+ENDPOINT = "faction/1?selections=basic,positions"
+
+
+@pytest.fixture(autouse=True)
+def redis_client(monkeypatch):
+    client = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(coalesce, "rds", lambda: client)
+    monkeypatch.setattr(coalesce, "_release_script", None)
+    monkeypatch.setitem(celery.current_app.conf, "tornium_torn_coalesce_wait", 0.2)
+    monkeypatch.setitem(celery.current_app.conf, "tornium_torn_coalesce_poll_interval", 0.01)
+    return client
+
+
+def test_flight_key():
+    assert flight_key("faction/1?selections=positions,basic", "a") == flight_key(ENDPOINT, "b")
+    assert flight_key("faction/?selections=basic", "a") != flight_key("faction/?selections=basic", "b")
+
+
+def test_coalesced_call(redis_client):
+    leader = join_flight(ENDPOINT, "a")
+    follower = join_flight(ENDPOINT, "b")
+
+    assert leader.leader
+    assert not follower.leader and follower.response is None
+
+    land_flight(leader, '{"ID": 1}')
+
+    assert wait_for_flight(follower) == '{"ID": 1}'
+    assert not redis_client.exists(leader.lock_key)
+    # Calls joining shortly after the flight has landed receive the response immediately
+    assert join_flight(ENDPOINT, "c").response == '{"ID": 1}'
+    assert redis_client.hget("tornium:torn-flight:metrics", "coalesced") == "1"
+
+
+def test_failed_call(redis_client):
+    leader = join_flight(ENDPOINT, "a")
+    follower = join_flight(ENDPOINT, "b")
+    land_flight(leader)
+
+    started = time.monotonic()
+
+    # The waiting calls perform the call themselves as soon as the leader's call failed
+    assert wait_for_flight(follower) is None
+    assert time.monotonic() - started < 0.1
+    assert join_flight(ENDPOINT, "c").leader
+    assert redis_client.hget("tornium:torn-flight:metrics", "fallback") == "1"
+
+
+def test_wait_timeout(redis_client):
+    join_flight(ENDPOINT, "a")
+    follower = join_flight(ENDPOINT, "b")
+
+    started = time.monotonic()
+
+    assert wait_for_flight(follower) is None
+    assert 0.2 <= time.monotonic() - started < 0.5
+    assert redis_client.hget("tornium:torn-flight:metrics", "fallback") == "1"
+
+
+def test_expired_lock(redis_client):
+    leader = join_flight(ENDPOINT, "a")
+    # The leader's lock expired and was acquired by another call
+    redis_client.delete(leader.lock_key)
+    new_leader = join_flight(ENDPOINT, "b")
+
+    assert new_leader.leader
+
+    # The first leader's response is kept but the new leader's lock isn't released
+    land_flight(leader, '{"ID": 1}')
+
+    assert redis_client.get(new_leader.lock_key) == new_leader.token
+    assert redis_client.get(leader.result_key) == '{"ID": 1}'
+
+
+def test_follower_land(redis_client):
+    leader = join_flight(ENDPOINT, "a")
+    follower = join_flight(ENDPOINT, "b")
+    land_flight(follower, '{"ID": 1}')
+
+    # Only the leader stores the response and releases the lock
+    assert redis_client.get(leader.lock_key) == leader.token
+    assert redis_client.get(leader.result_key) is None
@@ -0,0 +1,106 @@
+# Copyright (C) 2021-2023 tiksan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import time
+
+import celery
+import fakeredis
+import pytest
+
+from tornium_celery.tasks import keys, ratelimit
+from tornium_celery.tasks.keys import (
+    KEY_HEALTH_RETRY_KEY,
+    KeyPool,
+    claim_due_keys,
+    key_health,
+    key_health_key,
+    least_loaded_key,
+    mark_key_unavailable,
+    mark_key_unhealthy,
+    restore_key_health,
+    unhealthy_keys,
+)
+from tornium_celery.tasks.ratelimit import fixed_window, torn_ratelimit_key
+
+
+@pytest.fixture(autouse=True)
+def redis_client(monkeypatch):
+    client = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(keys, "rds", lambda: client)
+    monkeypatch.setattr(ratelimit, "rds", lambda: client)
+    monkeypatch.setattr(ratelimit, "_scripts", {})
+    monkeypatch.setitem(celery.current_app.conf, "tornium_torn_ratelimit_mode", "fixed")
+    return client
+
+
+def test_unhealthy_key():
+    assert mark_key_unhealthy("a", 18) == "paused"
+    assert key_health("a")["status"] == "paused"
+    assert unhealthy_keys(["a", "b"]) == {"a"}
+    assert least_loaded_key(["a"]) is None
+
+    assert restore_key_health("a")
+    assert not restore_key_health("a")
+    assert key_health("a") == {"status": "ok"}
+    assert least_loaded_key(["a"]) == "a"
+
+
+def test_invalid_key(redis_client):
+    assert mark_key_unhealthy("a", 18) == "paused"
+    assert mark_key_unhealthy("a", 2) == "invalid"
+
+    # Invalid keys are never probed, and their health expires once they're deleted from the database
+    assert redis_client.zscore(KEY_HEALTH_RETRY_KEY, "a") is None
+    assert redis_client.ttl(key_health_key("a")) > 0
+    assert key_health("a")["retry_at"] == 0
+
+
+def test_unknown_error(redis_client):
+    assert mark_key_unhealthy("a", 5) is None
+    assert redis_client.dbsize() == 0
+
+
+def test_claim_due_keys(redis_client):
+    now = int(time.time())
+    redis_client.zadd(KEY_HEALTH_RETRY_KEY, {"a": now - 10, "b": now - 5, "c": now + 600})
+
+    assert claim_due_keys(limit=1) == ["a"]
+    assert claim_due_keys() == ["b"]
+    # The next probe of the claimed keys is pushed back until the probe's result is stored
+    assert claim_due_keys() == []
+    assert redis_client.zscore(KEY_HEALTH_RETRY_KEY, "a") >= now + 300
+
+
+def test_key_pool_budgets():
+    fixed_window(torn_ratelimit_key("a"), 50, 60_000, cost=45)
+    pool = KeyPool(["a", "b", None, "", "b"])
+    handed_out = []
+
+    while (key := pool.get()) is not None:
+        handed_out.append(key)
+
+    # The calls handed out are counted locally until every key is out of calls
+    assert len(pool) == 2
+    assert handed_out[:45] == ["b"] * 45
+    assert handed_out.count("a") == 5
+    assert handed_out.count("b") == 50
+
+
+def test_unavailable_key():
+    mark_key_unavailable("a", 60)
+
+    assert least_loaded_key(["a", "b"]) == "b"
+    assert least_loaded_key(["a"]) is None
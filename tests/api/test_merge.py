@@ -0,0 +1,46 @@
+# Copyright (C) 2021-2023 tiksan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from tornium_celery.tasks.merge import merge_group, mergeable, merged_call, slice_response
+
+
+def test_merge_target():
+    assert merge_group({"endpoint": "faction/?selections=basic,crimes", "key": "a", "merge_target": 1}) == merge_group(
+        {"endpoint": "faction/?selections=positions", "key": "b", "merge_target": 1}
+    )
+    assert merge_group({"endpoint": "faction/?selections=crimes", "key": "a"}) != merge_group(
+        {"endpoint": "faction/?selections=crimes", "key": "b"}
+    )
+
+
+def test_unmergeable():
+    assert not mergeable({"endpoint": "faction/?selections=basic,contributors", "key": "a", "stat": "drugoverdoses"})
+    assert not mergeable({"endpoint": "user/?selections=", "key": "a"})
+    assert not mergeable({"endpoint": "faction/?selections=basic,crimes", "key": None})
+
+
+def test_slice_response():
+    entries = [
+        {"endpoint": "faction/?selections=basic,positions", "key": "a", "priority_class": "refresh", "cache": True},
+        {"endpoint": "faction/?selections=basic,crimes", "key": "a", "priority_class": "notifications", "cache": False},
+    ]
+    call = merged_call(entries)
+
+    assert call["endpoint"] == "faction/?selections=basic,crimes,positions"
+    assert call["priority_class"] == "notifications"
+
+    response = {"ID": 1, "name": "Faction", "positions": {}, "crimes": {}}
+    assert slice_response(response, entries[0], call["endpoint"]) == {"ID": 1, "name": "Faction", "positions": {}}
+    assert slice_response(response, entries[1], call["endpoint"]) == {"ID": 1, "name": "Faction", "crimes": {}}
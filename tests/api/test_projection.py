@@ -0,0 +1,55 @@
+# Copyright (C) 2021-2023 tiksan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+from tornium_celery.tasks.projection import project
+
+ATTACKS = {
+    "ID": 1,
+    "name": "Faction",
+    "attacks": {
+        "1": {"result": "Attacked", "defender_id": 2, "stealthed": 0},
+        "2": {"result": "Lost", "defender_id": 3, "stealthed": 1},
+    },
+}
+
+
+def test_wildcard_fields():
+    assert project(ATTACKS, ["ID", "attacks.*.{result,defender_id}"]) == {
+        "ID": 1,
+        "attacks": {
+            "1": {"result": "Attacked", "defender_id": 2},
+            "2": {"result": "Lost", "defender_id": 3},
+        },
+    }
+
+
+def test_whole_field():
+    assert project(ATTACKS, ["attacks.*.result", "attacks"])["attacks"] == ATTACKS["attacks"]
+
+
+def test_list_items():
+    assert project({"itemmarket": [{"ID": 1, "cost": 2, "seller": 3}], "bazaar": None}, ["itemmarket.*.{ID,cost}"]) == {
+        "itemmarket": [{"ID": 1, "cost": 2}]
+    }
+
+
+def test_error_kept():
+    assert project({"error": {"code": 2, "error": "Incorrect key"}}, ["ID"]) == {
+        "error": {"code": 2, "error": "Incorrect key"}
+    }
+
+
+def test_no_projection():
+    assert project(ATTACKS, None) is ATTACKS
@@ -0,0 +1,151 @@
+# Copyright (C) 2021-2023 tiksan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import fakeredis
+import pytest
+
+from tornium_celery.tasks import ratelimit
+from tornium_celery.tasks.ratelimit import (
+    PRIORITY_SHARES,
+    fixed_window,
+    gcra,
+    gcra_planned,
+    planned_window,
+)
+
+
+@pytest.fixture(autouse=True)
+def redis_client(monkeypatch):
+    client = fakeredis.FakeRedis(decode_responses=True)
+    monkeypatch.setattr(ratelimit, "rds", lambda: client)
+    monkeypatch.setattr(ratelimit, "_scripts", {})
+    return client
+
+
+def test_fixed_window():
+    results = [fixed_window("tornium:test", 5, 60_000) for _ in range(7)]
+
+    assert [result.allowed for result in results] == [True] * 5 + [False] * 2
+    assert results[4].remaining == 0
+    assert 0 < results[5].retry_after <= 60
+
+
+def test_fixed_window_cost(redis_client):
+    assert not fixed_window("tornium:test", 5, 60_000, cost=6).allowed
+    # Denied calls don't use the budget
+    assert redis_client.get("tornium:test") == "5"
+    assert fixed_window("tornium:test", 5, 60_000, cost=5).allowed
+
+
+def test_gcra():
+    results = [gcra("tornium:test", 50, 60_000, 5) for _ in range(10)]
+
+    assert [result.allowed for result in results] == [True] * 5 + [False] * 5
+    assert results[0].remaining == 4
+    # 46 calls are spread across the minute after the burst
+    assert results[5].retry_after == pytest.approx(60 / 46, abs=0.05)
+
+
+def test_planned_window_reservation(redis_client):
+    results = [
+        planned_window("tornium:test", "tornium:test:classes", 50, 60_000, 60_000, PRIORITY_SHARES, "reports")
+        for _ in range(50)
+    ]
+
+    # 85% of the calls are reserved for higher priority classes at the start of the window
+    assert sum(result.allowed for result in results) == 8
+    assert results[-1].retry_after > 0
+
+    for _ in range(20):
+        assert planned_window(
+            "tornium:test", "tornium:test:classes", 50, 60_000, 60_000, PRIORITY_SHARES, "retal"
+        ).allowed
+
+    assert redis_client.hget("tornium:test:classes", "1") == "20"
+    assert redis_client.hget("tornium:test:classes", "4") == "8"
+
+
+def test_planned_window_end_of_window():
+    # Reservations decrease as the window elapses so that unused calls flow down to lower priority classes
+    results = [
+        planned_window("tornium:test", "tornium:test:classes", 50, 6_000, 60_000, PRIORITY_SHARES, "reports")
+        for _ in range(50)
+    ]
+
+    assert sum(result.allowed for result in results) > 8
+
+
+def test_planned_window_unknown_class():
+    with pytest.raises(ValueError):
+        planned_window("tornium:test", "tornium:test:classes", 50, 60_000, 60_000, PRIORITY_SHARES, "unknown")
+
+
+def test_gcra_planned_denied_calls(redis_client):
+    results = [
+        gcra_planned(
+            "tornium:test",
+            "tornium:test:budget",
+            "tornium:test:classes",
+            50,
+            60_000,
+            5,
+            60_000,
+            60_000,
+            PRIORITY_SHARES,
+            "refresh",
+        )
+        for _ in range(60)
+    ]
+
+    assert sum(result.allowed for result in results) == 5
+    assert all(result.retry_after > 0 for result in results[5:])
+    # Calls denied by the GCRA don't use the planned window's calls
+    assert redis_client.get("tornium:test:budget") == "45"
+    assert redis_client.hget("tornium:test:classes", "3") == "5"
+
+
+def test_gcra_planned_reservation(redis_client):
+    for _ in range(5):
+        assert gcra_planned(
+            "tornium:test",
+            "tornium:test:budget",
+            "tornium:test:classes",
+            50,
+            60_000,
+            5,
+            60_000,
+            60_000,
+            PRIORITY_SHARES,
+            "retal",
+        ).allowed
+
+    # Only the calls reserved for the higher priority classes are left in the planned window
+    redis_client.set("tornium:test:budget", 37, px=60_000)
+    result = gcra_planned(
+        "tornium:test",
+        "tornium:test:budget",
+        "tornium:test:classes",
+        50,
+        60_000,
+        5,
+        60_000,
+        60_000,
+        PRIORITY_SHARES,
+        "reports",
+    )
+
+    assert not result.allowed
+    assert result.retry_after > 0
+    assert redis_client.get("tornium:test:budget") == "37"
@@ -0,0 +1,71 @@
+# Copyright (C) 2021-2023 tiksan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import types
+
+import celery
+import pytest
+from celery.exceptions import Retry
+
+from tornium_celery.tasks.api import REQUEUES_HEADER, requeue
+
+
+class Task:
+    name = "tasks.api.tornget"
+
+    def __init__(self, requeues=None):
+        self.request = types.SimpleNamespace(
+            called_directly=False,
+            is_eager=False,
+            headers=None if requeues is None else {REQUEUES_HEADER: requeues},
+        )
+        self.sent = []
+        self.retried = []
+
+    def signature_from_request(self, request, **options):
+        return types.SimpleNamespace(apply_async=lambda: self.sent.append(options))
+
+    def retry(self, exc=None, countdown=None):
+        self.retried.append(countdown)
+        return Retry(exc=exc, when=countdown)
+
+
+def test_requeue_counts():
+    task = Task()
+
+    with pytest.raises(Retry):
+        requeue(task, 1.5)
+
+    assert task.sent == [{"countdown": 1.5, "headers": {REQUEUES_HEADER: 1}}]
+
+    task = Task(requeues=3)
+
+    with pytest.raises(Retry):
+        requeue(task, 1.5)
+
+    assert task.sent[0]["headers"] == {REQUEUES_HEADER: 4}
+
+
+def test_requeue_limit(monkeypatch):
+    monkeypatch.setitem(celery.current_app.conf, "tornium_max_requeues", 5)
+    task = Task(requeues=5)
+
+    with pytest.raises(Retry):
+        requeue(task, 1.5)
+
+    # The task is retried (and fails once out of retries) instead of being re-sent
+    assert task.sent == []
+    assert task.retried == [1.5]
@@ -0,0 +1,143 @@
+# Copyright (C) 2021-2023 tiksan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import collections
+import json
+import random
+import threading
+import time
+import typing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class WindowCounter:
+    """
+    Thread-safe counter of calls per fixed window for each ratelimit key.
+    """
+
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+        self._lock = threading.Lock()
+        self._windows: typing.Dict[str, typing.Tuple[float, int]] = {}
+
+    def hit(self, name: str) -> typing.Tuple[bool, int, float]:
+        """
+        Count a call and return whether the call is allowed, the remaining calls, and the seconds until the reset.
+        """
+
+        now = time.monotonic()
+
+        with self._lock:
+            window_start, calls = self._windows.get(name, (now, 0))
+
+            if now - window_start >= self.window:
+                window_start, calls = now, 0
+
+            calls += 1
+            self._windows[name] = (window_start, calls)
+
+        return calls <= self.limit, max(self.limit - calls, 0), max(window_start + self.window - now, 0)
+
+
+class FakeServer(ThreadingHTTPServer):
+    """
+    Threaded HTTP server with a simulated latency that counts the calls made to it.
+
+    The settings of a running server can be changed with a `POST /__fake__/settings` call with a JSON object of the
+    settings to change, and the counts can be read with `GET /__fake__/stats`.
+    """
+
+    daemon_threads = True
+    default_settings: typing.Dict[str, typing.Any] = {
+        "latency": 0.05,  # Seconds
+        "jitter": 0.02,  # Seconds
+    }
+
+    def __init__(self, address: typing.Tuple[str, int], handler_cls, **settings):
+        super().__init__(address, handler_cls)
+
+        self.settings = dict(self.default_settings)
+        self.settings.update({name: value for name, value in settings.items() if value is not None})
+        self.stats: typing.Counter[str] = collections.Counter()
+        self.stats_lock = threading.Lock()
+
+    def count(self, name: str, value: int = 1):
+        with self.stats_lock:
+            self.stats[name] += value
+
+    def delay(self):
+        latency = float(self.settings["latency"]) + random.uniform(0, float(self.settings["jitter"]))
+
+        if latency > 0:
+            time.sleep(latency)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/"
+
+
+class FakeHandler(BaseHTTPRequestHandler):
+    server: FakeServer
+    protocol_version = "HTTP/1.1"  # Keep-alive connections like the real APIs
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status: int, payload, headers: typing.Optional[typing.Dict[str, str]] = None):
+        body = b"" if payload is None else json.dumps(payload, separators=(",", ":")).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.count(f"status:{status}")
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0) or 0)
+
+        if length == 0:
+            return None
+
+        return json.loads(self.rfile.read(length))
+
+    def handle_admin(self) -> bool:
+        if not self.path.startswith("/__fake__/"):
+            return False
+
+        if self.command == "GET" and self.path == "/__fake__/stats":
+            with self.server.stats_lock:
+                stats = dict(self.server.stats)
+
+            self.send_json(200, stats)
+        elif self.command == "POST" and self.path == "/__fake__/settings":
+            self.server.settings.update(self.read_json() or {})
+            self.send_json(200, self.server.settings)
+        else:
+            self.send_json(404, {"message": "Unknown fake endpoint"})
+
+        return True
+
+
+def serve_in_thread(server: FakeServer) -> threading.Thread:
+    thread = threading.Thread(target=server.serve_forever, name=type(server).__name__, daemon=True)
+    thread.start()
+    return thread
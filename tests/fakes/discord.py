@@ -0,0 +1,312 @@
+# Copyright (C) 2021-2023 tiksan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Local stand-in for the Discord API (discord.com/api/v10).
+
+Usage: python -m tests.fakes.discord [--port 8101] [--latency 0.05] [--global-ratelimit 50]
+
+Point Tornium at the server with the `tornium_discord_api_uri` Celery setting (e.g. `http://127.0.0.1:8101/`).
+
+Every route has a bucket of `bucket_limit` calls per `bucket_window` seconds per major parameter (channel or guild)
+with Discord's ratelimit headers, and every call counts towards the global ratelimit of `global_ratelimit` calls per
+second. Exceeding either returns a 429 with Discord's body and headers.
+"""
+
+import argparse
+import datetime
+import hashlib
+import itertools
+import math
+import re
+import threading
+import time
+import typing
+import urllib.parse
+
+from .common import FakeHandler, FakeServer, WindowCounter, serve_in_thread
+
+# Snowflakes of the fake members of every guild are spread evenly from this ID
+MEMBER_ID_START = 100_000_000_000_000_000
+MEMBER_ID_STEP = 7_919
+
+ROUTES = (
+    ("GET", re.compile(r"^channels/(\d+)/messages$"), "messages"),
+    ("POST", re.compile(r"^channels/(\d+)/messages$"), "create_message"),
+    ("GET", re.compile(r"^channels/(\d+)/messages/(\d+)$"), "message"),
+    ("PATCH", re.compile(r"^channels/(\d+)/messages/(\d+)$"), "edit_message"),
+    ("DELETE", re.compile(r"^channels/(\d+)/messages/(\d+)$"), "delete"),
+    ("POST", re.compile(r"^channels/(\d+)/webhooks$"), "create_webhook"),
+    ("POST", re.compile(r"^webhooks/(\d+)/([\w-]+)$"), "create_message"),
+    ("DELETE", re.compile(r"^webhooks/(\d+)$"), "delete"),
+    ("POST", re.compile(r"^users/@me/channels$"), "create_dm"),
+    ("GET", re.compile(r"^guilds/(\d+)$"), "guild"),
+    ("GET", re.compile(r"^guilds/(\d+)/channels$"), "guild_channels"),
+    ("GET", re.compile(r"^guilds/(\d+)/roles$"), "guild_roles"),
+    ("GET", re.compile(r"^guilds/(\d+)/members$"), "guild_members"),
+    ("GET", re.compile(r"^guilds/(\d+)/members/(\d+)$"), "guild_member"),
+    ("PATCH", re.compile(r"^guilds/(\d+)/members/(\d+)$"), "guild_member"),
+    ("PUT", re.compile(r"^guilds/(\d+)/members/(\d+)/roles/(\d+)$"), "delete"),
+    ("DELETE", re.compile(r"^guilds/(\d+)/members/(\d+)/roles/(\d+)$"), "delete"),
+)
+
+
+def member_id(index: int) -> int:
+    return MEMBER_ID_START + index * MEMBER_ID_STEP
+
+
+def member(guild_id: int, user_id: int) -> dict:
+    index = (user_id - MEMBER_ID_START) // MEMBER_ID_STEP
+    return {
+        "user": {
+            "id": str(user_id),
+            "username": f"user{index}",
+            "global_name": f"User {index}",
+            "discriminator": "0",
+            "avatar": None,
+            "bot": False,
+        },
+        # Most members of a Tornium guild are verified with a nickname of `name [ID]`
+        "nick": f"Member{index} [{1 + index % 3_000_000}]" if index % 4 != 0 else None,
+        "roles": [str(guild_id + role) for role in range(index % 3)],
+        "joined_at": "2021-01-01T00:00:00.000000+00:00",
+        "deaf": False,
+        "mute": False,
+        "flags": 0,
+    }
+
+
+def guild_members(guild_id: int, member_count: int = 50_000) -> typing.Iterator[dict]:
+    return (member(guild_id, member_id(index)) for index in range(member_count))
+
+
+class FakeDiscordServer(FakeServer):
+    default_settings = {
+        "latency": 0.05,  # Seconds
+        "jitter": 0.02,  # Seconds
+        "global_ratelimit": 50,  # Calls per second
+        "bucket_limit": 5,  # Calls per bucket
+        "bucket_window": 5,  # Seconds
+        "guild_member_count": 50_000,
+    }
+
+    def __init__(self, address, **settings):
+        super().__init__(address, DiscordHandler, **settings)
+        self.global_calls = WindowCounter(int(self.settings["global_ratelimit"]), 1)
+        self.bucket_calls = WindowCounter(int(self.settings["bucket_limit"]), float(self.settings["bucket_window"]))
+        self.snowflakes = itertools.count(int(time.time() * 1000) << 22)
+        self.snowflake_lock = threading.Lock()
+
+    def snowflake(self) -> str:
+        with self.snowflake_lock:
+            return str(next(self.snowflakes))
+
+
+class DiscordHandler(FakeHandler):
+    server: FakeDiscordServer
+
+    def do_GET(self):
+        self.dispatch()
+
+    def do_POST(self):
+        self.dispatch()
+
+    def do_PATCH(self):
+        self.dispatch()
+
+    def do_PUT(self):
+        self.dispatch()
+
+    def do_DELETE(self):
+        self.dispatch()
+
+    def dispatch(self):
+        if self.handle_admin():
+            return
+
+        self.server.delay()
+        parsed = urllib.parse.urlsplit(self.path)
+        path = re.sub(r"^/?(api/v\d+/)?", "", parsed.path).strip("/")
+        params = dict(urllib.parse.parse_qsl(parsed.query))
+        payload = self.read_json()
+
+        if not self.headers.get("Authorization", "").startswith("Bot "):
+            self.send_json(401, {"message": "401: Unauthorized", "code": 0})
+            return
+
+        for method, pattern, handler_name in ROUTES:
+            match = pattern.match(path)
+
+            if method != self.command or match is None:
+                continue
+
+            # The major parameter (the channel, guild, or webhook) of the route
+            major = int(match.group(1)) if len(match.groups()) != 0 else 0
+            headers = self.ratelimit(method, pattern.pattern, str(major))
+
+            if headers is None:
+                return
+
+            self.server.count(f"calls:{handler_name}")
+            status, response = getattr(self, handler_name)(major, match, params, payload)
+            self.send_json(status, response, headers)
+            return
+
+        self.send_json(404, {"message": "404: Not Found", "code": 0})
+
+    def ratelimit(self, method: str, route: str, major_parameter: str) -> typing.Optional[typing.Dict[str, str]]:
+        settings = self.server.settings
+        self.server.global_calls.limit = int(settings["global_ratelimit"])
+        self.server.bucket_calls.limit = int(settings["bucket_limit"])
+        self.server.bucket_calls.window = float(settings["bucket_window"])
+
+        global_allowed, _, global_reset = self.server.global_calls.hit("global")
+
+        if not global_allowed:
+            self.server.count("ratelimited:global")
+            self.send_json(
+                429,
+                {"message": "You are being rate limited.", "retry_after": round(global_reset, 3), "global": True},
+                {
+                    "Retry-After": str(math.ceil(global_reset)),
+                    "X-RateLimit-Global": "true",
+                    "X-RateLimit-Scope": "global",
+                },
+            )
+            return None
+
+        bucket = hashlib.sha1(f"{method}:{route}".encode("utf-8")).hexdigest()[:16]
+        allowed, remaining, reset_after = self.server.bucket_calls.hit(f"{bucket}:{major_parameter}")
+        headers = {
+            "X-RateLimit-Limit": str(self.server.bucket_calls.limit),
+            "X-RateLimit-Remaining": str(remaining),
+            "X-RateLimit-Reset": f"{time.time() + reset_after:.3f}",
+            "X-RateLimit-Reset-After": f"{reset_after:.3f}",
+            "X-RateLimit-Bucket": bucket,
+        }
+
+        if not allowed:
+            self.server.count("ratelimited:bucket")
+            headers.update({"Retry-After": str(math.ceil(reset_after)), "X-RateLimit-Scope": "user"})
+            self.send_json(
+                429,
+                {"message": "You are being rate limited.", "retry_after": round(reset_after, 3), "global": False},
+                headers,
+            )
+            return None
+
+        return headers
+
+    def message(self, channel_id: int, match, params: dict, payload) -> typing.Tuple[int, dict]:
+        payload = payload or {}
+        return 200, {
+            "id": match.group(2) if len(match.groups()) > 1 and match.group(2).isdigit() else self.server.snowflake(),
+            "channel_id": str(channel_id),
+            "type": 0,
+            "content": payload.get("content", ""),
+            "embeds": payload.get("embeds", []),
+            "components": payload.get("components", []),
+            "author": {"id": "1", "username": "Tornium", "discriminator": "0", "bot": True},
+            "timestamp": datetime.datetime.now(tz=datetime.timezone.utc).isoformat(),
+        }
+
+    def create_message(self, channel_id: int, match, params: dict, payload) -> typing.Tuple[int, dict]:
+        self.server.count("messages")
+        _, message = self.message(channel_id, match, params, payload)
+        message["id"] = self.server.snowflake()
+        return 200, message
+
+    def edit_message(self, channel_id: int, match, params: dict, payload) -> typing.Tuple[int, dict]:
+        return self.message(channel_id, match, params, payload)
+
+    def messages(self, channel_id: int, match, params: dict, payload) -> typing.Tuple[int, list]:
+        return 200, [
+            self.message(channel_id, match, params, None)[1] for _ in range(min(int(params.get("limit", 50)), 100))
+        ]
+
+    def delete(self, *args) -> typing.Tuple[int, None]:
+        return 204, None
+
+    def create_webhook(self, channel_id: int, match, params: dict, payload) -> typing.Tuple[int, dict]:
+        return 200, {"id": self.server.snowflake(), "token": "token", "channel_id": str(channel_id), "type": 1}
+
+    def create_dm(self, *args) -> typing.Tuple[int, dict]:
+        return 200, {"id": self.server.snowflake(), "type": 1}
+
+    def guild(self, guild_id: int, match, params: dict, payload) -> typing.Tuple[int, dict]:
+        return 200, {
+            "id": str(guild_id),
+            "name": f"Guild {guild_id}",
+            "icon": None,
+            "owner_id": str(member_id(0)),
+            "approximate_member_count": int(self.server.settings["guild_member_count"]),
+        }
+
+    def guild_channels(self, guild_id: int, match, params: dict, payload) -> typing.Tuple[int, list]:
+        return 200, [
+            {"id": str(guild_id + channel), "type": 0, "name": f"channel-{channel}", "position": channel}
+            for channel in range(50)
+        ]
+
+    def guild_roles(self, guild_id: int, match, params: dict, payload) -> typing.Tuple[int, list]:
+        return 200, [
+            {"id": str(guild_id + role), "name": f"Role {role}", "position": role, "permissions": "0"}
+            for role in range(50)
+        ]
+
+    def guild_members(self, guild_id: int, match, params: dict, payload) -> typing.Tuple[int, list]:
+        member_count = int(self.server.settings["guild_member_count"])
+        limit = max(min(int(params.get("limit", 1)), 1000), 1)
+        after = int(params.get("after", 0))
+
+        # Members are sorted by their IDs, so the first member after `after` can be found without listing the members
+        start = max((after - MEMBER_ID_START) // MEMBER_ID_STEP + 1, 0) if after != 0 else 0
+        return 200, [member(guild_id, member_id(index)) for index in range(start, min(start + limit, member_count))]
+
+    def guild_member(self, guild_id: int, match, params: dict, payload) -> typing.Tuple[int, dict]:
+        return 200, member(guild_id, int(match.group(2)))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8101)
+    parser.add_argument("--latency", type=float)
+    parser.add_argument("--jitter", type=float)
+    parser.add_argument("--global-ratelimit", type=int)
+    parser.add_argument("--bucket-limit", type=int)
+    parser.add_argument("--bucket-window", type=float)
+    parser.add_argument("--guild-member-count", type=int)
+    args = parser.parse_args()
+
+    server = FakeDiscordServer(
+        (args.host, args.port),
+        latency=args.latency,
+        jitter=args.jitter,
+        global_ratelimit=args.global_ratelimit,
+        bucket_limit=args.bucket_limit,
+        bucket_window=args.bucket_window,
+        guild_member_count=args.guild_member_count,
+    )
+    print(f"Fake Discord API listening on {server.base_url}")
+
+    try:
+        serve_in_thread(server).join()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
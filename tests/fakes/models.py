@@ -0,0 +1,74 @@
+# Copyright (C) 2021-2023 tiksan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Copies of Tornium's models that can be created in a SQLite database for tests run against an in-memory database.
+"""
+
+import typing
+
+import peewee
+from playhouse.sqlite_ext import JSONField
+
+try:
+    from playhouse import postgres_ext
+
+    POSTGRESQL_FIELDS: typing.Tuple[type, ...] = (
+        postgres_ext.ArrayField,
+        postgres_ext.BinaryJSONField,
+        postgres_ext.HStoreField,
+        postgres_ext.JSONField,
+    )
+except ImportError:
+    POSTGRESQL_FIELDS = ()
+
+
+def sqlite_models(*models: typing.Type[peewee.Model]) -> typing.List[typing.Type[peewee.Model]]:
+    """
+    Get a copy of each model with the model's PostgreSQL-only fields (arrays and JSON) stored as JSON text.
+
+    The copies keep the tables, fields, and methods of the models. Foreign keys between the models point to the
+    copies so that joins and related models stay within the copies.
+    """
+
+    copies = {
+        model: type(
+            f"Sqlite{model.__name__}", (model,), {"Meta": type("Meta", (), {"table_name": model._meta.table_name})}
+        )
+        for model in models
+    }
+
+    for model_copy in copies.values():
+        for name, field in list(model_copy._meta.fields.items()):
+            if field.primary_key:
+                continue
+            elif isinstance(field, POSTGRESQL_FIELDS):
+                replacement = JSONField(null=field.null, default=field.default, column_name=field.column_name)
+            elif isinstance(field, peewee.ForeignKeyField) and field.rel_model in copies:
+                replacement = peewee.ForeignKeyField(
+                    copies[field.rel_model],
+                    field=field.rel_field.name,
+                    null=field.null,
+                    default=field.default,
+                    column_name=field.column_name,
+                    backref=field.backref,
+                )
+            else:
+                continue
+
+            model_copy._meta.remove_field(name)
+            model_copy._meta.add_field(name, replacement)
+
+    return [copies[model] for model in models]
@@ -0,0 +1,396 @@
+# Copyright (C) 2021-2023 tiksan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Generators of Torn API responses with the shapes and sizes of real responses.
+
+Every generator is deterministic for the same arguments so that benchmarks can be compared between runs.
+"""
+
+import random
+import string
+import time
+import typing
+import zlib
+
+POSITIONS = ("Leader", "Co-leader", "Council", "Enforcer", "Recruit", "Member")
+STATES = (
+    ("Okay", "green", "Okay", ""),
+    ("Hospital", "red", "In hospital for 12 mins", "Hospitalized by someone"),
+    ("Traveling", "blue", "Traveling to Mexico", ""),
+    ("Jail", "red", "In jail for 5 mins", "Busted"),
+)
+ATTACK_RESULTS = ("Attacked", "Mugged", "Hospitalized", "Lost", "Stalemate", "Escape", "Assist")
+ARMORY_TYPES = ("armor", "boosters", "drugs", "medical", "temporary", "weapons")
+
+
+def _rng(*seed) -> random.Random:
+    return random.Random(zlib.crc32(repr(seed).encode("utf-8")))
+
+
+def _name(rng: random.Random) -> str:
+    return "".join(rng.choices(string.ascii_letters, k=rng.randint(4, 14)))
+
+
+def key_owner(key: str) -> typing.Tuple[int, int]:
+    """
+    Get the user ID and the faction ID of the owner of a fake API key.
+    """
+
+    user_id = 1 + zlib.crc32(key.encode("utf-8")) % 3_000_000
+    return user_id, 1 + user_id % 50_000
+
+
+def faction_members(faction_id: int, member_count: int = 100) -> typing.List[int]:
+    rng = _rng("members", faction_id)
+    return [rng.randint(1, 3_000_000) for _ in range(member_count)]
+
+
+def _status(rng: random.Random, now: int) -> dict:
+    state, color, description, details = rng.choice(STATES)
+    return {
+        "description": description,
+        "details": details,
+        "state": state,
+        "color": color,
+        "until": 0 if state == "Okay" else now + rng.randint(60, 3600),
+    }
+
+
+def faction_basic(faction_id: int, member_count: int = 100) -> dict:
+    rng = _rng("faction", faction_id)
+    now = int(time.time())
+    members = faction_members(faction_id, member_count)
+
+    return {
+        "ID": faction_id,
+        "name": _name(rng),
+        "tag": rng.choice((_name(rng)[:4].upper(), rng.randint(0, 999))),  # Tags can be integers
+        "tag_image": f"{faction_id}-{rng.randint(1, 99)}.png",
+        "leader": members[0],
+        "co-leader": members[1],
+        "respect": rng.randint(0, 10_000_000),
+        "age": rng.randint(0, 6000),
+        "capacity": member_count,
+        "best_chain": rng.choice((10, 25, 50, 100, 250, 500, 1000, 2500)),
+        "ranked_wars": {},
+        "territory_wars": {},
+        "raid_wars": {},
+        "peace": {},
+        "rank": {"level": rng.randint(0, 20), "name": "Gold", "division": rng.randint(1, 3), "position": 0, "wins": 0},
+        "members": {
+            str(member_id): {
+                "name": _name(rng),
+                "level": rng.randint(1, 100),
+                "days_in_faction": rng.randint(0, 3000),
+                "last_action": {
+                    "status": rng.choice(("Online", "Idle", "Offline")),
+                    "timestamp": now - rng.randint(0, 86400),
+                    "relative": "1 hour ago",
+                },
+                "status": _status(rng, now),
+                "position": rng.choice(POSITIONS),
+            }
+            for member_id in members
+        },
+    }
+
+
+def faction_positions(faction_id: int) -> dict:
+    return {
+        "positions": {
+            position: {
+                "default": int(position == "Member"),
+                "canUseMedicalItem": 1,
+                "canUseBoosterItem": 1,
+                "canUseDrugItem": 1,
+                "canUseEnergyRefill": 0,
+                "canUseNerveRefill": 0,
+                "canLoanTemporaryItem": 1,
+                "canLoanWeaponAndArmory": 1,
+                "canRetrieveLoanedArmory": 0,
+                "canPlanAndInitiateOrganisedCrime": int(position in ("Leader", "Co-leader", "Council")),
+                "canAccessFactionApi": int(position in ("Leader", "Co-leader", "Council")),
+                "canGiveItem": 0,
+                "canGiveMoney": 0,
+                "canGivePoints": 0,
+                "canManageForum": 0,
+                "canManageApplications": 0,
+                "canKickMembers": 0,
+                "canAdjustMemberBalance": 0,
+                "canManageWars": 0,
+                "canManageUpgrades": 0,
+                "canSendNewsletter": 0,
+                "canChangeAnnouncement": 0,
+                "canChangeDescription": 0,
+            }
+            for position in POSITIONS[2:]
+        }
+    }
+
+
+def faction_attacks(faction_id: int, attack_count: int = 100, since: typing.Optional[int] = None) -> dict:
+    now = int(time.time())
+    since = now - 300 if since is None else since
+    # Every 10 second window has its own attacks so that repeated calls return new attacks like the real API
+    rng = _rng("attacks", faction_id, now // 10)
+    members = faction_members(faction_id)
+    attacks = {}
+
+    for attack in range(attack_count):
+        ended = rng.randint(since, now)
+        outgoing = rng.random() < 0.5
+        stealthed = rng.random() < 0.1 and not outgoing
+
+        attacks[str(rng.randint(1, 2_000_000_000))] = {
+            "code": "".join(rng.choices(string.hexdigits.lower(), k=32)),
+            "timestamp_started": ended - rng.randint(5, 300),
+            "timestamp_ended": ended,
+            "attacker_id": "" if stealthed else (rng.choice(members) if outgoing else rng.randint(1, 3_000_000)),
+            "attacker_name": "" if stealthed else _name(rng),
+            "attacker_faction": "" if stealthed else (faction_id if outgoing else rng.randint(0, 50_000)),
+            "attacker_factionname": "" if stealthed else _name(rng),
+            "defender_id": rng.randint(1, 3_000_000) if outgoing else rng.choice(members),
+            "defender_name": _name(rng),
+            "defender_faction": rng.randint(0, 50_000) if outgoing else faction_id,
+            "defender_factionname": _name(rng),
+            "result": rng.choice(ATTACK_RESULTS),
+            "stealthed": int(stealthed),
+            "respect": round(rng.uniform(0, 10), 2),
+            "chain": rng.randint(0, 1000),
+            "raid": 0,
+            "ranked_war": 0,
+            "respect_gain": round(rng.uniform(0, 10), 2),
+            "respect_loss": 0,
+            "modifiers": {
+                "fair_fight": round(rng.uniform(1, 3), 2),
+                "war": 1,
+                "retaliation": rng.choice((1, 1.5)),
+                "group_attack": 1,
+                "overseas": rng.choice((1, 1.25)),
+                "chain_bonus": rng.choice((1, 1.1, 1.2)),
+            },
+        }
+
+    return {"attacks": attacks}
+
+
+def faction_crimes(faction_id: int, crime_count: int = 30) -> dict:
+    rng = _rng("crimes", faction_id)
+    now = int(time.time())
+    members = faction_members(faction_id)
+    crimes = {}
+
+    for crime in range(crime_count):
+        participants = rng.sample(members, rng.choice((2, 3, 4, 6, 8)))
+        started = now - rng.randint(0, 7 * 86400)
+        ready = started + rng.choice((86400, 2 * 86400, 5 * 86400, 7 * 86400))
+        completed = ready <= now and rng.random() < 0.5
+
+        crimes[str(rng.randint(1, 50_000_000))] = {
+            "crime_id": rng.randint(1, 8),
+            "crime_name": rng.choice(("Blackmailing", "Kidnapping", "Bomb threat", "Planned robbery")),
+            "participants": [{str(participant): _status(rng, now)} for participant in participants],
+            "time_started": started,
+            "time_ready": ready,
+            "time_left": max(ready - now, 0),
+            "time_completed": ready if completed else 0,
+            "initiated": int(completed),
+            "initiated_by": participants[0] if completed else 0,
+            "planned_by": participants[0],
+            "success": int(completed and rng.random() < 0.7),
+            "money_gain": rng.randint(0, 50_000_000) if completed else 0,
+            "respect_gain": rng.randint(0, 500) if completed else 0,
+        }
+
+    return {"crimes": crimes}
+
+
+def faction_armory(faction_id: int, selection: str, item_count: int = 40) -> dict:
+    rng = _rng("armory", faction_id, selection)
+    items = []
+
+    for item in range(item_count):
+        quantity = rng.randint(0, 500)
+        items.append(
+            {
+                "ID": rng.randint(1, 1400),
+                "name": _name(rng),
+                "type": selection.capitalize(),
+                "quantity": quantity,
+                "available": rng.randint(0, quantity),
+                "loaned": 0,
+                "loaned_to": "",
+            }
+        )
+
+    return {selection: items}
+
+
+def faction_contributors(faction_id: int, stat: str) -> dict:
+    rng = _rng("contributors", faction_id, stat)
+    return {
+        "contributors": {
+            stat: {
+                str(member_id): {"contributed": rng.randint(0, 10), "in_faction": 1}
+                for member_id in faction_members(faction_id)
+            }
+        }
+    }
+
+
+def user_basic(user_id: int) -> dict:
+    rng = _rng("user", user_id)
+    return {
+        "level": rng.randint(1, 100),
+        "gender": rng.choice(("Male", "Female", "Enby")),
+        "player_id": user_id,
+        "name": _name(rng),
+        "status": _status(rng, int(time.time())),
+    }
+
+
+def user_profile(user_id: int, faction_id: int) -> dict:
+    rng = _rng("profile", user_id)
+    now = int(time.time())
+    profile = user_basic(user_id)
+    profile.update(
+        {
+            "rank": "Average Hustler",
+            "property": "Private Island",
+            "signup": "2015-01-01 00:00:00",
+            "awards": rng.randint(0, 1000),
+            "friends": rng.randint(0, 500),
+            "enemies": rng.randint(0, 500),
+            "forum_posts": rng.randint(0, 5000),
+            "karma": rng.randint(0, 5000),
+            "age": rng.randint(0, 6000),
+            "role": "Civilian",
+            "donator": rng.randint(0, 1),
+            "property_id": rng.randint(1, 1_000_000),
+            "life": {"current": 5000, "maximum": 5000, "increment": 300, "interval": 300, "ticktime": 120},
+            "last_action": {"status": "Online", "timestamp": now, "relative": "0 minutes ago"},
+            "faction": {
+                "position": rng.choice(POSITIONS),
+                "faction_id": faction_id,
+                "days_in_faction": rng.randint(0, 3000),
+                "faction_name": _name(rng),
+                "faction_tag": _name(rng)[:4].upper(),
+                "faction_tag_image": f"{faction_id}-1.png",
+            },
+            "married": {"spouse_id": 0, "spouse_name": "", "duration": 0},
+            "states": {"hospital_timestamp": 0, "jail_timestamp": 0},
+            "competition": None,
+        }
+    )
+
+    return profile
+
+
+def user_personalstats(user_id: int) -> dict:
+    rng = _rng("personalstats", user_id)
+    stats = ("xantaken", "lsdtaken", "refills", "energydrinkused", "statenhancersused", "networth", "attackswon")
+    return {"personalstats": {stat: rng.randint(0, 100_000) for stat in stats}}
+
+
+def user_discord(user_id: int) -> dict:
+    rng = _rng("discord", user_id)
+    linked = rng.random() < 0.8
+    return {"discord": {"userID": user_id, "discordID": str(rng.randint(10**17, 10**18)) if linked else ""}}
+
+
+def user_battlestats(user_id: int) -> dict:
+    rng = _rng("battlestats", user_id)
+    stats = {stat: rng.randint(1_000, 2_000_000_000) for stat in ("strength", "defense", "speed", "dexterity")}
+    stats.update({f"{stat}_modifier": rng.randint(-20, 20) for stat in ("strength", "defense", "speed", "dexterity")})
+    stats["total"] = sum(stats[stat] for stat in ("strength", "defense", "speed", "dexterity"))
+    return stats
+
+
+def market_listings(item_id: int, row_count: int = 500) -> dict:
+    rng = _rng("market", item_id, int(time.time()) // 30)
+    base_cost = rng.randint(100, 10_000_000)
+
+    def listings(count):
+        return [
+            {
+                "ID": rng.randint(1, 200_000_000),
+                "cost": base_cost + rng.randint(-base_cost // 10, base_cost),
+                "quantity": rng.randint(1, 100),
+            }
+            for _ in range(count)
+        ]
+
+    return {"itemmarket": listings(row_count // 2), "bazaar": listings(row_count - row_count // 2)}
+
+
+def torn_stocks(stock_count: int = 32) -> dict:
+    # Prices change every minute like the real API
+    rng = _rng("stocks", int(time.time()) // 60)
+    return {
+        "stocks": {
+            str(stock_id): {
+                "stock_id": stock_id,
+                "name": f"Stock {stock_id}",
+                "acronym": string.ascii_uppercase[stock_id % 26] * 3,
+                "current_price": round(rng.uniform(1, 1500), 2),
+                "market_cap": rng.randint(10**9, 10**13),
+                "total_shares": rng.randint(10**8, 10**10),
+                "investors": rng.randint(1000, 30_000),
+                "benefit": {
+                    "type": "active",
+                    "frequency": 7,
+                    "requirement": rng.randint(100_000, 10_000_000),
+                    "description": "$1,000,000",
+                },
+            }
+            for stock_id in range(1, stock_count + 1)
+        }
+    }
+
+
+def torn_items(item_count: int = 1200) -> dict:
+    rng = _rng("items")
+    return {
+        "items": {
+            str(item_id): {
+                "name": _name(rng),
+                "description": " ".join(_name(rng) for _ in range(12)),
+                "effect": "",
+                "requirement": "",
+                "type": rng.choice(("Melee", "Primary", "Drug", "Medical", "Booster", "Temporary", "Defensive")),
+                "weapon_type": None,
+                "buy_price": rng.randint(0, 1_000_000),
+                "sell_price": rng.randint(0, 1_000_000),
+                "market_value": rng.randint(0, 1_000_000_000),
+                "circulation": rng.randint(0, 10_000_000),
+                "image": f"https://www.torn.com/images/items/{item_id}/large.png",
+            }
+            for item_id in range(1, item_count + 1)
+        }
+    }
+
+
+def key_info(access_level: int = 3) -> dict:
+    return {
+        "access_level": access_level,
+        "access_type": {1: "Public Only", 2: "Minimal Access", 3: "Limited Access", 4: "Full Access"}[access_level],
+        "selections": {
+            "user": ["basic", "profile", "discord", "personalstats", "battlestats", "attacks"],
+            "faction": ["basic", "positions", "attacks", "crimes", "armor", "contributors"],
+            "market": ["itemmarket", "bazaar"],
+            "torn": ["stocks", "items"],
+        },
+    }
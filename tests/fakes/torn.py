@@ -0,0 +1,239 @@
+# Copyright (C) 2021-2023 tiksan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+"""
+Local stand-in for the Torn API (api.torn.com).
+
+Usage: python -m tests.fakes.torn [--port 8100] [--latency 0.05] [--key-ratelimit 100]
+
+Point Tornium at the server by setting `torn_api_uri` in Tornium's configuration to `http://127.0.0.1:8100/`.
+
+Keys determine the key's owner (see `payloads.key_owner`) and the errors returned for the key:
+- keys starting with `invalid` :: error 2 (incorrect key)
+- keys starting with `jailed` :: error 10 (key owner is in federal jail)
+- keys starting with `inactive` :: error 13 (key disabled due to owner inactivity)
+- keys starting with `paused` :: error 18 (API key paused by owner)
+- more than `key_ratelimit` calls with a key in a minute :: error 5 (too many requests)
+- private faction selections of another faction :: error 7 (incorrect ID-entity relation)
+- the `disabled` setting :: error 9 (API disabled)
+"""
+
+import argparse
+import random
+import time
+import urllib.parse
+
+from . import payloads
+from .common import FakeHandler, FakeServer, WindowCounter, serve_in_thread
+
+KEY_ERRORS = {
+    "invalid": (2, "Incorrect key"),
+    "jailed": (10, "Key owner is in federal jail"),
+    "inactive": (13, "The key owner hasn't been online for more than 7 days"),
+    "paused": (18, "API key has been paused by the owner"),
+}
+PUBLIC_FACTION_SELECTIONS = ("", "basic", "timestamp")
+
+
+class TornError(Exception):
+    def __init__(self, code: int, error: str):
+        super().__init__(error)
+        self.code = code
+        self.error = error
+
+
+class FakeTornServer(FakeServer):
+    default_settings = {
+        "latency": 0.05,  # Seconds
+        "jitter": 0.02,  # Seconds
+        "key_ratelimit": 100,  # Calls per key per minute
+        "disabled": False,  # Respond to every call with error 9
+        "server_error_rate": 0.0,  # Share of calls responded to with a 502
+        "member_count": 100,
+        "attack_count": 100,
+        "crime_count": 30,
+        "market_rows": 500,
+    }
+
+    def __init__(self, address, **settings):
+        super().__init__(address, TornHandler, **settings)
+        self.key_calls = WindowCounter(int(self.settings["key_ratelimit"]), 60)
+
+
+class TornHandler(FakeHandler):
+    server: FakeTornServer
+
+    def do_GET(self):
+        if self.handle_admin():
+            return
+
+        self.server.delay()
+        parsed = urllib.parse.urlsplit(self.path)
+        params = dict(urllib.parse.parse_qsl(parsed.query, keep_blank_values=True))
+        resource, _, target = parsed.path.strip("/").partition("/")
+        self.server.count(f"calls:{resource}")
+
+        if random.random() < float(self.server.settings["server_error_rate"]):
+            self.send_json(502, {"message": "Bad gateway"})
+            return
+
+        try:
+            response = self.respond(resource, target, params)
+        except TornError as e:
+            self.server.count(f"error:{e.code}")
+            response = {"error": {"code": e.code, "error": e.error}}
+
+        self.send_json(200, response)
+
+    def do_POST(self):
+        if not self.handle_admin():
+            self.send_json(405, {"message": "Method not allowed"})
+
+    def respond(self, resource: str, target: str, params: dict) -> dict:
+        key = params.get("key", "")
+
+        if self.server.settings["disabled"]:
+            raise TornError(9, "API disabled")
+        elif key == "":
+            raise TornError(1, "Key is empty")
+
+        for prefix, error in KEY_ERRORS.items():
+            if key.startswith(prefix):
+                raise TornError(*error)
+
+        self.server.key_calls.limit = int(self.server.settings["key_ratelimit"])
+
+        if not self.server.key_calls.hit(key)[0]:
+            raise TornError(5, "Too many requests")
+
+        if target != "" and not target.isdigit():
+            raise TornError(6, "Incorrect ID")
+
+        user_id, faction_id = payloads.key_owner(key)
+        selections = [selection.strip() for selection in params.get("selections", "").split(",")]
+        response = {}
+
+        for selection in selections:
+            if resource == "faction":
+                response.update(self.faction(selection, int(target or faction_id), faction_id, params))
+            elif resource == "user":
+                response.update(self.user(selection, int(target or user_id), faction_id))
+            elif resource == "market":
+                response.update(self.market(selection, int(target or 0)))
+            elif resource == "torn":
+                response.update(self.torn(selection))
+            elif resource == "key" and selection in ("", "info"):
+                response.update(payloads.key_info())
+            else:
+                raise TornError(4, "Wrong selections")
+
+        return response
+
+    def faction(self, selection: str, target: int, faction_id: int, params: dict) -> dict:
+        settings = self.server.settings
+
+        if selection not in PUBLIC_FACTION_SELECTIONS and target != faction_id:
+            raise TornError(7, "Incorrect ID-entity relation")
+
+        if selection in ("", "basic"):
+            return payloads.faction_basic(target, int(settings["member_count"]))
+        elif selection == "positions":
+            return payloads.faction_positions(target)
+        elif selection in ("attacks", "attacksfull"):
+            since = int(params["from"]) if params.get("from", "").isdigit() else None
+            return payloads.faction_attacks(target, int(settings["attack_count"]), since)
+        elif selection == "crimes":
+            return payloads.faction_crimes(target, int(settings["crime_count"]))
+        elif selection in payloads.ARMORY_TYPES:
+            return payloads.faction_armory(target, selection)
+        elif selection == "contributors":
+            if params.get("stat", "") == "":
+                raise TornError(3, "Incorrect ID")
+
+            return payloads.faction_contributors(target, params["stat"])
+        elif selection == "timestamp":
+            return {"timestamp": int(time.time())}
+
+        raise TornError(4, "Wrong selections")
+
+    def user(self, selection: str, target: int, faction_id: int) -> dict:
+        if selection in ("", "basic"):
+            return payloads.user_basic(target)
+        elif selection == "profile":
+            return payloads.user_profile(target, faction_id)
+        elif selection == "personalstats":
+            return payloads.user_personalstats(target)
+        elif selection == "discord":
+            return payloads.user_discord(target)
+        elif selection == "battlestats":
+            return payloads.user_battlestats(target)
+        elif selection == "attacks":
+            return payloads.faction_attacks(faction_id, int(self.server.settings["attack_count"]))
+        elif selection == "timestamp":
+            return {"timestamp": int(time.time())}
+
+        raise TornError(4, "Wrong selections")
+
+    def market(self, selection: str, item_id: int) -> dict:
+        if selection not in ("", "itemmarket", "bazaar"):
+            raise TornError(4, "Wrong selections")
+
+        listings = payloads.market_listings(item_id, int(self.server.settings["market_rows"]))
+
+        if selection == "":
+            return listings
+
+        return {selection: listings[selection]}
+
+    def torn(self, selection: str) -> dict:
+        if selection == "stocks":
+            return payloads.torn_stocks()
+        elif selection == "items":
+            return payloads.torn_items()
+        elif selection in ("", "timestamp"):
+            return {"timestamp": int(time.time())}
+
+        raise TornError(4, "Wrong selections")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--latency", type=float)
+    parser.add_argument("--jitter", type=float)
+    parser.add_argument("--key-ratelimit", type=int)
+    parser.add_argument("--server-error-rate", type=float)
+    parser.add_argument("--disabled", action="store_true", default=None)
+    args = parser.parse_args()
+
+    server = FakeTornServer(
+        (args.host, args.port),
+        latency=args.latency,
+        jitter=args.jitter,
+        key_ratelimit=args.key_ratelimit,
+        server_error_rate=args.server_error_rate,
+        disabled=args.disabled,
+    )
+    print(f"Fake Torn API listening on {server.base_url}")
+
+    try:
+        serve_in_thread(server).join()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
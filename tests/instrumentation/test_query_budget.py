@@ -0,0 +1,134 @@
+# Copyright (C) 2021-2023 tiksan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import time
+
+import peewee
+import pytest
+from tornium_commons.models import Faction, FactionPosition, User
+
+from tests.fakes import payloads
+from tests.fakes.models import sqlite_models
+from tornium_celery.instrumentation import QueryBudgetError, query_budget, query_shape
+from tornium_celery.tasks import faction
+from tornium_celery.tasks.faction import update_faction, update_faction_ts
+
+database = peewee.SqliteDatabase(":memory:")
+
+
+class Member(peewee.Model):
+    tid = peewee.IntegerField(primary_key=True)
+    name = peewee.TextField()
+
+    class Meta:
+        database = database
+
+
+def setup_module():
+    database.create_tables([Member])
+    Member.insert_many([{"tid": tid, "name": f"Member{tid}"} for tid in range(20)]).execute()
+
+
+def test_query_shape():
+    assert query_shape('SELECT "t1"."tid" FROM "member" AS "t1" WHERE ("t1"."tid" IN (?, ?, ?))') == query_shape(
+        'SELECT "t1"."tid" FROM "member" AS "t1" WHERE ("t1"."tid" IN (?))'
+    )
+    assert query_shape('INSERT INTO "member" ("tid", "name") VALUES (%s, %s), (%s, %s)') == query_shape(
+        'INSERT INTO "member" ("tid", "name") VALUES (%s, %s)'
+    )
+
+
+def test_query_budget():
+    with query_budget(queries=1) as counters:
+        list(Member.select().where(Member.tid.in_([1, 2, 3])))
+
+    assert counters.queries == 1
+
+    with pytest.raises(QueryBudgetError):
+        with query_budget(queries=5):
+            for tid in range(10):
+                Member.get_by_id(tid)
+
+
+def test_repeated_query_budget():
+    with query_budget(repeated_queries=1):
+        Member.select().where(Member.tid == 1).first()
+        Member.select().where(Member.name == "Member1").first()
+
+    with pytest.raises(QueryBudgetError):
+        with query_budget(repeated_queries=3):
+            for tid in range(10):
+                Member.select().where(Member.tid == tid).first()
+
+
+@pytest.fixture
+def user_model(monkeypatch):
+    # Handlers run against SQLite copies of the models in a separate in-memory database for each test
+    handler_database = peewee.SqliteDatabase(":memory:")
+    handler_models = sqlite_models(User, Faction, FactionPosition)
+
+    for model, model_copy in zip((User, Faction, FactionPosition), handler_models):
+        monkeypatch.setattr(faction, model.__name__, model_copy)
+
+    with handler_database.bind_ctx(handler_models):
+        handler_database.create_tables(handler_models)
+        yield handler_models[0]
+
+    handler_database.close()
+
+
+def test_update_faction_query_budget(user_model):
+    member_count = 50
+    faction_data = {**payloads.faction_basic(1, member_count=member_count), **payloads.faction_positions(1)}
+
+    # Each member is upserted separately (see the TODO in update_faction) and each position is upserted up to twice
+    with query_budget(queries=member_count + 20, redis_commands=0, repeated_queries=member_count) as counters:
+        update_faction(faction_data)
+
+    assert user_model.select().where(user_model.faction_id == 1).count() == member_count
+    assert counters.queries > member_count
+
+    with query_budget(queries=member_count + 20, redis_commands=0, repeated_queries=member_count):
+        update_faction(faction_data)
+
+
+def test_update_faction_ts_query_budget(user_model):
+    faction_data = payloads.faction_basic(1, member_count=50)
+    update_faction({**faction_data, **payloads.faction_positions(1)})
+
+    now = int(time.time())
+    faction_ts_data = {
+        "status": True,
+        "faction": {
+            "members": {
+                member_id: {
+                    "spy": {
+                        "strength": 1_000_000,
+                        "defense": 1_000_000,
+                        "speed": 1_000_000,
+                        "dexterity": 1_000_000,
+                        "timestamp": now,
+                    }
+                }
+                for member_id in faction_data["members"]
+            }
+        },
+    }
+
+    # The members are loaded and their spies are updated in bulk regardless of the number of members
+    with query_budget(queries=3, redis_commands=0, repeated_queries=1):
+        update_faction_ts(faction_ts_data)
+
+    assert user_model.select().where(user_model.battlescore_update.is_null(False)).count() == 50
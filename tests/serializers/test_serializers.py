@@ -0,0 +1,101 @@
+# Copyright (C) 2021-2023 tiksan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+
+import datetime
+import json
+import random
+import string
+
+import pytest
+from kombu import serialization
+
+from tornium_celery import serializers
+from tornium_celery.serializers import (
+    COMPRESSION_NONE,
+    COMPRESSION_ZLIB,
+    COMPRESSION_ZSTD,
+    CONTENT_TYPE,
+    FORMAT_JSON,
+    SERIALIZER_NAME,
+    dumps,
+    loads,
+    register_serializer,
+)
+
+MESSAGE = [
+    ["faction/?selections=basic", "a"],
+    {"tots": 0, "priority_class": None, "projection": ["members.*.name"], "members": {"1": {"level": 1}}},
+    {"callbacks": None, "errbacks": None, "chain": None, "chord": None},
+]
+
+
+@pytest.fixture(autouse=True)
+def settings(monkeypatch):
+    monkeypatch.setattr(serializers, "_settings", {"format": None, "compression": None, "compress_min_size": 1024})
+    return serializers._settings
+
+
+def test_round_trip():
+    assert loads(dumps(MESSAGE)) == MESSAGE
+    # Values without a native representation are serialized like Celery's JSON serializer
+    assert loads(dumps({"at": datetime.datetime(2023, 1, 1, 12), "ids": (1, 2)})) == {
+        "at": "2023-01-01T12:00:00",
+        "ids": [1, 2],
+    }
+
+
+def test_compression_threshold(settings):
+    rng = random.Random(0)
+    names = {str(tid): "".join(rng.choices(string.ascii_letters, k=8)) for tid in range(200)}
+    small_message = dumps(MESSAGE)
+    large_message = dumps(names)
+
+    assert small_message[:2] == FORMAT_JSON + COMPRESSION_NONE
+    assert large_message[:2] in (FORMAT_JSON + COMPRESSION_ZLIB, FORMAT_JSON + COMPRESSION_ZSTD)
+    assert len(large_message) < len(json.dumps(names))
+    assert loads(large_message) == names
+
+    settings["compression"] = "zlib"
+    settings["compress_min_size"] = 16
+
+    assert dumps(MESSAGE)[:2] == FORMAT_JSON + COMPRESSION_ZLIB
+    assert loads(dumps(MESSAGE)) == MESSAGE
+
+
+def test_mixed_workers(monkeypatch):
+    # Messages encoded by workers without orjson are decoded by workers with orjson and vice versa
+    monkeypatch.setattr(serializers, "ORJSON_LOADED", False)
+    message = dumps(MESSAGE)
+    monkeypatch.setattr(serializers, "ORJSON_LOADED", serializers.module_loaded("orjson"))
+
+    assert loads(message) == MESSAGE
+    assert loads(message.decode("latin-1")) == MESSAGE
+
+
+def test_kombu_serializer():
+    register_serializer()
+    # Celery converts the names of accepted serializers to content types the same way
+    accept = serialization.prepare_accept_content(["json", SERIALIZER_NAME])
+    content_type, content_encoding, body = serialization.dumps(MESSAGE, serializer=SERIALIZER_NAME)
+
+    assert content_type == CONTENT_TYPE
+    assert serialization.loads(body, content_type, content_encoding, accept=accept) == MESSAGE
+
+    # Messages sent with Celery's JSON serializer (e.g. by workers that don't send the tornium serializer) are still
+    # decoded
+    content_type, content_encoding, body = serialization.dumps(MESSAGE, serializer="json")
+
+    assert serialization.loads(body, content_type, content_encoding, accept=accept) == MESSAGE
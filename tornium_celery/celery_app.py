@@ -41,8 +41,26 @@ from celery.schedules import crontab
 from celery.signals import after_setup_logger
 from tornium_commons import Config
 
+from . import metrics  # noqa: F401 (connects the signal handlers of the metrics)
+from .instrumentation import install_instrumentation
+from .results import ResultPolicy
+from .serializers import SERIALIZER_NAME, SerializerPolicy
+from .serializers import configure as configure_serializer
+from .serializers import register_serializer
+
 config = Config.from_json()
 
+
+def _config_setting(name: str, default):
+    # Optional settings that may not be in Tornium's configuration
+    try:
+        value = config[name]
+    except (AttributeError, KeyError):
+        return default
+
+    return default if value is None else value
+
+
 _FORMAT = (
     "%(asctime)s %(levelname)s [%(name)s] [%(filename)s:%(lineno)d] "
     "[dd.service=%(dd.service)s dd.env=%(dd.env)s dd.version=%(dd.version)s dd.trace_id=%(dd.trace_id)s dd.span_id=%"
@@ -201,6 +219,26 @@ if celery_app is None:
         ],
     )
     celery_app.conf.update(task_serializer="json", result_serializer="json")
+
+    # Compact serializer (orjson or msgpack with zstd/zlib compression of large messages) for the tasks of the api
+    # queue and for results. Workers of earlier releases reject messages of the serializer, so the serializer is
+    # accepted by every worker in one release and only sent (`serializer_send` in Tornium's configuration) from the
+    # next release.
+    register_serializer()
+    celery_app.conf.accept_content = ["json", SERIALIZER_NAME]
+    celery_app.conf.result_accept_content = ["json", SERIALIZER_NAME]
+    celery_app.conf.tornium_serializer_send = bool(_config_setting("serializer_send", False))
+    # json (with orjson when installed) or msgpack
+    celery_app.conf.tornium_serializer_format = _config_setting("serializer_format", None)
+    # zstd (when installed) or zlib
+    celery_app.conf.tornium_serializer_compression = _config_setting("serializer_compression", None)
+    # Bytes; smaller messages aren't compressed
+    celery_app.conf.tornium_serializer_compress_min_size = int(_config_setting("serializer_compress_min_size", 1024))
+    configure_serializer(
+        serializer_format=celery_app.conf.tornium_serializer_format,
+        compression=celery_app.conf.tornium_serializer_compression,
+        compress_min_size=celery_app.conf.tornium_serializer_compress_min_size,
+    )
     celery_app.conf.timezone = "UTC"
     celery_app.conf.task_queues = (
         kombu.Queue("default", routing_key="default.#"),
@@ -241,6 +279,111 @@ if celery_app is None:
 
     celery_app.conf.beat_schedule = schedule
     celery_app.conf.result_expires = 300  # Results are evicted from Redis cache after five minutes
+    # Only results that are read are stored (see tornium_celery.results.RESULT_KEPT_TASKS). The number of results and
+    # bytes not stored are counted in `tornium:result-policy:metrics`.
+    celery_app.conf.task_annotations = (ResultPolicy(),)
+
+    if celery_app.conf.tornium_serializer_send:
+        celery_app.conf.task_annotations += (SerializerPolicy(),)
+        celery_app.conf.result_serializer = SERIALIZER_NAME
+
+    # Keep-alive HTTP connection pools (one per upstream API per worker process)
+    # Workers only consuming the api queue can be run with the gevent pool to make many API calls concurrently from a
+    # single process (e.g. `celery -A tornium_celery worker -Q api -P gevent -c 100`) with `pip install .[gevent]`. The
+    # pools are then sized to the worker's concurrency.
+    celery_app.conf.tornium_http_pool_size = 10
+    celery_app.conf.tornium_http_pool_idle_timeout = 60  # Seconds before an idle pool is closed and re-opened
+
+    # Torn API key ratelimiter
+    # fixed: 50 calls per key reset at the start of each minute
+    # gcra: 50 calls per key in any sliding minute spread evenly after an initial burst
+    celery_app.conf.tornium_torn_ratelimit_mode = "fixed"
+    celery_app.conf.tornium_torn_ratelimit_burst = 5
+    # Share of each key's calls per minute reserved for each priority class of calls (from the highest priority)
+    # Calls tagged with a priority class that would use the calls reserved for higher priority classes are deferred;
+    # calls without a priority class only use the key's ratelimit
+    celery_app.conf.tornium_torn_priority_shares = {
+        "retal": 0.4,
+        "notifications": 0.25,
+        "refresh": 0.2,
+        "reports": 0.15,
+    }
+    # Times a task deferred by a ratelimit is sent back to its queue before it's retried (and fails once out of retries)
+    celery_app.conf.tornium_max_requeues = 20
+
+    # Circuit breaker of Torn API calls (tasks.circuit)
+    # The circuit is opened when Torn's API is disabled or blocks Tornium (errors 8 and 9) or when the share of failed
+    # calls (timeouts, 5xx responses, and error 5) in the window is above the error rate. While the circuit is open,
+    # calls fail immediately and runners skip enqueuing calls until a single probe call succeeds.
+    celery_app.conf.tornium_torn_circuit_window = 30  # Seconds
+    celery_app.conf.tornium_torn_circuit_min_calls = 20
+    celery_app.conf.tornium_torn_circuit_error_rate = 0.5
+    celery_app.conf.tornium_torn_circuit_cooldown = 30  # Seconds; doubled after each failed probe
+    celery_app.conf.tornium_torn_circuit_max_cooldown = 300  # Seconds
+    celery_app.conf.tornium_torn_circuit_probe_timeout = 10  # Seconds before an unfinished probe is abandoned
+
+    # Seconds until jailed, inactive, and paused API keys are probed by check_api_keys (tasks.keys.KEY_HEALTH_ERRORS)
+    celery_app.conf.tornium_torn_key_health_retry = {
+        "jailed": 21600,
+        "inactive": 3600,
+        "paused": 900,
+    }
+
+    # Batched Torn API calls (tasks.api.tornget_many)
+    celery_app.conf.tornium_tornget_many_batch_size = 50
+    celery_app.conf.tornium_tornget_many_concurrency = 10
+
+    # Merging of calls to the same target (e.g. a faction's positions, crimes, and armory) into a single Torn API call
+    # (tasks.merge)
+    celery_app.conf.tornium_torn_merge_window = 1.5  # Seconds calls are held for to be merged
+    celery_app.conf.tornium_torn_merge_max_entries = 20  # Calls per merged call
+
+    # Torn API responses passed to linked tasks as a claim to the response stored in Redis (tornget's claim_check)
+    celery_app.conf.tornium_claim_check_min_size = 8192  # Bytes
+    celery_app.conf.tornium_claim_check_ttl = 300  # Seconds
+
+    # Seconds TornStats' spies of a faction are cached for; longer than the hour between refresh_factions runs so that
+    # every other run uses the cached spies instead of calling TornStats
+    celery_app.conf.tornium_tornstats_cache_ttl = 5400
+
+    # Base URL of the Discord API (the base URL of the Torn API is `torn_api_uri` in Tornium's configuration)
+    celery_app.conf.tornium_discord_api_uri = "https://discord.com/api/v10/"
+
+    # Discord API calls per second across all workers
+    celery_app.conf.tornium_discord_global_ratelimit = 50
+
+    # Coalescing of identical in-flight Torn API calls (seconds)
+    celery_app.conf.tornium_torn_coalesce_lock = 6  # Longer than tornget's time limit
+    celery_app.conf.tornium_torn_coalesce_wait = 3  # The call's timeout is reduced by the wait (see tornget)
+    celery_app.conf.tornium_torn_coalesce_poll_interval = 0.05
+    celery_app.conf.tornium_torn_coalesce_result_ttl = 2
+
+    # File Torn API responses are appended to (tasks.capture) to be replayed with benchmarks/replay.py, formatted with
+    # the `pid` of the worker process (e.g. "/var/lib/tornium/captures/torn-{pid}.gz"); disabled when None
+    celery_app.conf.tornium_torn_capture_path = None
+
+    # Per-task counts of queries and Redis commands (tornium_celery.instrumentation) flushed to
+    # `tornium:task-instrumentation:metrics`. Queries of the same shape run at least the threshold times by a task are
+    # logged as possible N+1 queries. Disabled by default as peewee and redis-py are wrapped to count every query and
+    # command; enabled with `task_instrumentation` in Tornium's configuration, after which only the sampled fraction of
+    # tasks is counted.
+    celery_app.conf.tornium_task_instrumentation = bool(_config_setting("task_instrumentation", False))
+    celery_app.conf.tornium_task_instrumentation_sample_rate = float(
+        _config_setting("task_instrumentation_sample_rate", 0.01)
+    )
+    celery_app.conf.tornium_repeated_query_threshold = 10
+
+    if celery_app.conf.tornium_task_instrumentation:
+        install_instrumentation()
+
+    # Metrics of the tasks run by each worker process and of the depths of the queues in Prometheus' text format
+    # (tornium_celery.metrics) served on the port by a worker's main process and on the port plus one plus the index of
+    # each process of a prefork worker's pool; disabled when None
+    celery_app.conf.tornium_metrics_port = None
+    celery_app.conf.tornium_metrics_host = "127.0.0.1"
+    celery_app.conf.tornium_metrics_queues = ("default", "quick", "api")
+    celery_app.conf.tornium_metrics_queue_interval = 5  # Seconds between samples of the depths of the queues
+
     celery_app.set_default()
 
     trace.LOG_SUCCESS = """\
@@ -0,0 +1,265 @@
+# Copyright (C) 2021-2023 tiksan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import collections
+import contextlib
+import functools
+import random
+import re
+import threading
+import time
+import typing
+
+import celery
+import peewee
+import redis
+from celery.signals import task_postrun, task_prerun, worker_process_shutdown
+from celery.utils.log import get_task_logger
+from tornium_commons import rds
+
+logger = get_task_logger("celery_app")
+
+METRICS_KEY = "tornium:task-instrumentation:metrics"
+FLUSH_INTERVAL = 60  # Seconds
+METRICS = ("invocations", "queries", "redis_commands", "repeated_queries")
+
+# Lists of parameters (e.g. `IN (?, ?, ?)`) and of rows (e.g. `VALUES (?, ?), (?, ?)`) have the same shape regardless
+# of their length
+_PARAMETER_LIST = re.compile(r"\(\s*(?:\?|%s)(?:\s*,\s*(?:\?|%s))*\s*\)")
+_ROW_LIST = re.compile(r"\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+")
+_WHITESPACE = re.compile(r"\s+")
+
+_local = threading.local()
+_lock = threading.Lock()
+_totals: typing.Dict[str, typing.List[int]] = {}  # Task name -> counts of METRICS not yet flushed to Redis
+_last_flush = time.monotonic()
+_installed = False
+
+
+class QueryBudgetError(AssertionError):
+    pass
+
+
+class TaskCounters:
+    """
+    Counts of the queries and Redis commands run by a task (including the tasks it runs eagerly).
+    """
+
+    def __init__(self, name: str, task_id: typing.Optional[str] = None):
+        self.name = name
+        self.task_id = task_id
+        self.queries = 0
+        self.redis_commands = 0
+        self.query_shapes: typing.Counter[str] = collections.Counter()
+
+    def repeated_queries(self, threshold: int) -> typing.List[typing.Tuple[str, int]]:
+        """
+        Get the shapes of the queries run at least `threshold` times with the number of times each shape was run.
+        """
+
+        return [(shape, count) for shape, count in self.query_shapes.most_common() if count >= threshold]
+
+
+def query_shape(sql: str) -> str:
+    return _WHITESPACE.sub(" ", _ROW_LIST.sub("(...)", _PARAMETER_LIST.sub("(...)", sql))).strip()
+
+
+def _active_counters() -> typing.List[TaskCounters]:
+    stack = getattr(_local, "stack", None)
+
+    if stack is None:
+        stack = _local.stack = []
+
+    return stack
+
+
+def install_instrumentation():
+    """
+    Count the queries run by peewee and the commands sent by redis-py towards the counters of the running task.
+
+    Neither peewee nor redis-py has hooks for every query or command, so `Database.execute_sql`,
+    `Redis.execute_command`, and `Pipeline.execute` are wrapped. Queries and commands run from other threads (e.g.
+    tornget_many's calls) aren't counted towards the task.
+    """
+
+    global _installed
+
+    with _lock:
+        if _installed:
+            return
+
+        _installed = True
+
+    execute_sql = peewee.Database.execute_sql
+    execute_command = redis.Redis.execute_command
+    execute_pipeline = redis.client.Pipeline.execute
+
+    @functools.wraps(execute_sql)
+    def counted_execute_sql(self, sql, *args, **kwargs):
+        stack = _active_counters()
+
+        if len(stack) != 0:
+            shape = query_shape(sql)
+
+            for counters in stack:
+                counters.queries += 1
+                counters.query_shapes[shape] += 1
+
+        return execute_sql(self, sql, *args, **kwargs)
+
+    @functools.wraps(execute_command)
+    def counted_execute_command(self, *args, **options):
+        for counters in _active_counters():
+            counters.redis_commands += 1
+
+        return execute_command(self, *args, **options)
+
+    @functools.wraps(execute_pipeline)
+    def counted_execute_pipeline(self, *args, **kwargs):
+        for counters in _active_counters():
+            counters.redis_commands += len(self.command_stack)
+
+        return execute_pipeline(self, *args, **kwargs)
+
+    peewee.Database.execute_sql = counted_execute_sql
+    redis.Redis.execute_command = counted_execute_command
+    redis.client.Pipeline.execute = counted_execute_pipeline
+
+
+def flush_metrics():
+    global _last_flush
+
+    with _lock:
+        totals = dict(_totals)
+        _totals.clear()
+        _last_flush = time.monotonic()
+
+    if len(totals) == 0:
+        return
+
+    pipeline = rds().pipeline(transaction=False)
+
+    for task_name, counts in totals.items():
+        for metric, count in zip(METRICS, counts):
+            if count != 0:
+                pipeline.hincrby(METRICS_KEY, f"{task_name}:{metric}", count)
+
+    pipeline.execute()
+
+
+def task_instrumentation_metrics() -> typing.Dict[str, typing.Dict[str, int]]:
+    """
+    Get the number of invocations, queries, Redis commands, and repeated query shapes (possible N+1 queries) per task.
+
+    Only the sampled invocations of each task are counted (see `tornium_task_instrumentation_sample_rate`).
+    """
+
+    metrics: typing.Dict[str, typing.Dict[str, int]] = {}
+
+    for field, value in rds().hgetall(METRICS_KEY).items():
+        if isinstance(field, bytes):
+            field = field.decode("utf-8")
+
+        task_name, _, metric = field.rpartition(":")
+        metrics.setdefault(task_name, {metric: 0 for metric in METRICS})[metric] = int(value)
+
+    return metrics
+
+
+@contextlib.contextmanager
+def query_budget(
+    queries: typing.Optional[int] = None,
+    redis_commands: typing.Optional[int] = None,
+    repeated_queries: typing.Optional[int] = None,
+):
+    """
+    Count the queries and Redis commands run in the block (including by tasks run eagerly) and raise
+    `QueryBudgetError` when the block runs more queries or Redis commands than its budget or runs a query of the same
+    shape more than `repeated_queries` times.
+
+    ```
+    with query_budget(queries=110, repeated_queries=1):
+        update_faction(faction_data)
+    ```
+    """
+
+    install_instrumentation()
+    counters = TaskCounters("query_budget")
+    stack = _active_counters()
+    stack.append(counters)
+
+    try:
+        yield counters
+    finally:
+        stack.remove(counters)
+
+    exceeded = []
+
+    if queries is not None and counters.queries > queries:
+        exceeded.append(f"{counters.queries} queries (budget of {queries})")
+
+    if redis_commands is not None and counters.redis_commands > redis_commands:
+        exceeded.append(f"{counters.redis_commands} Redis commands (budget of {redis_commands})")
+
+    if repeated_queries is not None:
+        exceeded.extend(
+            f"{count} queries of the shape `{shape}` (budget of {repeated_queries})"
+            for shape, count in counters.repeated_queries(repeated_queries + 1)
+        )
+
+    if len(exceeded) != 0:
+        raise QueryBudgetError("Over the query budget: " + "; ".join(exceeded))
+
+
+@task_prerun.connect
+def start_task_counters(sender=None, task_id=None, task=None, *args, **kwargs):
+    if not _installed or task is None:
+        return
+    elif random.random() >= float(celery.current_app.conf.get("tornium_task_instrumentation_sample_rate", 1)):
+        return
+
+    _active_counters().append(TaskCounters(task.name, task_id))
+
+
+@task_postrun.connect
+def finish_task_counters(sender=None, task_id=None, task=None, *args, **kwargs):
+    stack = _active_counters()
+
+    if not _installed or task is None or len(stack) == 0 or stack[-1].task_id != task_id:
+        return
+
+    counters = stack.pop()
+    threshold = int(celery.current_app.conf.get("tornium_repeated_query_threshold", 10))
+    repeated = counters.repeated_queries(threshold)
+
+    for shape, count in repeated:
+        logger.warning(f"{counters.name} :: {count} queries of the same shape (possible N+1 query) :: {shape[:500]}")
+
+    # The counts are kept in memory and flushed periodically like the metrics of tornium_celery.results
+    with _lock:
+        totals = _totals.setdefault(counters.name, [0] * len(METRICS))
+        totals[0] += 1
+        totals[1] += counters.queries
+        totals[2] += counters.redis_commands
+        totals[3] += len(repeated)
+        flush = time.monotonic() - _last_flush >= FLUSH_INTERVAL
+
+    if flush and len(stack) == 0:
+        flush_metrics()
+
+
+@worker_process_shutdown.connect
+def flush_instrumentation_metrics(*args, **kwargs):
+    flush_metrics()
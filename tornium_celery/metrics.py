@@ -0,0 +1,323 @@
+# Copyright (C) 2021-2023 tiksan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import bisect
+import collections
+import datetime
+import threading
+import time
+import typing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import celery
+from billiard.process import current_process
+from celery.signals import (
+    before_task_publish,
+    task_failure,
+    task_postrun,
+    task_prerun,
+    task_retry,
+    task_revoked,
+    worker_process_init,
+    worker_ready,
+)
+from celery.utils.log import get_task_logger
+from kombu.exceptions import ChannelError
+
+from .utils import setting
+
+logger = get_task_logger("celery_app")
+
+# Header set on every task message with the time the message was published
+ENQUEUED_AT_HEADER = "tornium_enqueued_at"
+
+RUNTIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)  # Seconds
+LAG_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)  # Seconds
+
+
+class Histogram:
+    def __init__(self, buckets: typing.Sequence[float]):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)  # The last count is of the +Inf bucket
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    def samples(self, name: str, labels: str) -> typing.Iterator[str]:
+        cumulative = 0
+
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(float(bound))
+            yield f'{name}_bucket{{{labels},le="{le}"}} {cumulative}'
+
+        yield f"{name}_sum{{{labels}}} {self.sum}"
+        yield f"{name}_count{{{labels}}} {cumulative}"
+
+
+class TaskMetrics:
+    """
+    Metrics of the tasks run by the worker process.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.runtime: typing.Dict[str, Histogram] = {}
+        self.lag: typing.Dict[str, Histogram] = {}
+        self.retries: typing.Counter[str] = collections.Counter()
+        self.expirations: typing.Counter[str] = collections.Counter()
+        self.failures: typing.Counter[typing.Tuple[str, str]] = collections.Counter()
+        self.started: typing.Dict[str, float] = {}  # Task ID -> start of the task (monotonic)
+
+    def observe_runtime(self, task_name: str, runtime: float):
+        with self.lock:
+            self.runtime.setdefault(task_name, Histogram(RUNTIME_BUCKETS)).observe(runtime)
+
+    def observe_lag(self, task_name: str, lag: float):
+        with self.lock:
+            self.lag.setdefault(task_name, Histogram(LAG_BUCKETS)).observe(max(lag, 0))
+
+    def render(self, queue_depths: typing.Dict[str, int]) -> str:
+        lines = []
+
+        with self.lock:
+            lines.append("# HELP tornium_task_runtime_seconds Time tasks took to run")
+            lines.append("# TYPE tornium_task_runtime_seconds histogram")
+
+            for task_name, histogram in sorted(self.runtime.items()):
+                lines.extend(histogram.samples("tornium_task_runtime_seconds", f'task="{_escape(task_name)}"'))
+
+            lines.append("# HELP tornium_task_lag_seconds Time from the publishing (or ETA) of tasks to their start")
+            lines.append("# TYPE tornium_task_lag_seconds histogram")
+
+            for task_name, histogram in sorted(self.lag.items()):
+                lines.extend(histogram.samples("tornium_task_lag_seconds", f'task="{_escape(task_name)}"'))
+
+            lines.append("# HELP tornium_task_retries_total Retries of tasks")
+            lines.append("# TYPE tornium_task_retries_total counter")
+            lines.extend(
+                f'tornium_task_retries_total{{task="{_escape(task_name)}"}} {count}'
+                for task_name, count in sorted(self.retries.items())
+            )
+
+            lines.append("# HELP tornium_task_expirations_total Tasks not run as they had expired")
+            lines.append("# TYPE tornium_task_expirations_total counter")
+            lines.extend(
+                f'tornium_task_expirations_total{{task="{_escape(task_name)}"}} {count}'
+                for task_name, count in sorted(self.expirations.items())
+            )
+
+            lines.append("# HELP tornium_task_failures_total Failures of tasks by the exception raised")
+            lines.append("# TYPE tornium_task_failures_total counter")
+            lines.extend(
+                f'tornium_task_failures_total{{task="{_escape(task_name)}",exception="{_escape(exception)}"}} {count}'
+                for (task_name, exception), count in sorted(self.failures.items())
+            )
+
+        lines.append("# HELP tornium_queue_depth Messages waiting in the queue")
+        lines.append("# TYPE tornium_queue_depth gauge")
+        lines.extend(
+            f'tornium_queue_depth{{queue="{_escape(queue)}"}} {depth}' for queue, depth in queue_depths.items()
+        )
+
+        return "\n".join(lines) + "\n"
+
+
+_metrics = TaskMetrics()
+_server: typing.Optional[ThreadingHTTPServer] = None
+_queue_depths: typing.Tuple[float, typing.Dict[str, int]] = (0.0, {})
+_queue_depths_lock = threading.Lock()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _timestamp(value) -> typing.Optional[float]:
+    if value in (None, ""):
+        return None
+    elif isinstance(value, (int, float)):
+        return float(value)
+
+    try:
+        eta = datetime.datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+
+    if eta.tzinfo is None:
+        eta = eta.replace(tzinfo=datetime.timezone.utc)
+
+    return eta.timestamp()
+
+
+def queue_depths() -> typing.Dict[str, int]:
+    """
+    Get the number of messages waiting in each of the `tornium_metrics_queues` queues.
+
+    The depths are sampled from the broker at most once per `tornium_metrics_queue_interval` seconds per worker process.
+    """
+
+    global _queue_depths
+
+    with _queue_depths_lock:
+        sampled_at, depths = _queue_depths
+
+        if time.monotonic() - sampled_at < float(setting("tornium_metrics_queue_interval", 5)):
+            return depths
+
+        depths = {}
+
+        try:
+            with celery.current_app.connection_for_read() as connection:
+                channel = connection.default_channel
+
+                for queue in setting("tornium_metrics_queues", ("default", "quick", "api")):
+                    try:
+                        depths[queue] = channel.queue_declare(queue=queue, passive=True).message_count
+                    except ChannelError:
+                        # Empty queues don't exist in Redis
+                        depths[queue] = 0
+        except Exception as e:
+            logger.warning(f"Failed to sample the depths of the queues :: {e!r}")
+            return {}
+
+        _queue_depths = (time.monotonic(), depths)
+        return depths
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+
+        body = _metrics.render(queue_depths()).encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(index: int = 0) -> typing.Optional[ThreadingHTTPServer]:
+    """
+    Serve the metrics of the process in Prometheus' text format on `tornium_metrics_port` plus `index` when
+    `tornium_metrics_port` is set.
+
+    The main process of a worker uses the base port and the pool processes of prefork workers use the base port plus
+    one plus their index, so every process of a worker has its own port. Expirations are counted by the main process
+    as expired tasks aren't sent to the pool.
+    """
+
+    global _server
+
+    port = setting("tornium_metrics_port", None)
+
+    if port is None or _server is not None:
+        return _server
+
+    try:
+        _server = ThreadingHTTPServer((setting("tornium_metrics_host", "127.0.0.1"), int(port) + index), MetricsHandler)
+    except OSError as e:
+        logger.warning(f"Failed to serve the metrics on port {int(port) + index} :: {e!r}")
+        return None
+
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, name="tornium-metrics", daemon=True).start()
+    return _server
+
+
+@before_task_publish.connect
+def set_enqueued_at(sender=None, headers=None, *args, **kwargs):
+    if headers is not None:
+        headers[ENQUEUED_AT_HEADER] = time.time()
+
+
+@task_prerun.connect
+def record_task_start(sender=None, task_id=None, task=None, *args, **kwargs):
+    if task is None or task_id is None or task.request.is_eager:
+        return
+
+    # Headers of the message are set as attributes of the request by newer versions of Celery
+    enqueued_at = _timestamp(
+        getattr(task.request, ENQUEUED_AT_HEADER, None) or (task.request.headers or {}).get(ENQUEUED_AT_HEADER)
+    )
+
+    if enqueued_at is not None:
+        # Tasks sent with a countdown are only late once their ETA has passed
+        eta = _timestamp(task.request.eta)
+        _metrics.observe_lag(task.name, time.time() - max(enqueued_at, eta or 0))
+
+    with _metrics.lock:
+        _metrics.started[task_id] = time.monotonic()
+
+
+@task_postrun.connect
+def record_task_runtime(sender=None, task_id=None, task=None, *args, **kwargs):
+    if task is None or task_id is None:
+        return
+
+    with _metrics.lock:
+        started = _metrics.started.pop(task_id, None)
+
+    if started is not None:
+        _metrics.observe_runtime(task.name, time.monotonic() - started)
+
+
+@task_retry.connect
+def record_task_retry(sender=None, request=None, *args, **kwargs):
+    if sender is None or (request is not None and request.is_eager):
+        return
+
+    with _metrics.lock:
+        _metrics.retries[sender.name] += 1
+
+
+@task_failure.connect
+def record_task_failure(sender=None, task_id=None, exception=None, *args, **kwargs):
+    if sender is None or sender.request.is_eager:
+        return
+
+    with _metrics.lock:
+        _metrics.failures[(sender.name, type(exception).__name__)] += 1
+
+
+@task_revoked.connect
+def record_task_expiration(sender=None, request=None, expired=False, *args, **kwargs):
+    if not expired or sender is None:
+        return
+
+    with _metrics.lock:
+        _metrics.expirations[sender.name] += 1
+
+
+@worker_process_init.connect
+def start_process_metrics_server(*args, **kwargs):
+    global _metrics, _server
+
+    # Processes replacing exited pool processes are forked from the main process after its server was started
+    _metrics = TaskMetrics()
+    _server = None
+    start_metrics_server(1 + (getattr(current_process(), "index", 0) or 0))
+
+
+@worker_ready.connect
+def start_worker_metrics_server(*args, **kwargs):
+    start_metrics_server()
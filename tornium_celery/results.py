@@ -0,0 +1,148 @@
+# Copyright (C) 2021-2023 tiksan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import threading
+import time
+import typing
+
+from celery.signals import task_postrun, worker_process_shutdown
+from kombu.serialization import dumps
+from tornium_commons import rds
+
+# Tasks whose results are read from the result backend
+# - tasks.api.discordpost :: the created message is read by check_attacks to store retaliations
+# - tasks.api.discordget :: read by callers with `.get()`
+# - tasks.api.torn_stats_get :: read by callers with `.get()`
+# Results of every other task are never read (the results of linked tasks are passed to the callbacks directly) so
+# they aren't stored in Redis. Calls whose results are read (e.g. the tornget calls in the header of check_api_keys's
+# chord) are sent with the `ignore_result=False` option.
+RESULT_KEPT_TASKS = frozenset(
+    (
+        "tasks.api.discordget",
+        "tasks.api.discordpost",
+        "tasks.api.torn_stats_get",
+    )
+)
+
+# Approximate size of the result's metadata stored by the Redis result backend besides the result itself (status,
+# traceback, children, date_done, and task_id)
+RESULT_META_SIZE = 160
+
+METRICS_KEY = "tornium:result-policy:metrics"
+FLUSH_INTERVAL = 60  # Seconds
+
+_lock = threading.Lock()
+_skipped: typing.Dict[str, typing.List[int]] = {}  # Task name -> [results, bytes] not yet flushed to Redis
+_last_flush = time.monotonic()
+
+
+class ResultPolicy:
+    """
+    Task annotation ignoring the results of Tornium tasks whose results are never read.
+
+    Used as `celery_app.conf.task_annotations = (ResultPolicy(),)`. The annotation overrides the `ignore_result` set
+    by the task itself, so tasks whose results are read have to be added to `kept_tasks`. The result of a single call
+    is stored when the call is sent with `ignore_result=False` as the option of the call overrides the task's.
+    """
+
+    def __init__(self, kept_tasks: typing.Iterable[str] = RESULT_KEPT_TASKS):
+        self.kept_tasks = frozenset(kept_tasks)
+
+    def annotate(self, task) -> typing.Optional[dict]:
+        if not task.name.startswith("tasks.") or task.name in self.kept_tasks:
+            return None
+
+        return {"ignore_result": True}
+
+    def annotate_any(self) -> typing.Optional[dict]:
+        return None
+
+
+def _result_size(task, task_id: str, retval) -> int:
+    try:
+        _, _, data = dumps(retval, serializer=task.app.conf.result_serializer)
+    except Exception:
+        data = b""
+
+    return len(task.backend.task_keyprefix) + len(task_id) + len(data) + RESULT_META_SIZE
+
+
+def flush_metrics():
+    global _last_flush
+
+    with _lock:
+        skipped = dict(_skipped)
+        _skipped.clear()
+        _last_flush = time.monotonic()
+
+    if len(skipped) == 0:
+        return
+
+    pipeline = rds().pipeline(transaction=False)
+
+    for task_name, (results, result_bytes) in skipped.items():
+        pipeline.hincrby(METRICS_KEY, f"{task_name}:results", results)
+        pipeline.hincrby(METRICS_KEY, f"{task_name}:bytes", result_bytes)
+
+    pipeline.execute()
+
+
+def result_policy_metrics() -> typing.Dict[str, typing.Dict[str, int]]:
+    """
+    Get the number of results and the approximate number of bytes not stored in Redis per task.
+    """
+
+    metrics: typing.Dict[str, typing.Dict[str, int]] = {}
+
+    for field, value in rds().hgetall(METRICS_KEY).items():
+        if isinstance(field, bytes):
+            field = field.decode("utf-8")
+
+        task_name, _, counter = field.rpartition(":")
+        metrics.setdefault(task_name, {"results": 0, "bytes": 0})[counter] = int(value)
+
+    return metrics
+
+
+@task_postrun.connect
+def record_ignored_result(sender=None, task_id=None, task=None, retval=None, *args, **kwargs):
+    if task is None or task_id is None or not task.name.startswith("tasks."):
+        return
+    elif task.request.is_eager:
+        return
+
+    # The `ignore_result` option of the call overrides the task's
+    ignore_result = getattr(task.request, "ignore_result", None)
+
+    if not (task.ignore_result if ignore_result is None else ignore_result):
+        return
+
+    # The counts are kept in memory and flushed periodically to avoid adding a round trip to Redis to every task
+    # which would negate the saving
+    result_size = _result_size(task, task_id, retval)
+
+    with _lock:
+        counts = _skipped.setdefault(task.name, [0, 0])
+        counts[0] += 1
+        counts[1] += result_size
+        flush = time.monotonic() - _last_flush >= FLUSH_INTERVAL
+
+    if flush:
+        flush_metrics()
+
+
+@worker_process_shutdown.connect
+def flush_result_metrics(*args, **kwargs):
+    flush_metrics()
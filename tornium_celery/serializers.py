@@ -0,0 +1,192 @@
+# Copyright (C) 2021-2023 tiksan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import datetime
+import decimal
+import json
+import typing
+import uuid
+import zlib
+
+from kombu.serialization import register
+
+from .utils import ORJSON_LOADED, module_loaded
+
+MSGPACK_LOADED = module_loaded("msgpack")
+ZSTANDARD_LOADED = module_loaded("zstandard")
+
+if MSGPACK_LOADED:
+    import msgpack
+
+if ORJSON_LOADED:
+    import orjson
+
+if ZSTANDARD_LOADED:
+    import zstandard
+
+SERIALIZER_NAME = "tornium"
+CONTENT_TYPE = "application/x-tornium"
+
+# Every message starts with a two byte header of the format and the compression of the message, so messages can be
+# decoded by any worker regardless of the format and compression used by the worker that encoded the message
+FORMAT_JSON = b"j"
+FORMAT_MSGPACK = b"m"
+COMPRESSION_NONE = b"-"
+COMPRESSION_ZLIB = b"z"
+COMPRESSION_ZSTD = b"s"
+
+# Settings are set by `configure` from the Celery configuration
+_settings = {
+    "format": None,  # Preferred format (json or msgpack); json is encoded with orjson when installed
+    "compression": None,  # Preferred compression (zstd or zlib)
+    "compress_min_size": 1024,  # Bytes
+}
+
+_zstd_compressor = None
+_zstd_decompressor = None
+
+
+def _default(obj):
+    # Values the formats can't serialize natively are serialized the same way as Celery's JSON serializer
+    if isinstance(obj, (datetime.datetime, datetime.date, datetime.time)):
+        return obj.isoformat()
+    elif isinstance(obj, (decimal.Decimal, uuid.UUID)):
+        return str(obj)
+    elif isinstance(obj, (set, frozenset, tuple)):
+        return list(obj)
+
+    raise TypeError(f"Object of type {type(obj).__name__} is not serializable")
+
+
+def configure(
+    serializer_format: typing.Optional[str] = None,
+    compression: typing.Optional[str] = None,
+    compress_min_size: typing.Optional[int] = None,
+):
+    if serializer_format is not None:
+        _settings["format"] = serializer_format
+    if compression is not None:
+        _settings["compression"] = compression
+    if compress_min_size is not None:
+        _settings["compress_min_size"] = compress_min_size
+
+
+def _format() -> bytes:
+    if _settings["format"] == "msgpack" and MSGPACK_LOADED:
+        return FORMAT_MSGPACK
+    elif _settings["format"] is None and not ORJSON_LOADED and MSGPACK_LOADED:
+        # msgpack is preferred over the standard library's JSON encoder when orjson isn't installed
+        return FORMAT_MSGPACK
+
+    return FORMAT_JSON
+
+
+def _compression() -> bytes:
+    if _settings["compression"] in (None, "zstd") and ZSTANDARD_LOADED:
+        return COMPRESSION_ZSTD
+
+    return COMPRESSION_ZLIB
+
+
+def _serialize(data, serializer_format: bytes) -> bytes:
+    if serializer_format == FORMAT_MSGPACK:
+        return msgpack.packb(data, default=_default, use_bin_type=True)
+    elif ORJSON_LOADED:
+        return orjson.dumps(
+            data,
+            default=_default,
+            option=orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME,
+        )
+
+    return json.dumps(data, default=_default, separators=(",", ":")).encode("utf-8")
+
+
+def _deserialize(data: bytes, serializer_format: bytes):
+    if serializer_format == FORMAT_MSGPACK:
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+    elif ORJSON_LOADED:
+        return orjson.loads(data)
+
+    return json.loads(data)
+
+
+def _compress(data: bytes, compression: bytes) -> bytes:
+    global _zstd_compressor
+
+    if compression == COMPRESSION_ZSTD:
+        if _zstd_compressor is None:
+            _zstd_compressor = zstandard.ZstdCompressor(level=3)
+
+        return _zstd_compressor.compress(data)
+
+    return zlib.compress(data, 1)
+
+
+def _decompress(data: bytes, compression: bytes) -> bytes:
+    global _zstd_decompressor
+
+    if compression == COMPRESSION_ZSTD:
+        if _zstd_decompressor is None:
+            _zstd_decompressor = zstandard.ZstdDecompressor()
+
+        return _zstd_decompressor.decompress(data)
+    elif compression == COMPRESSION_ZLIB:
+        return zlib.decompress(data)
+
+    return data
+
+
+def dumps(data) -> bytes:
+    serializer_format = _format()
+    serialized_data = _serialize(data, serializer_format)
+
+    if len(serialized_data) < _settings["compress_min_size"]:
+        return serializer_format + COMPRESSION_NONE + serialized_data
+
+    compression = _compression()
+    return serializer_format + compression + _compress(serialized_data, compression)
+
+
+def loads(data: typing.Union[bytes, bytearray, memoryview, str]):
+    if isinstance(data, str):
+        data = data.encode("latin-1")
+
+    data = bytes(data)
+    return _deserialize(_decompress(data[2:], data[1:2]), data[0:1])
+
+
+def register_serializer():
+    register(SERIALIZER_NAME, dumps, loads, content_type=CONTENT_TYPE, content_encoding="binary")
+
+
+class SerializerPolicy:
+    """
+    Task annotation sending the tasks of the api queue with the tornium serializer.
+
+    Used as `celery_app.conf.task_annotations = (SerializerPolicy(),)`. Only enable the policy once every worker
+    accepts the tornium serializer as workers of earlier releases reject the messages of the serializer.
+    """
+
+    def __init__(self, queues: typing.Iterable[str] = ("api",)):
+        self.queues = frozenset(queues)
+
+    def annotate(self, task) -> typing.Optional[dict]:
+        if getattr(task, "queue", None) not in self.queues:
+            return None
+
+        return {"serializer": SERIALIZER_NAME}
+
+    def annotate_any(self) -> typing.Optional[dict]:
+        return None
@@ -13,18 +13,17 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import datetime
+import concurrent.futures
 import json
 import random
+import time
 import typing
 
-if globals().get("orjson:loaded"):
-    import orjson
-
 import celery
 import requests
+from celery.exceptions import Retry
 from celery.utils.log import get_task_logger
-from tornium_commons import Config, DBucket, rds
+from tornium_commons import Config, DBucket
 from tornium_commons.errors import (
     DiscordError,
     MissingKeyError,
@@ -34,9 +33,63 @@ from tornium_commons.errors import (
 )
 from tornium_commons.models import TornKey
 
+from ..utils import json_dumps, json_loads, setting
+from .cache import cache_entry, cache_get, cache_set, tornstats_cache_entry
+from .capture import capture_path, capture_response
+from .circuit import (
+    FAILURE_ERROR_CODES,
+    OUTCOME_FAILURE,
+    OUTCOME_RELEASE,
+    OUTCOME_SUCCESS,
+    OUTCOME_TRIP,
+    TRIP_ERROR_CODES,
+    CircuitOpenError,
+    torn_circuit_allow,
+    torn_circuit_record,
+)
+from .claims import store_payload
+from .coalesce import join_flight, land_flight, wait_for_flight
+from .keys import (
+    key_health_key,
+    mark_key_unavailable,
+    mark_key_unhealthy,
+    restore_key_health,
+)
+from .merge import (
+    add_to_merge,
+    extend_merge,
+    finish_merge,
+    mergeable,
+    merged_call,
+    pending_entries,
+    slice_response,
+)
+from .projection import project
+from .ratelimit import (
+    discord_global_block,
+    discord_global_ratelimit,
+    discord_route_reset,
+    discord_route_reset_after,
+    record_discord_retry,
+    torn_ratelimit,
+    tornstats_ratelimit,
+)
+from .sessions import discord_session, torn_session, tornstats_session
+
 logger = get_task_logger("celery_app")
 config = Config.from_cache()
 
+TORNGET_TIME_LIMIT = 5  # Seconds
+TORNGET_TIMEOUT = 5  # Seconds
+
+# Header of task messages storing the number of times the task was sent back to its queue by `requeue`
+REQUEUES_HEADER = "tornium_requeues"
+
+
+def discord_api_uri() -> str:
+    # Can be pointed at a local stand-in of the Discord API (see tests/fakes)
+    return celery.current_app.conf.get("tornium_discord_api_uri", "https://discord.com/api/v10/")
+
 
 def backoff(self: celery.Task):
     if self.request.retries <= 1:
@@ -48,6 +101,79 @@ def countdown_wo():
     return random.randint(1, 3)
 
 
+def discord_countdown(
+    self: celery.Task,
+    method: str,
+    endpoint: str,
+    retry_after: typing.Optional[float] = None,
+    backoff_var: typing.Optional[bool] = True,
+) -> float:
+    """
+    Get the countdown before a ratelimited Discord API call should be retried.
+
+    Discord's Retry-After (from a 429) or the reset of the route's bucket (from the headers of the previous response)
+    are used when known with some jitter so that the retries of a burst don't all land at the same time. Otherwise, the
+    random backoff is used.
+    """
+
+    backoff_countdown = backoff(self) if backoff_var is None or backoff_var else countdown_wo()
+
+    if retry_after is None:
+        retry_after = discord_route_reset_after(method, endpoint)
+
+    if retry_after is None:
+        record_discord_retry(backoff_countdown, backoff_countdown, informed=False)
+        return backoff_countdown
+
+    countdown = retry_after + random.uniform(0.05, 0.25)
+    record_discord_retry(countdown, backoff_countdown, informed=True)
+    return countdown
+
+
+def _cached_response(content: typing.Union[str, bytes], claim_check: bool = False, projection=None):
+    response = json_loads(content)
+
+    if projection is not None:
+        return store_payload(project(response, projection)) if claim_check else project(response, projection)
+    elif claim_check:
+        return store_payload(response, content)
+
+    return response
+
+
+def requeue(self: celery.Task, countdown: float, exc: typing.Optional[Exception] = None):
+    """
+    Re-send the task to its queue to be run after `countdown` seconds without counting it as a retry.
+
+    This should be used when the task is waiting on a known ratelimit rather than on an error. When the task is
+    called directly instead of in a worker, the exception is raised instead. Once the task has been re-sent
+    `tornium_max_requeues` times, the task is retried instead so that the task fails once it runs out of retries
+    rather than being re-sent forever.
+    """
+
+    if exc is None:
+        exc = RatelimitError()
+
+    exc.retry_after = countdown
+
+    if self.request.called_directly or self.request.is_eager:
+        raise exc
+
+    # Headers of the message are set as attributes of the request by newer versions of Celery
+    requeues = int(
+        getattr(self.request, REQUEUES_HEADER, None) or (self.request.headers or {}).get(REQUEUES_HEADER) or 0
+    )
+
+    if requeues >= int(setting("tornium_max_requeues", 20)):
+        logger.warning(f"{self.name} :: requeued {requeues} times :: retrying instead")
+        raise self.retry(exc=exc, countdown=countdown)
+
+    self.signature_from_request(
+        self.request, countdown=countdown, headers={REQUEUES_HEADER: requeues + 1}
+    ).apply_async()
+    raise Retry(exc=exc, when=countdown)
+
+
 def discord_ratelimit_pre(
     self: celery.Task,
     method: typing.Literal["GET", "PATCH", "POST", "PUT", "DELETE"],
@@ -60,12 +186,12 @@ def discord_ratelimit_pre(
     try:
         bucket = DBucket.from_endpoint(method=method, endpoint=endpoint)
     except RatelimitError:
-        raise self.retry(countdown=backoff(self) if backoff_var else countdown_wo())
+        raise self.retry(countdown=discord_countdown(self, method, endpoint, backoff_var=backoff_var))
 
     try:
         bucket.call()
     except RatelimitError:
-        raise self.retry(countdown=backoff(self) if backoff_var else countdown_wo())
+        raise self.retry(countdown=discord_countdown(self, method, endpoint, backoff_var=backoff_var))
 
     logger.debug(f"{method}|{endpoint.split('?')[0]} :: {bucket._id} :: {bucket.remaining} / {bucket.limit}")
 
@@ -89,9 +215,11 @@ def handle_discord_error(e: DiscordError):
         except ValueError:
             return
 
+        session = discord_session()
+
         try:
-            webhook_data = requests.post(
-                f"https://discord.com/api/v10/channels/{channel_id}/webhooks",
+            webhook_data = session.post(
+                f"{discord_api_uri()}channels/{channel_id}/webhooks",
                 headers={"Authorization": f'Bot {config["bot_token"]}', "Content-Type": "application/json"},
                 data=json.dumps(
                     {
@@ -192,21 +320,28 @@ def handle_discord_error(e: DiscordError):
             payload["embeds"][0]["description"] += " The bot most likely is unable to write to this channel."
 
         try:
-            requests.post(
-                f"https://discord.com/api/v10/webhooks/{webhook_data['id']}/{webhook_data['token']}",
+            session.post(
+                f"{discord_api_uri()}webhooks/{webhook_data['id']}/{webhook_data['token']}",
                 headers={"Authorization": f'Bot {config["bot_token"]}', "Content-Type": "application/json"},
                 data=json.dumps(payload),
             )
-            requests.delete(
-                f"https://discord.com/api/v10/webhooks/{webhook_data['id']}",
+            session.delete(
+                f"{discord_api_uri()}webhooks/{webhook_data['id']}",
                 headers={"Authorization": f'Bot {config["bot_token"]}', "Content-Type": "application/json"},
             )
         except:  # noqa 722
             pass
 
 
-@celery.shared_task(name="tasks.api.tornget", time_limit=5, routing_key="api.tornget", queue="api")
+@celery.shared_task(
+    name="tasks.api.tornget",
+    bind=True,
+    time_limit=TORNGET_TIME_LIMIT,
+    routing_key="api.tornget",
+    queue="api",
+)
 def tornget(
+    self: celery.Task,
     endpoint,
     key,
     tots=0,
@@ -214,6 +349,12 @@ def tornget(
     stat="",
     session=None,
     pass_error=False,
+    cache=False,
+    coalesce=False,
+    priority_class=None,
+    claim_check=False,
+    projection=None,
+    capture_links=None,
 ):
     url = (
         f'{config.torn_api_uri}{endpoint}&key={key}&comment=Tornium{"" if fromts == 0 else f"&from={fromts}"}'
@@ -223,265 +364,368 @@ def tornget(
     if key is None or key == "":
         raise MissingKeyError
 
-    redis_client = rds()
-    redis_key = f"tornium:torn-ratelimit:{key}"
-    ttl = 60 - datetime.datetime.utcnow().second
+    started = time.monotonic()
 
-    redis_client.set(redis_key, 50, nx=True, ex=ttl)
+    # Responses are cached by endpoint and target instead of by key so that calls for the same data made with
+    # different keys share the cached response
+    response_cache = cache_entry(endpoint, key, tots, fromts, stat) if cache else None
 
-    try:
-        if int(redis_client.get(redis_key)) > 0:
-            redis_client.decrby(redis_key, 1)
-            redis_client.expire(redis_key, ttl, nx=True)
-        else:
-            if redis_client.ttl(redis_key) == -1:
-                redis_client.set(redis_key, 1, ex=ttl)
+    if response_cache is not None:
+        cached_response = cache_get(response_cache)
+
+        if cached_response is not None:
+            return _cached_response(cached_response, claim_check, projection)
 
-            raise RatelimitError
-    except TypeError:
-        redis_client.set(redis_key, 50, nx=True, ex=ttl)
+    # Identical calls made while a call is in flight wait for the response of the first call instead of performing
+    # the call themselves
+    flight = join_flight(endpoint, key, tots, fromts, stat) if coalesce else None
+
+    if flight is not None and flight.response is not None:
+        land_flight(flight)
+        return _cached_response(flight.response, claim_check, projection)
+    elif flight is not None and not flight.leader:
+        coalesced_response = wait_for_flight(flight)
+
+        if coalesced_response is not None:
+            return _cached_response(coalesced_response, claim_check, projection)
+
+    # Only set once the call has succeeded so that waiting calls will perform the call themselves if the call fails
+    response_content = None
+    # The outcome is only recorded in the circuit breaker once the call has been made
+    circuit = None
+    circuit_outcome = None
+    circuit_reason = ""
 
     try:
+        circuit = torn_circuit_allow(key_health_key(key))
+
+        if circuit.wait:
+            # A single call probes whether the Torn API has recovered before the other calls are made
+            requeue(self, max(circuit.retry_after, 0.1))
+        elif not circuit.allowed:
+            raise CircuitOpenError(code=503, url=url)
+
+        ratelimit = torn_ratelimit(key, priority_class=priority_class)
+
+        if not ratelimit.allowed:
+            # The call is sent back to the queue until the key's budget (or the share of the budget for the call's
+            # priority class) allows for the call instead of failing
+            requeue(self, max(ratelimit.retry_after, 0.1))
+
         if session is None:
-            request = requests.get(url, timeout=5)
+            session = torn_session()
+
+        # Calls waiting on a coalesced call have less time left before the task's hard time limit kills the worker
+        # process so the call's timeout is reduced to fail cleanly within the time limit
+        timeout = min(TORNGET_TIMEOUT, TORNGET_TIME_LIMIT - 0.5 - (time.monotonic() - started))
+
+        if timeout < 0.5:
+            raise NetworkingError(code=408, url=url)
+
+        circuit_outcome = OUTCOME_FAILURE
+
+        try:
+            request = session.get(url, timeout=timeout)
+        except requests.exceptions.Timeout:
+            circuit_reason = "timeout"
+            raise NetworkingError(code=408, url=url)
+
+        if request.status_code // 100 != 2:
+            circuit_reason = f"http-{request.status_code}"
+            raise NetworkingError(code=request.status_code, url=url)
+
+        content = request.content
+        request = json_loads(content)
+
+        if "error" in request:
+            if request["error"]["code"] in TRIP_ERROR_CODES:
+                circuit_outcome = OUTCOME_TRIP
+                circuit_reason = f"torn-error-{request['error']['code']}"
+            elif request["error"]["code"] in FAILURE_ERROR_CODES:
+                circuit_reason = f"torn-error-{request['error']['code']}"
+            else:
+                # Errors caused by the call itself (e.g. an incorrect ID) show that the Torn API is working
+                circuit_outcome = OUTCOME_SUCCESS
+
+            key_status = mark_key_unhealthy(key, request["error"]["code"])
+
+            if key_status == "invalid":
+                TornKey.delete().where(TornKey.api_key == key).execute()
+            elif key_status is not None:
+                # Jailed, inactive, and paused keys are kept and restored once a call with the key succeeds (see
+                # check_api_keys for the probes of these keys)
+                TornKey.update(paused=True).where(TornKey.api_key == key).execute()
+            elif request["error"]["code"] == 5:  # Too many requests
+                # The key's budget has been used outside of Tornium so the key is skipped until the ratelimit resets
+                mark_key_unavailable(key)
+
+            if not pass_error:
+                raise TornError(code=request["error"]["code"], endpoint=url)
         else:
-            request = session.get(url, timeout=5)
-    except requests.exceptions.Timeout:
-        raise NetworkingError(code=408, url=url)
+            circuit_outcome = OUTCOME_SUCCESS
+            response_content = content
 
-    if request.status_code // 100 != 2:
-        raise NetworkingError(code=request.status_code, url=url)
+            # Only keys known to be unhealthy are restored to avoid a round trip to Redis for every call
+            if circuit.key_unhealthy and restore_key_health(key):
+                TornKey.update(paused=False).where(TornKey.api_key == key).execute()
+
+            if response_cache is not None:
+                cache_set(response_cache, response_content)
 
-    if globals().get("orjson:loaded"):
-        request = orjson.loads(request.content)
-    else:
-        request = request.json()
-
-    if "error" in request:
-        if request["error"]["code"] in (
-            2,  # Incorrect key
-            10,  # Key owner is in federal jail
-            13,  # Key disabled due to owner inactivity
-            18,  # API key paused by owner
-        ):
-            # TODO: Add proper support for pausing API key with restoring when the key has been unpaused
-            #
-            # Delete the API key
-            # WIth these errors, it'll hurt more to keep the API key rather than removing it and letting the person sign in later
-            TornKey.delete().where(TornKey.api_key == key).execute()
-
-        if not pass_error:
-            raise TornError(code=request["error"]["code"], endpoint=url)
+            # Calls made by tornget_many and tornget_merged aren't linked to their handlers so the handlers are passed
+            # as `capture_links`
+            capture_response(endpoint, content, self.request.callbacks if capture_links is None else capture_links)
+    finally:
+        if circuit is not None and circuit.allowed and (circuit_outcome is not None or circuit.probe is not None):
+            torn_circuit_record(circuit_outcome or OUTCOME_RELEASE, circuit.probe, circuit_reason)
+
+        if flight is not None:
+            land_flight(flight, response_content)
+
+    if projection is not None:
+        # Only the fields used by the linked tasks are passed to the linked tasks
+        request = project(request, projection)
+
+        if claim_check:
+            return store_payload(request)
+    elif claim_check:
+        # Large responses are passed to the linked tasks as a claim to the response stored in Redis
+        return store_payload(request, content)
 
     return request
 
 
+def _tornget_call(call: typing.Union[dict, list, tuple]) -> dict:
+    # Calls can either be an (endpoint, key) pair or the kwargs of tornget with optional kwargs for the handler
+    if isinstance(call, dict):
+        return dict(call)
+
+    return {"endpoint": call[0], "key": call[1]}
+
+
 @celery.shared_task(
-    name="tasks.api.discordget",
+    name="tasks.api.tornget_many",
     bind=True,
-    max_retries=5,
-    routing_key="api.discordget",
+    time_limit=60,
+    routing_key="api.tornget_many",
     queue="api",
-    time_limit=10,
+    ignore_result=True,
 )
-def discordget(self: celery.Task, endpoint, *args, **kwargs):
-    url = f"https://discord.com/api/v10/{endpoint}"
-    headers = {"Authorization": f'Bot {config["bot_token"]}'}
+def tornget_many(self: celery.Task, calls: list, handler=None, batch_handler=None):
+    """
+    Perform many Torn API calls concurrently within one task.
 
-    bucket = discord_ratelimit_pre(self, "GET", endpoint, backoff_var=kwargs.get("backoff", True))
-    request = requests.get(url, headers=headers)
-    bucket.update_bucket(request.headers, "GET", endpoint)
+    Each successful response is passed to `handler` (with the call's `handler_kwargs`) as if `handler` had been linked
+    to a tornget task and/or to `batch_handler` as a list of `[handler_kwargs, response]` pairs. Failed calls are
+    logged and skipped in the same way as a failed tornget task wouldn't call its link. Calls held back by the
+    ratelimiter are re-sent in another batch once the ratelimit has reset.
+    """
 
-    if request.status_code == 429:
-        raise self.retry(
-            countdown=backoff(self) if kwargs.get("backoff", True) else countdown_wo(),
-            exc=RatelimitError(),
-        )
+    if len(calls) == 0:
+        return
 
-    try:
-        if globals().get("orjson:loaded"):
-            request_json = orjson.loads(request.content)
-        else:
-            request_json = request.json()
-    except Exception as e:
-        if request.status_code // 100 != 2:
-            raise NetworkingError(code=request.status_code, url=url)
-        elif request.status_code == 204:
-            return
-        else:
-            raise e
+    calls = [_tornget_call(call) for call in calls]
+    concurrency = max(min(int(celery.current_app.conf.get("tornium_tornget_many_concurrency", 10)), len(calls)), 1)
 
-    if "code" in request_json:
-        # See https://discord.com/developers/docs/topics/opcodes-and-status-codes#json for a full list of error codes
-        # explanations
+    responses = []
+    ratelimited_calls = []
+    retry_after = 0.0
 
-        if request_json["code"] == 0:
-            logger.info(request_json)
+    def perform_call(call: dict):
+        call_kwargs = {name: value for name, value in call.items() if name not in ("handler_kwargs", "merge_target")}
 
-        error = DiscordError(code=request_json["code"], message=request_json["message"], url=endpoint)
-        handle_discord_error(error)
-        raise error
-    elif request.status_code // 100 != 2:
-        raise NetworkingError(code=request.status_code, url=url)
+        if handler is not None and capture_path() is not None:
+            call_kwargs["capture_links"] = [celery.signature(handler).clone(kwargs=call.get("handler_kwargs", {}))]
 
-    return request_json
+        return tornget(**call_kwargs)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = [(call, executor.submit(perform_call, call)) for call in calls]
+
+        for call, future in futures:
+            try:
+                response = future.result()
+            except RatelimitError as e:
+                ratelimited_calls.append(call)
+                retry_after = max(retry_after, getattr(e, "retry_after", 1) or 1)
+                continue
+            except (TornError, NetworkingError, MissingKeyError) as e:
+                logger.info(f"tornget_many :: {call['endpoint']} :: {e!r}")
+                continue
+            except Exception:
+                logger.exception(f"tornget_many :: {call['endpoint']} :: unexpected error")
+                continue
+
+            responses.append([call.get("handler_kwargs", {}), response])
+
+            if handler is not None:
+                celery.signature(handler).clone(args=(response,), kwargs=call.get("handler_kwargs", {})).apply_async()
+
+    if batch_handler is not None and len(responses) != 0:
+        celery.signature(batch_handler).clone(args=(responses,)).apply_async()
+
+    if len(ratelimited_calls) != 0:
+        tornget_many.signature(
+            kwargs={"calls": ratelimited_calls, "handler": handler, "batch_handler": batch_handler},
+        ).apply_async(countdown=retry_after, expires=300)
 
 
 @celery.shared_task(
-    name="tasks.api.discordpatch",
+    name="tasks.api.tornget_merged",
     bind=True,
-    max_retries=5,
-    routing_key="api.discordpatch",
-    queue="api",
     time_limit=10,
+    routing_key="api.tornget_merged",
+    queue="api",
+    ignore_result=True,
 )
-def discordpatch(self, endpoint, payload, *args, **kwargs):
-    url = f"https://discord.com/api/v10/{endpoint}"
-    headers = {
-        "Authorization": f'Bot {config["bot_token"]}',
-        "Content-Type": "application/json",
-    }
+def tornget_merged(self: celery.Task, group: str):
+    """
+    Perform the pending calls of a merge group as a single Torn API call.
 
-    bucket = discord_ratelimit_pre(self, "PATCH", endpoint, backoff_var=kwargs.get("backoff", True))
+    The response is sliced by the selections of each call and passed to each call's handler (with the call's
+    `handler_kwargs`). Calls added to the group while the call is made are flushed by another task.
+    """
 
-    if globals().get("orjson:loaded"):
-        payload = orjson.dumps(payload)
-    else:
-        payload = json.dumps(payload)
+    entries = pending_entries(group)
 
-    request = requests.patch(url, headers=headers, data=payload)
-    bucket.update_bucket(request.headers, "PATCH", endpoint)
+    if len(entries) == 0:
+        finish_merge(group, 0)
+        return
 
-    if request.status_code == 429:
-        raise self.retry(
-            countdown=backoff(self) if kwargs.get("backoff", True) else countdown_wo(),
-            exc=RatelimitError(),
-        )
+    call = merged_call(entries)
+
+    if capture_path() is not None:
+        call["capture_links"] = [
+            celery.signature(entry["handler"]).clone(kwargs=entry["handler_kwargs"]) for entry in entries
+        ]
 
     try:
-        if globals().get("orjson:loaded"):
-            request_json = orjson.loads(request.content)
-        else:
-            request_json = request.json()
-    except Exception as e:
-        if request.status_code // 100 != 2:
-            raise NetworkingError(code=request.status_code, url=url)
-        elif request.status_code == 204:
-            return
-        else:
-            raise e
+        response = tornget(**call)
+    except RatelimitError as e:
+        # The entries are kept so that calls added to the group in the meantime are merged into the deferred call
+        retry_after = max(getattr(e, "retry_after", 1) or 1, 0.1)
+        extend_merge(group, retry_after)
+        requeue(self, retry_after)
+    except (TornError, NetworkingError, MissingKeyError) as e:
+        logger.info(f"tornget_merged :: {call['endpoint']} :: {e!r}")
+        response = None
+
+    if finish_merge(group, len(entries)) != 0:
+        tornget_merged.signature(kwargs={"group": group}).apply_async(
+            countdown=float(celery.current_app.conf.get("tornium_torn_merge_window", 1.5))
+        )
 
-    if "code" in request_json:
-        # See https://discord.com/developers/docs/topics/opcodes-and-status-codes#json for a full list of error codes
-        # explanations
+    if response is None:
+        return
 
-        if request_json["code"] == 0:
-            logger.info(request_json)
+    for entry in entries:
+        entry_response = slice_response(response, entry, call["endpoint"])
 
-        error = DiscordError(code=request_json["code"], message=request_json["message"], url=endpoint)
-        handle_discord_error(error)
-        raise error
-    elif request.status_code // 100 != 2:
-        raise NetworkingError(code=request.status_code, url=url)
+        if entry["projection"] is not None:
+            entry_response = project(entry_response, tuple(entry["projection"]))
 
-    return request_json
+        if entry["claim_check"]:
+            entry_response = store_payload(entry_response)
 
+        celery.signature(entry["handler"]).clone(args=(entry_response,), kwargs=entry["handler_kwargs"]).apply_async()
 
-@celery.shared_task(
-    name="tasks.api.discordpost",
-    bind=True,
-    max_retries=5,
-    routing_key="api.discordpost",
-    queue="api",
-    time_limit=10,
-)
-def discordpost(self, endpoint, payload, *args, **kwargs):
-    url = f"https://discord.com/api/v10/{endpoint}"
-    headers = {
-        "Authorization": f'Bot {config["bot_token"]}',
-        "Content-Type": "application/json",
-    }
 
-    bucket = discord_ratelimit_pre(self, "POST", endpoint, backoff_var=kwargs.get("backoff", True))
+def enqueue_tornget_many(calls: typing.Iterable, handler=None, batch_handler=None, merge=False, **options):
+    """
+    Split calls into tornget_many tasks of up to `tornium_tornget_many_batch_size` calls each.
 
-    if globals().get("orjson:loaded"):
-        payload = orjson.dumps(payload)
-    else:
-        payload = json.dumps(payload)
+    When `merge` is set, calls to the same target are held for `tornium_torn_merge_window` seconds to be merged with
+    other calls to the target (see `tasks.merge`) with the response passed to `handler`. Merged calls ignore `options`.
+    """
 
-    request = requests.post(url, headers=headers, data=payload)
-    bucket.update_bucket(request.headers, "POST", endpoint)
+    batch_size = max(int(celery.current_app.conf.get("tornium_tornget_many_batch_size", 50)), 1)
+    batch = []
 
-    if request.status_code == 429:
-        raise self.retry(
-            countdown=backoff(self) if kwargs.get("backoff", True) else countdown_wo(),
-            exc=RatelimitError(),
+    if merge and handler is not None and batch_handler is None:
+        calls = [_tornget_call(call) for call in calls]
+        merged_calls = [call for call in calls if mergeable(call)]
+        calls = [call for call in calls if not mergeable(call)]
+
+        for group in add_to_merge(merged_calls, handler):
+            tornget_merged.signature(kwargs={"group": group}).apply_async(
+                countdown=float(celery.current_app.conf.get("tornium_torn_merge_window", 1.5))
+            )
+
+    for call in calls:
+        batch.append(call)
+
+        if len(batch) >= batch_size:
+            tornget_many.signature(
+                kwargs={"calls": batch, "handler": handler, "batch_handler": batch_handler}
+            ).apply_async(**options)
+            batch = []
+
+    if len(batch) != 0:
+        tornget_many.signature(kwargs={"calls": batch, "handler": handler, "batch_handler": batch_handler}).apply_async(
+            **options
         )
 
-    try:
-        if globals().get("orjson:loaded"):
-            request_json = orjson.loads(request.content)
-        else:
-            request_json = request.json()
-    except Exception as e:
-        if request.status_code // 100 != 2:
-            raise NetworkingError(code=request.status_code, url=url)
-        elif request.status_code == 204:
-            return
-        else:
-            raise e
 
-    if "code" in request_json:
-        # See https://discord.com/developers/docs/topics/opcodes-and-status-codes#json for a full list of error codes
-        # explanations
+def discord_request(
+    self: celery.Task,
+    method: typing.Literal["GET", "PATCH", "POST", "PUT", "DELETE"],
+    endpoint: str,
+    payload=None,
+    backoff_var: typing.Optional[bool] = True,
+):
+    """
+    Perform a call against the Discord API with the ratelimit bucket of the method and endpoint.
 
-        if request_json["code"] == 0:
-            logger.info(request_json)
+    This is shared by all of the Discord API tasks so that every call is serialized, ratelimited, and parsed the
+    same way.
+    """
 
-        error = DiscordError(code=request_json["code"], message=request_json["message"], url=endpoint)
-        handle_discord_error(error)
-        raise error
-    elif request.status_code // 100 != 2:
-        raise NetworkingError(code=request.status_code, url=url)
+    if backoff_var is None:
+        backoff_var = True
 
-    return request_json
+    url = f"{discord_api_uri()}{endpoint}"
+    headers = {"Authorization": f'Bot {config["bot_token"]}'}
 
+    if payload is not None:
+        headers["Content-Type"] = "application/json"
 
-@celery.shared_task(
-    name="tasks.api.discordput",
-    bind=True,
-    max_retries=5,
-    routing_key="api.discordput",
-    queue="api",
-)
-def discordput(self, endpoint, payload, *args, **kwargs):
-    url = f"https://discord.com/api/v10/{endpoint}"
-    headers = {
-        "Authorization": f'Bot {config["bot_token"]}',
-        "Content-Type": "application/json",
-    }
+        payload = json_dumps(payload)
 
-    bucket = discord_ratelimit_pre(self, "PUT", endpoint, backoff_var=kwargs.get("backoff", True))
+    # The global ratelimit is checked before the bucket so that a call held back by the global ratelimit doesn't use
+    # up the bucket's calls
+    global_ratelimit = discord_global_ratelimit()
 
-    if globals().get("orjson:loaded"):
-        payload = orjson.dumps(payload)
-    else:
-        payload = json.dumps(payload)
+    if not global_ratelimit.allowed:
+        requeue(self, max(global_ratelimit.retry_after, 0.05))
 
-    request = requests.put(url, headers=headers, data=payload)
-    bucket.update_bucket(request.headers, "PUT", endpoint)
+    bucket = discord_ratelimit_pre(self, method, endpoint, backoff_var=backoff_var)
+    request = discord_session().request(method, url, headers=headers, data=payload)
+    bucket.update_bucket(request.headers, method, endpoint)
+    discord_route_reset(method, endpoint, request.headers)
+
+    if request.status_code == 429 and request.headers.get("X-RateLimit-Global", "").lower() == "true":
+        try:
+            retry_after = float(request.headers.get("Retry-After", 1))
+        except ValueError:
+            retry_after = 1
+
+        # Every worker is held back until Discord's global ratelimit has reset
+        discord_global_block(retry_after)
+        requeue(self, retry_after)
+    elif request.status_code == 429:
+        # Discord provides the exact seconds until the call can be retried in the body of the response
+        try:
+            retry_after = float(json_loads(request.content)["retry_after"])
+        except Exception:
+            retry_after = None
 
-    if request.status_code == 429:
         raise self.retry(
-            countdown=backoff(self) if kwargs.get("backoff", True) else countdown_wo(),
+            countdown=discord_countdown(self, method, endpoint, retry_after=retry_after, backoff_var=backoff_var),
             exc=RatelimitError(),
         )
 
     try:
-        if globals().get("orjson:loaded"):
-            request_json = orjson.loads(request.content)
-        else:
-            request_json = request.json()
+        request_json = json_loads(request.content)
     except Exception as e:
         if request.status_code // 100 != 2:
             raise NetworkingError(code=request.status_code, url=url)
@@ -507,95 +751,108 @@ def discordput(self, endpoint, payload, *args, **kwargs):
 
 
 @celery.shared_task(
-    name="tasks.api.discorddelete",
+    name="tasks.api.discordget",
     bind=True,
     max_retries=5,
-    routing_key="api.discorddelete",
+    routing_key="api.discordget",
     queue="api",
-    time_limit=5,
+    time_limit=10,
 )
-def discorddelete(self, endpoint, *args, **kwargs):
-    url = f"https://discord.com/api/v10/{endpoint}"
-    headers = {
-        "Authorization": f'Bot {config["bot_token"]}',
-        "Content-Type": "application/json",
-    }
+def discordget(self: celery.Task, endpoint, *args, **kwargs):
+    return discord_request(self, "GET", endpoint, backoff_var=kwargs.get("backoff", True))
 
-    bucket = discord_ratelimit_pre(self, "GET", endpoint, backoff_var=kwargs.get("backoff", True))
-    request = requests.delete(url, headers=headers)
-    bucket.update_bucket(request.headers, "DELETE", endpoint)
 
-    if request.status_code == 429:
-        raise self.retry(
-            countdown=backoff(self) if kwargs.get("backoff", True) else countdown_wo(),
-            exc=RatelimitError(),
-        )
+@celery.shared_task(
+    name="tasks.api.discordpatch",
+    bind=True,
+    max_retries=5,
+    routing_key="api.discordpatch",
+    queue="api",
+    time_limit=10,
+)
+def discordpatch(self, endpoint, payload, *args, **kwargs):
+    return discord_request(self, "PATCH", endpoint, payload, backoff_var=kwargs.get("backoff", True))
 
-    try:
-        if globals().get("orjson:loaded"):
-            request_json = orjson.loads(request.content)
-        else:
-            request_json = request.json()
-    except Exception as e:
-        if request.status_code // 100 != 2:
-            raise NetworkingError(code=request.status_code, url=url)
-        elif request.status_code == 204:
-            return
-        else:
-            raise e
 
-    if "code" in request_json:
-        # See https://discord.com/developers/docs/topics/opcodes-and-status-codes#json for a full list of error codes
-        # explanations
+@celery.shared_task(
+    name="tasks.api.discordpost",
+    bind=True,
+    max_retries=5,
+    routing_key="api.discordpost",
+    queue="api",
+    time_limit=10,
+)
+def discordpost(self, endpoint, payload, *args, **kwargs):
+    return discord_request(self, "POST", endpoint, payload, backoff_var=kwargs.get("backoff", True))
 
-        if request_json["code"] == 0:
-            logger.info(request_json)
 
-        error = DiscordError(code=request_json["code"], message=request_json["message"], url=endpoint)
-        handle_discord_error(error)
-        raise error
-    elif request.status_code // 100 != 2:
-        raise NetworkingError(code=request.status_code, url=url)
+@celery.shared_task(
+    name="tasks.api.discordput",
+    bind=True,
+    max_retries=5,
+    routing_key="api.discordput",
+    queue="api",
+    time_limit=10,
+)
+def discordput(self, endpoint, payload, *args, **kwargs):
+    return discord_request(self, "PUT", endpoint, payload, backoff_var=kwargs.get("backoff", True))
 
-    return request_json
+
+@celery.shared_task(
+    name="tasks.api.discorddelete",
+    bind=True,
+    max_retries=5,
+    routing_key="api.discorddelete",
+    queue="api",
+    time_limit=5,
+)
+def discorddelete(self, endpoint, *args, **kwargs):
+    return discord_request(self, "DELETE", endpoint, backoff_var=kwargs.get("backoff", True))
 
 
 @celery.shared_task(
     name="tasks.api.torn_stats_get",
+    bind=True,
     time_limit=15,
     routing_key="api.torn_stats_get",
     queue="api",
 )
-def torn_stats_get(endpoint, key, session=None):
+def torn_stats_get(self: celery.Task, endpoint, key, session=None, cache=False):
     url = f"https://www.tornstats.com/api/v2/{key}/{endpoint}"
-    redis_key = f"tornium:ts-ratelimit:{key}"
-    redis_client = rds()
 
-    redis_client.set(redis_key, 15, nx=True, ex=60 - datetime.datetime.utcnow().second)
+    # Spies of a faction are cached for `tornium_tornstats_cache_ttl` seconds
+    response_cache = (
+        tornstats_cache_entry(endpoint, key, int(celery.current_app.conf.get("tornium_tornstats_cache_ttl", 5400)))
+        if cache
+        else None
+    )
+
+    if response_cache is not None:
+        cached_response = cache_get(response_cache)
+
+        if cached_response is not None:
+            return json_loads(cached_response)
 
-    if redis_client.ttl(redis_key) < 1:
-        redis_client.expire(redis_key, 1)
-        redis_client.set(redis_key, 50, nx=True, ex=60 - datetime.datetime.utcnow().second)
+    ratelimit = tornstats_ratelimit(key)
 
-    if int(redis_client.get(redis_key)) > 0:
-        redis_client.decrby(redis_key, 1)
-    else:
-        raise RatelimitError
+    if not ratelimit.allowed:
+        requeue(self, max(ratelimit.retry_after, 0.1))
+
+    if session is None:
+        session = tornstats_session()
 
     try:
-        if session is None:
-            request = requests.get(url, timeout=15)
-        else:
-            request = session.get(url, timeout=15)
+        request = session.get(url, timeout=15)
     except requests.exceptions.Timeout:
         raise NetworkingError(code=408, url=url)
 
     if request.status_code // 100 != 2:
         raise NetworkingError(code=request.status_code, url=url)
 
-    if globals().get("orjson:loaded"):
-        request = orjson.loads(request.content)
-    else:
-        request = request.json()
+    content = request.content
+    request = json_loads(content)
+
+    if response_cache is not None and request.get("status"):
+        cache_set(response_cache, content)
 
     return request
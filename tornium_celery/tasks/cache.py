@@ -0,0 +1,160 @@
+# Copyright (C) 2021-2023 tiksan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import typing
+import urllib.parse
+
+from tornium_commons import rds
+
+from .ratelimit import _script
+
+# Seconds that the response of a selection can be re-used for
+# Selections not listed here are never cached (e.g. attacks, crimes, and fundsnews where stale data would result in
+# missed notifications)
+SELECTION_TTLS = {
+    "": 15,  # Default selection (e.g. user/?selections=)
+    "basic": 60,
+    "profile": 60,
+    "discord": 3600,
+    "personalstats": 3600,
+    "positions": 600,
+    "contributors": 300,
+    "stocks": 30,
+    "itemmarket": 30,
+    "bazaar": 30,
+    "items": 3600,
+    "info": 300,
+}
+
+# Resources where an empty target refers to the owner of the API key (or the faction of the owner)
+KEY_SCOPED_RESOURCES = ("user", "faction", "property", "company", "key")
+
+
+# KEYS[1]: cached response
+# KEYS[2]: hash of the cache's metrics
+# ARGV[1]: resource of the cached response
+#
+# Returns the cached response (or nil) after counting the lookup and, if nothing is cached, the miss
+_CACHE_GET_SCRIPT = """
+local cached_response = redis.call("GET", KEYS[1])
+redis.call("HINCRBY", KEYS[2], ARGV[1] .. ":lookup", 1)
+
+if not cached_response then
+    redis.call("HINCRBY", KEYS[2], ARGV[1] .. ":miss", 1)
+end
+
+return cached_response
+"""
+
+
+class CacheEntry(typing.NamedTuple):
+    redis_key: str
+    resource: str
+    ttl: int
+
+
+def normalize_endpoint(endpoint: str, key: str, tots=0, fromts=0, stat="") -> typing.Tuple[str, str, tuple, tuple]:
+    """
+    Normalize a Torn API endpoint into its resource, target, sorted selections, and sorted extra parameters so that
+    equivalent calls (e.g. `faction/?selections=positions,basic` and `faction/?selections=basic,positions` made with
+    two keys of the same faction) are treated as the same call.
+    """
+
+    path, _, query = endpoint.partition("?")
+    resource, _, target = path.strip("/").partition("/")
+
+    params = urllib.parse.parse_qsl(query, keep_blank_values=True)
+    selections = tuple(
+        sorted(
+            set(selection.strip() for name, value in params if name == "selections" for selection in value.split(","))
+        )
+    )
+    extra_params = [(name, value) for name, value in params if name != "selections"]
+
+    if fromts != 0:
+        extra_params.append(("from", str(fromts)))
+    if tots != 0:
+        extra_params.append(("to", str(tots)))
+    if stat != "":
+        extra_params.append(("stat", stat))
+
+    if target == "" and resource in KEY_SCOPED_RESOURCES:
+        # The response depends upon the owner of the key so the key has to be part of the target
+        target = "key-" + hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+    return resource, target, selections or ("",), tuple(sorted(extra_params))
+
+
+def cache_entry(endpoint: str, key: str, tots=0, fromts=0, stat="") -> typing.Optional[CacheEntry]:
+    resource, target, selections, extra_params = normalize_endpoint(endpoint, key, tots, fromts, stat)
+
+    try:
+        ttl = min(SELECTION_TTLS[selection] for selection in selections)
+    except KeyError:
+        return None
+
+    if ttl <= 0:
+        return None
+
+    redis_key = f"tornium:torn-cache:{resource}:{target}:{','.join(selections)}"
+
+    if len(extra_params) != 0:
+        redis_key += ":" + urllib.parse.urlencode(extra_params)
+
+    return CacheEntry(redis_key=redis_key, resource=resource, ttl=ttl)
+
+
+def tornstats_cache_entry(endpoint: str, key: str, ttl: int) -> CacheEntry:
+    # Spies shown by TornStats depend upon the spies shared with the key's owner, so responses are only shared between
+    # calls made with the same key
+    endpoint = endpoint.strip("/")
+    key_hash = hashlib.sha256(key.encode("utf-8")).hexdigest()[:16]
+
+    return CacheEntry(
+        redis_key=f"tornium:tornstats-cache:{endpoint}:key-{key_hash}",
+        resource="tornstats",
+        ttl=ttl,
+    )
+
+
+def cache_get(entry: CacheEntry) -> typing.Optional[typing.Union[str, bytes]]:
+    # Misses are counted in the lookup so that calls failing upstream (which are never stored) aren't counted as hits
+    redis_client = rds()
+    return _script(redis_client, _CACHE_GET_SCRIPT)(
+        keys=[entry.redis_key, "tornium:torn-cache:metrics"],
+        args=[entry.resource],
+        client=redis_client,
+    )
+
+
+def cache_set(entry: CacheEntry, response: typing.Union[str, bytes]):
+    rds().set(entry.redis_key, response, ex=entry.ttl)
+
+
+def cache_metrics() -> typing.Dict[str, typing.Dict[str, int]]:
+    metrics: typing.Dict[str, typing.Dict[str, int]] = {}
+
+    for field, value in rds().hgetall("tornium:torn-cache:metrics").items():
+        if isinstance(field, bytes):
+            field = field.decode("utf-8")
+
+        resource, _, counter = field.rpartition(":")
+        metrics.setdefault(resource, {"lookup": 0, "miss": 0})[counter] = int(value)
+
+    for resource_metrics in metrics.values():
+        resource_metrics["hit"] = max(resource_metrics["lookup"] - resource_metrics["miss"], 0)
+
+    return metrics
@@ -0,0 +1,163 @@
+# Copyright (C) 2021-2023 tiksan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import gzip
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import typing
+import zlib
+
+import celery
+from celery.utils.log import get_task_logger
+
+logger = get_task_logger("celery_app")
+
+_capture_lock = threading.Lock()
+
+# Arguments of the linked tasks holding API keys which are replaced with a pseudonym of the key in captures
+KEY_ARGUMENTS = ("key", "api_key", "keys", "admin_keys")
+KEY_PSEUDONYM_PREFIX = "captured-key-"
+# Torn's API keys are 16 alphanumeric characters, so keys passed positionally or under any other name are redacted too
+KEY_PATTERN = re.compile(r"[A-Za-z0-9]{16}")
+
+
+class CapturedResponse(typing.NamedTuple):
+    endpoint: str
+    timestamp: float
+    links: typing.List[dict]
+    content: bytes
+
+
+def capture_path() -> typing.Optional[str]:
+    path = celery.current_app.conf.get("tornium_torn_capture_path", None)
+
+    if path in (None, ""):
+        return None
+
+    # Every worker process appends to its own file
+    return str(path).format(pid=os.getpid())
+
+
+def key_pseudonym(key):
+    # The pseudonym of a key is stable so that calls made with the same key are still made with the same key when
+    # replayed
+    if not isinstance(key, str) or key == "":
+        return key
+
+    return KEY_PSEUDONYM_PREFIX + hashlib.sha256(key.encode("utf-8")).hexdigest()[:12]
+
+
+def redact_keys(value):
+    """
+    Replace the API keys in the arguments of signatures (including nested signatures and handler args and kwargs)
+    with the pseudonyms of the keys.
+
+    Besides the values of `KEY_ARGUMENTS`, every key-shaped string is replaced wherever it's found.
+    """
+
+    if isinstance(value, dict):
+        redacted = {}
+
+        for name, item in value.items():
+            if name not in KEY_ARGUMENTS:
+                redacted[name] = redact_keys(item)
+            elif isinstance(item, (list, tuple)):
+                redacted[name] = [key_pseudonym(key) for key in item]
+            else:
+                redacted[name] = key_pseudonym(item)
+
+        return redacted
+    elif isinstance(value, (list, tuple)):
+        return [redact_keys(item) for item in value]
+    elif isinstance(value, str) and KEY_PATTERN.fullmatch(value) is not None:
+        return key_pseudonym(value)
+
+    return value
+
+
+def fake_keys(value):
+    """
+    Replace the pseudonyms of API keys in captured signatures with fake API keys (see tests/fakes/torn.py).
+    """
+
+    if isinstance(value, dict):
+        return {name: fake_keys(item) for name, item in value.items()}
+    elif isinstance(value, (list, tuple)):
+        return [fake_keys(item) for item in value]
+    elif isinstance(value, str) and value.startswith(KEY_PSEUDONYM_PREFIX):
+        # Fake keys are 16 characters long like Torn's API keys
+        return "fake" + value[len(KEY_PSEUDONYM_PREFIX) :]
+
+    return value
+
+
+def capture_response(endpoint: str, content: bytes, links: typing.Optional[typing.Iterable[dict]] = None):
+    """
+    Append a response of the Torn API to the capture file of the worker process when capturing is enabled.
+
+    Every record is a separate gzip member so that records can be appended without re-compressing the file and the
+    records written before a crash can still be read. A record is a JSON header (the endpoint, the time of the response,
+    the signatures of the tasks linked to the call, and the size of the response) followed by a newline, the response as
+    returned by the Torn API, and a newline. The API key isn't part of the endpoint and the API keys passed to the
+    linked tasks are replaced with pseudonyms (see `redact_keys`), so no API key is recorded.
+    """
+
+    path = capture_path()
+
+    if path is None:
+        return
+
+    header = json.dumps(
+        {"endpoint": endpoint, "timestamp": time.time(), "links": redact_keys(list(links or [])), "size": len(content)},
+        separators=(",", ":"),
+        default=str,
+    )
+    record = gzip.compress(header.encode("utf-8") + b"\n" + content + b"\n")
+
+    try:
+        with _capture_lock, open(path, "ab") as capture_file:
+            capture_file.write(record)
+    except OSError as e:
+        logger.warning(f"Failed to capture the response of {endpoint} to {path}: {e!r}")
+
+
+def read_capture(path: str) -> typing.Iterator[CapturedResponse]:
+    """
+    Read the responses captured to a file by `capture_response`. A record cut off by a crash ends the capture.
+    """
+
+    with gzip.open(path, "rb") as capture_file:
+        while True:
+            try:
+                header = capture_file.readline()
+
+                if header == b"":
+                    return
+
+                header = json.loads(header)
+                content = capture_file.read(header["size"])
+                capture_file.read(1)
+            except (EOFError, zlib.error, ValueError):
+                logger.warning(f"Capture {path} ends with an incomplete record")
+                return
+
+            if len(content) != header["size"]:
+                return
+
+            yield CapturedResponse(header["endpoint"], header["timestamp"], header["links"], content)
@@ -0,0 +1,325 @@
+# Copyright (C) 2021-2023 tiksan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import time
+import typing
+import uuid
+
+from celery.utils.log import get_task_logger
+from tornium_commons import rds
+from tornium_commons.errors import NetworkingError
+
+from ..utils import setting
+from .ratelimit import _script
+
+logger = get_task_logger("celery_app")
+
+# Circuit breaker shared by every worker for calls to the Torn API
+# - closed :: calls are made
+# - open :: calls fail immediately until the cooldown has passed
+# - half-open :: a single probe call is made once the cooldown has passed; the circuit is closed if the probe succeeds
+#   and re-opened with twice the cooldown if the probe fails
+CIRCUIT_KEY = "tornium:torn-circuit"
+CIRCUIT_PROBE_KEY = "tornium:torn-circuit:probe"
+CIRCUIT_METRICS_KEY = "tornium:torn-circuit:metrics"
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half-open"
+
+# Outcomes of Torn API calls
+OUTCOME_SUCCESS = "success"
+OUTCOME_FAILURE = "failure"  # Counted towards the error rate (e.g. timeouts and 5xx responses)
+OUTCOME_TRIP = "trip"  # Opens the circuit immediately (e.g. Torn's API is disabled)
+OUTCOME_RELEASE = "release"  # The call was not made (e.g. deferred by the ratelimiter)
+
+# Torn API errors that open the circuit immediately as every call would fail
+TRIP_ERROR_CODES = (
+    8,  # IP block
+    9,  # API disabled
+)
+
+# Torn API errors counted towards the error rate; a single key making too many requests isn't an outage but many keys
+# making too many requests is
+FAILURE_ERROR_CODES = (5,)  # Too many requests
+
+# KEYS[1]: hash storing the state of the circuit
+# KEYS[2]: key storing the token of the in-flight probe
+# KEYS[3]: (optional) key storing the health of the call's API key (see tasks.keys)
+# ARGV[1]: token of the call
+# ARGV[2]: milliseconds until an unfinished probe is abandoned
+#
+# Returns {1 (allowed) | 2 (allowed as the probe) | 0 (open) | -1 (waiting for the probe), milliseconds to wait,
+# 1 if the API key is unhealthy}
+_ALLOW_SCRIPT = """
+if redis.replicate_commands ~= nil then
+    redis.replicate_commands()
+end
+
+local unhealthy = 0
+
+if KEYS[3] then
+    unhealthy = redis.call("EXISTS", KEYS[3])
+end
+
+local state = redis.call("HGET", KEYS[1], "state")
+
+if not state or state == "closed" then
+    return {1, 0, unhealthy}
+end
+
+local now_parts = redis.call("TIME")
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+local open_until = tonumber(redis.call("HGET", KEYS[1], "open_until")) or 0
+
+if now < open_until then
+    return {0, open_until - now, unhealthy}
+end
+
+if redis.call("SET", KEYS[2], ARGV[1], "NX", "PX", ARGV[2]) then
+    redis.call("HSET", KEYS[1], "state", "half-open")
+    return {2, 0, unhealthy}
+end
+
+return {-1, math.max(redis.call("PTTL", KEYS[2]), 1), unhealthy}
+"""
+
+# KEYS[1]: hash storing the state of the circuit
+# KEYS[2]: key storing the token of the in-flight probe
+# KEYS[3]: hash storing the calls and failures of the current window
+# KEYS[4]: hash storing the calls and failures of the previous window
+# KEYS[5]: hash storing the metrics of the circuit
+# ARGV[1]: outcome of the call
+# ARGV[2]: token of the call if the call was the probe (otherwise an empty string)
+# ARGV[3]: length of the window in milliseconds
+# ARGV[4]: minimum number of calls in the windows before the error rate is checked
+# ARGV[5]: error rate opening the circuit
+# ARGV[6]: cooldown in milliseconds
+# ARGV[7]: maximum cooldown in milliseconds
+# ARGV[8]: reason of the outcome
+#
+# Returns {state, 1 if the state was changed}
+_RECORD_SCRIPT = """
+if redis.replicate_commands ~= nil then
+    redis.replicate_commands()
+end
+
+local now_parts = redis.call("TIME")
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+local outcome = ARGV[1]
+
+local function open(cooldown)
+    redis.call(
+        "HSET", KEYS[1], "state", "open", "opened_at", now, "open_until", now + cooldown, "cooldown", cooldown,
+        "reason", ARGV[8]
+    )
+    redis.call("DEL", KEYS[3], KEYS[4])
+    redis.call("HINCRBY", KEYS[5], "opened", 1)
+    return {"open", 1}
+end
+
+if ARGV[2] ~= "" and redis.call("GET", KEYS[2]) == ARGV[2] then
+    redis.call("DEL", KEYS[2])
+
+    if outcome == "release" then
+        return {redis.call("HGET", KEYS[1], "state") or "closed", 0}
+    elseif outcome == "success" then
+        redis.call("DEL", KEYS[1], KEYS[3], KEYS[4])
+        redis.call("HINCRBY", KEYS[5], "closed", 1)
+        return {"closed", 1}
+    end
+
+    local cooldown = tonumber(redis.call("HGET", KEYS[1], "cooldown")) or tonumber(ARGV[6])
+    return open(math.min(cooldown * 2, tonumber(ARGV[7])))
+end
+
+local state = redis.call("HGET", KEYS[1], "state")
+
+if outcome == "release" then
+    return {state or "closed", 0}
+elseif state and state ~= "closed" then
+    -- Calls started before the circuit was opened don't change the state
+    return {state, 0}
+end
+
+local failure = 0
+
+if outcome ~= "success" then
+    failure = 1
+end
+
+redis.call("HINCRBY", KEYS[3], "calls", 1)
+redis.call("HINCRBY", KEYS[3], "failures", failure)
+redis.call("PEXPIRE", KEYS[3], tonumber(ARGV[3]) * 2)
+
+if outcome == "trip" then
+    return open(tonumber(ARGV[6]))
+elseif failure == 0 then
+    return {"closed", 0}
+end
+
+local calls = 0
+local failures = 0
+
+for i = 3, 4 do
+    local window = redis.call("HMGET", KEYS[i], "calls", "failures")
+    calls = calls + (tonumber(window[1]) or 0)
+    failures = failures + (tonumber(window[2]) or 0)
+end
+
+if calls >= tonumber(ARGV[4]) and failures / calls >= tonumber(ARGV[5]) then
+    return open(tonumber(ARGV[6]))
+end
+
+return {"closed", 0}
+"""
+
+# KEYS[1]: hash storing the state of the circuit
+# KEYS[2]: key storing the token of the in-flight probe
+#
+# Returns {state, milliseconds until the cooldown has passed, 1 if a probe is in flight}
+_STATE_SCRIPT = """
+local state = redis.call("HGET", KEYS[1], "state")
+
+if not state then
+    return {"closed", 0, 0}
+end
+
+local now_parts = redis.call("TIME")
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+local open_until = tonumber(redis.call("HGET", KEYS[1], "open_until")) or 0
+
+return {state, math.max(open_until - now, 0), redis.call("EXISTS", KEYS[2])}
+"""
+
+
+class CircuitOpenError(NetworkingError):
+    """
+    Raised instead of calling the Torn API while the circuit is open.
+    """
+
+
+class CircuitPermit(typing.NamedTuple):
+    allowed: bool
+    probe: typing.Optional[str] = None  # Token of the call when the call is the probe of a half-open circuit
+    wait: bool = False  # Whether the call should be deferred until the probe has finished
+    retry_after: float = 0  # Seconds until the cooldown has passed or the probe has finished
+    key_unhealthy: bool = False  # Whether the call's API key is marked as unhealthy
+
+
+class CircuitState(typing.NamedTuple):
+    state: str
+    open_for: float  # Seconds until the cooldown has passed
+    probing: bool
+
+
+def _window_keys(window_s: int) -> typing.Tuple[str, str]:
+    window = int(time.time()) // window_s
+    return f"{CIRCUIT_KEY}:window:{window}", f"{CIRCUIT_KEY}:window:{window - 1}"
+
+
+def torn_circuit_allow(health_key: typing.Optional[str] = None) -> CircuitPermit:
+    """
+    Check whether a Torn API call can be made.
+
+    The outcome of every allowed call must be passed to `torn_circuit_record` with the permit's probe.
+
+    When the Redis key storing the health of the call's API key (see `tasks.keys.key_health_key`) is provided, the
+    permit's `key_unhealthy` is whether the key is marked as unhealthy. The check doesn't affect whether the call is
+    allowed; it's only made in the same round trip so that tornget doesn't need a separate round trip per call to know
+    whether a successful call should restore the key's health.
+    """
+
+    redis_client = rds()
+    token = uuid.uuid4().hex
+    status, wait_ms, unhealthy = _script(redis_client, _ALLOW_SCRIPT)(
+        keys=[CIRCUIT_KEY, CIRCUIT_PROBE_KEY] + ([] if health_key is None else [health_key]),
+        args=[token, int(float(setting("tornium_torn_circuit_probe_timeout", 10)) * 1000)],
+        client=redis_client,
+    )
+    status = int(status)
+    unhealthy = bool(int(unhealthy))
+
+    if status == 1:
+        return CircuitPermit(allowed=True, key_unhealthy=unhealthy)
+    elif status == 2:
+        logger.info("Torn API circuit half-open :: probing")
+        return CircuitPermit(allowed=True, probe=token, key_unhealthy=unhealthy)
+
+    return CircuitPermit(allowed=False, wait=status == -1, retry_after=int(wait_ms) / 1000, key_unhealthy=unhealthy)
+
+
+def torn_circuit_record(outcome: str, probe: typing.Optional[str] = None, reason: str = "") -> str:
+    """
+    Record the outcome of a Torn API call and return the state of the circuit.
+    """
+
+    window_s = max(int(setting("tornium_torn_circuit_window", 30)), 1)
+    current_window, previous_window = _window_keys(window_s)
+
+    redis_client = rds()
+    state, changed = _script(redis_client, _RECORD_SCRIPT)(
+        keys=[CIRCUIT_KEY, CIRCUIT_PROBE_KEY, current_window, previous_window, CIRCUIT_METRICS_KEY],
+        args=[
+            outcome,
+            probe or "",
+            window_s * 1000,
+            int(setting("tornium_torn_circuit_min_calls", 20)),
+            float(setting("tornium_torn_circuit_error_rate", 0.5)),
+            int(float(setting("tornium_torn_circuit_cooldown", 30)) * 1000),
+            int(float(setting("tornium_torn_circuit_max_cooldown", 300)) * 1000),
+            reason or outcome,
+        ],
+        client=redis_client,
+    )
+
+    if isinstance(state, bytes):
+        state = state.decode("utf-8")
+
+    if int(changed) and state == STATE_OPEN:
+        logger.warning(f"Torn API circuit opened :: {reason or outcome}")
+    elif int(changed) and state == STATE_CLOSED:
+        logger.info("Torn API circuit closed")
+
+    return state
+
+
+def torn_circuit_state() -> CircuitState:
+    redis_client = rds()
+    state, open_for_ms, probing = _script(redis_client, _STATE_SCRIPT)(
+        keys=[CIRCUIT_KEY, CIRCUIT_PROBE_KEY],
+        args=[],
+        client=redis_client,
+    )
+
+    if isinstance(state, bytes):
+        state = state.decode("utf-8")
+
+    return CircuitState(state=state, open_for=int(open_for_ms) / 1000, probing=bool(probing))
+
+
+def torn_circuit_open() -> bool:
+    """
+    Check whether runners should skip enqueuing Torn API calls.
+
+    Once the cooldown has passed, calls are enqueued again so that one of them can be made as the probe.
+    """
+
+    circuit = torn_circuit_state()
+
+    if circuit.state == STATE_CLOSED:
+        return False
+
+    return circuit.open_for > 0 or circuit.probing
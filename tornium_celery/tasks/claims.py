@@ -0,0 +1,74 @@
+# Copyright (C) 2021-2023 tiksan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import typing
+
+from celery.utils.log import get_task_logger
+from tornium_commons import rds
+
+from ..utils import json_dumps, json_loads, setting
+
+logger = get_task_logger("celery_app")
+
+
+def is_claim(payload) -> bool:
+    return isinstance(payload, dict) and len(payload) == 1 and "__claim__" in payload
+
+
+def store_payload(payload, serialized_payload: typing.Optional[typing.Union[str, bytes]] = None):
+    """
+    Store a large payload in Redis under the SHA256 of its contents and return a claim to the payload.
+
+    Payloads smaller than `tornium_claim_check_min_size` bytes are returned as is as the claim wouldn't be much
+    smaller than the payload. Identical payloads share a single key. If the payload has already been serialized
+    (e.g. the response from the API), the serialized payload can be provided to avoid serializing the payload again.
+    """
+
+    if serialized_payload is None:
+        serialized_payload = json_dumps(payload)
+
+    if isinstance(serialized_payload, str):
+        serialized_payload = serialized_payload.encode("utf-8")
+
+    if len(serialized_payload) < int(setting("tornium_claim_check_min_size", 8192)):
+        return payload
+
+    claim = hashlib.sha256(serialized_payload).hexdigest()
+    # The payload is set again (instead of only if it doesn't exist) so that the TTL of an identical payload stored
+    # by an earlier call is extended for the new claim
+    rds().set(f"tornium:claim:{claim}", serialized_payload, ex=int(setting("tornium_claim_check_ttl", 300)))
+
+    return {"__claim__": claim}
+
+
+def load_payload(payload) -> typing.Any:
+    """
+    Load the payload of a claim created by `store_payload`.
+
+    Payloads that aren't claims are returned as is. If the claimed payload has expired, an empty dictionary is
+    returned so that handlers skip the payload.
+    """
+
+    if not is_claim(payload):
+        return payload
+
+    serialized_payload = rds().get(f"tornium:claim:{payload['__claim__']}")
+
+    if serialized_payload is None:
+        logger.warning(f"Claimed payload {payload['__claim__']} has expired")
+        return {}
+
+    return json_loads(serialized_payload)
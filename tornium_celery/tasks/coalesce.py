@@ -0,0 +1,149 @@
+# Copyright (C) 2021-2023 tiksan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import time
+import typing
+import urllib.parse
+import uuid
+
+from tornium_commons import rds
+
+from ..utils import setting
+from .cache import normalize_endpoint
+
+# Deletes the leader's lock only if it is still held by the leader (the lock could have expired and been acquired
+# by another caller) and stores the response for the waiting callers in the same round trip
+#
+# KEYS[1]: lock key
+# KEYS[2]: result key
+# ARGV[1]: token of the leader
+# ARGV[2]: response (or an empty string if the call failed)
+# ARGV[3]: milliseconds the response is kept for
+_RELEASE_SCRIPT = """
+if ARGV[2] ~= "" then
+    redis.call("SET", KEYS[2], ARGV[2], "PX", ARGV[3])
+end
+
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    redis.call("DEL", KEYS[1])
+end
+
+return 1
+"""
+
+_release_script = None
+
+
+class Flight(typing.NamedTuple):
+    lock_key: str
+    result_key: str
+    token: typing.Optional[str]  # Only set for the caller performing the call
+    response: typing.Optional[typing.Union[str, bytes]] = None  # Set when a flight has recently landed
+
+    @property
+    def leader(self) -> bool:
+        return self.token is not None
+
+
+def flight_key(endpoint: str, key: str, tots=0, fromts=0, stat="") -> str:
+    resource, target, selections, extra_params = normalize_endpoint(endpoint, key, tots, fromts, stat)
+    flight = f"tornium:torn-flight:{resource}:{target}:{','.join(selections)}"
+
+    if len(extra_params) != 0:
+        flight += ":" + urllib.parse.urlencode(extra_params)
+
+    return flight
+
+
+def join_flight(endpoint: str, key: str, tots=0, fromts=0, stat="") -> Flight:
+    """
+    Join the in-flight call for an endpoint.
+
+    The first caller becomes the leader and is expected to perform the call and to `land_flight` afterwards. Every
+    other caller while the call is in flight should `wait_for_flight` for the leader's response. Callers joining
+    shortly after a flight has landed receive the leader's response immediately.
+    """
+
+    flight = flight_key(endpoint, key, tots, fromts, stat)
+    token = uuid.uuid4().hex
+    lock_ms = int(float(setting("tornium_torn_coalesce_lock", 6)) * 1000)
+
+    redis_client = rds()
+    pipeline = redis_client.pipeline(transaction=False)
+    pipeline.get(f"{flight}:result")
+    pipeline.set(f"{flight}:lock", token, nx=True, px=lock_ms)
+    pipeline.hincrby("tornium:torn-flight:metrics", "calls")
+    response, acquired, _ = pipeline.execute()
+
+    return Flight(
+        lock_key=f"{flight}:lock",
+        result_key=f"{flight}:result",
+        token=token if acquired else None,
+        response=response,
+    )
+
+
+def land_flight(flight: Flight, response: typing.Optional[typing.Union[str, bytes]] = None):
+    """
+    Release the leader's lock and store the response for the waiting callers.
+
+    The response should be `None` when the call failed so that the waiting callers perform the call themselves.
+    """
+
+    global _release_script
+
+    if not flight.leader:
+        return
+
+    redis_client = rds()
+
+    if _release_script is None:
+        _release_script = redis_client.register_script(_RELEASE_SCRIPT)
+
+    result_ms = int(float(setting("tornium_torn_coalesce_result_ttl", 2)) * 1000)
+    _release_script(
+        keys=[flight.lock_key, flight.result_key],
+        args=[flight.token, b"" if response is None else response, result_ms],
+        client=redis_client,
+    )
+
+
+def wait_for_flight(flight: Flight) -> typing.Optional[typing.Union[str, bytes]]:
+    """
+    Wait for the leader's response.
+
+    Returns `None` when the leader's call failed or did not complete within the configured wait so that the caller
+    can fall back to performing the call itself.
+    """
+
+    timeout = float(setting("tornium_torn_coalesce_wait", 3))
+    interval = float(setting("tornium_torn_coalesce_poll_interval", 0.05))
+    deadline = time.monotonic() + timeout
+    redis_client = rds()
+
+    while True:
+        pipeline = redis_client.pipeline(transaction=False)
+        pipeline.get(flight.result_key)
+        pipeline.exists(flight.lock_key)
+        response, in_flight = pipeline.execute()
+
+        if response is not None:
+            redis_client.hincrby("tornium:torn-flight:metrics", "coalesced")
+            return response
+        elif not in_flight or time.monotonic() >= deadline:
+            redis_client.hincrby("tornium:torn-flight:metrics", "fallback")
+            return None
+
+        time.sleep(interval)
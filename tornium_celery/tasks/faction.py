@@ -16,7 +16,6 @@
 import datetime
 import inspect
 import math
-import random
 import re
 import time
 import typing
@@ -27,6 +26,7 @@ from decimal import DivisionByZero
 import celery
 from celery.utils.log import get_task_logger
 from peewee import JOIN, DoesNotExist
+from tornium_commons import rds
 from tornium_commons.errors import DiscordError, NetworkingError
 from tornium_commons.formatters import LinkHTMLParser, commas, timestamp, torn_timestamp
 from tornium_commons.models import (
@@ -45,7 +45,16 @@ from tornium_commons.models import (
 )
 from tornium_commons.skyutils import SKYNET_ERROR, SKYNET_GOOD
 
-from .api import discordpatch, discordpost, torn_stats_get, tornget
+from .api import (
+    discordpatch,
+    discordpost,
+    enqueue_tornget_many,
+    torn_stats_get,
+    tornget,
+)
+from .circuit import torn_circuit_open
+from .claims import load_payload
+from .keys import KeyPool, least_loaded_key
 from .misc import send_dm
 from .user import update_user
 
@@ -62,6 +71,14 @@ ORGANIZED_CRIMES = {
     8: "Political Assassination",
 }
 
+# Fields of faction/?selections=basic,attacks used by check_attacks and stat_db_attacks
+ATTACKS_PROJECTION = (
+    "ID",
+    "attacks.*.{code,timestamp_ended,result,respect,respect_gain,respect_loss,chain,modifiers}",
+    "attacks.*.{attacker,attacker_id,attacker_name,attacker_faction,attacker_factionname}",
+    "attacks.*.{defender_id,defender_name,defender_faction,defender_factionname}",
+)
+
 ATTACK_RESULTS = {
     "Lost": 0,
     "Attacked": 1,
@@ -85,6 +102,13 @@ ATTACK_RESULTS = {
     time_limit=30,
 )
 def refresh_factions():
+    if torn_circuit_open():
+        logger.info("refresh_factions skipped :: Torn API circuit is open")
+        return
+
+    faction_calls = []
+    od_calls = []
+
     faction: Faction
     for faction in Faction.select().join(Server, JOIN.LEFT_OUTER):
         # Optimize this query to use one query to select valid factions
@@ -92,13 +116,22 @@ def refresh_factions():
         if len(faction.aa_keys) == 0:
             continue
 
-        tornget.signature(
-            kwargs={
+        key_pool = KeyPool(faction.aa_keys)
+        aa_key = key_pool.get()
+
+        if aa_key is None:
+            # Every AA key of the faction is unhealthy (e.g. paused) or out of calls
+            continue
+
+        faction_calls.append(
+            {
                 "endpoint": "faction/?selections=basic,positions",
-                "key": random.choice(faction.aa_keys),
-            },
-            queue="api",
-        ).apply_async(expires=300, link=update_faction.s())
+                "key": aa_key,
+                "cache": True,
+                "claim_check": True,
+                "merge_target": faction.tid,
+            }
+        )
 
         ts_key = ""
 
@@ -108,11 +141,13 @@ def refresh_factions():
             if faction.coleader is not None and faction.coleader.key not in ("", None):
                 ts_key = faction.coleader.key
 
-        if ts_key is not None:
+        if ts_key != "":
             torn_stats_get.signature(
-                kwargs={"endpoint": f"spy/faction/{faction.tid}", "key": ts_key},
+                kwargs={"endpoint": f"spy/faction/{faction.tid}", "key": ts_key, "cache": True},
+                queue="api",
+            ).apply_async(
                 expires=300,
-                link=update_faction_ts.s(),
+                link=update_faction_ts.signature(kwargs={"faction_id": faction.tid}),
             )
 
         try:
@@ -121,20 +156,22 @@ def refresh_factions():
                 and faction.guild is not None
                 and faction.tid in faction.guild.factions
             ):
-                tornget.signature(
-                    kwargs={
-                        "endpoint": "faction/?selections=basic,contributors",
-                        "stat": "drugoverdoses",
-                        "key": random.choice(faction.aa_keys),
-                    },
-                    queue="api",
-                ).apply_async(
-                    expires=300,
-                    link=check_faction_ods.s(),
-                )
+                od_key = key_pool.get()
+
+                if od_key is not None:
+                    od_calls.append(
+                        {
+                            "endpoint": "faction/?selections=basic,contributors",
+                            "stat": "drugoverdoses",
+                            "key": od_key,
+                        }
+                    )
         except DoesNotExist:
             pass
 
+    enqueue_tornget_many(faction_calls, handler=update_faction.s(), merge=True, expires=300)
+    enqueue_tornget_many(od_calls, handler=check_faction_ods.s(), expires=300)
+
 
 @celery.shared_task(
     name="tasks.faction.update_faction",
@@ -143,6 +180,8 @@ def refresh_factions():
     time_limit=5,
 )
 def update_faction(faction_data):
+    faction_data = load_payload(faction_data)
+
     if faction_data is None:
         return
     elif faction_data.get("ID") is None:
@@ -384,40 +423,75 @@ def update_faction_positions(faction_positions_data: dict) -> typing.Optional[di
     queue="default",
     time_limit=5,
 )
-def update_faction_ts(faction_ts_data):
+def update_faction_ts(faction_ts_data, faction_id: typing.Optional[int] = None):
     if not faction_ts_data["status"]:
         return
 
+    # The timestamps of the spies last stored for the faction's members so that members whose spy hasn't changed are
+    # skipped without being loaded. Only the spies of updated members are recorded so that members skipped while they
+    # weren't eligible (e.g. not in the database yet) are updated once they are eligible.
+    spies_key = f"tornium:tornstats-spies:{faction_id}"
+    stored_spies = {
+        (user_id.decode("utf-8") if isinstance(user_id, bytes) else user_id): int(spy_timestamp)
+        for user_id, spy_timestamp in (rds().hgetall(spies_key) if faction_id is not None else {}).items()
+    }
+    spies = {}
+
     for user_id, user_data in faction_ts_data["faction"]["members"].items():
         if "spy" not in user_data:
             continue
 
-        try:
-            user: User = User.select().where(User.tid == int(user_id)).get()
-        except DoesNotExist:
+        if user_data["spy"]["timestamp"] <= stored_spies.get(user_id, 0):
             continue
 
+        spies[int(user_id)] = user_data["spy"]
+
+    if len(spies) == 0:
+        return
+
+    updated_users = []
+
+    user: User
+    for user in User.select().where(User.tid.in_(list(spies.keys()))):
+        spy = spies[user.tid]
+
         if user.key is not None:
             continue
-        elif user.battlescore_update is not None and user_data["spy"]["timestamp"] <= timestamp(
-            user.battlescore_update
-        ):
+        elif user.battlescore_update is not None and spy["timestamp"] <= timestamp(user.battlescore_update):
             continue
 
         user.battlescore = (
-            math.sqrt(user_data["spy"]["strength"])
-            + math.sqrt(user_data["spy"]["defense"])
-            + math.sqrt(user_data["spy"]["speed"])
-            + math.sqrt(user_data["spy"]["dexterity"])
+            math.sqrt(spy["strength"])
+            + math.sqrt(spy["defense"])
+            + math.sqrt(spy["speed"])
+            + math.sqrt(spy["dexterity"])
         )
-        user.strength = user_data["spy"]["strength"]
-        user.defense = user_data["spy"]["defense"]
-        user.speed = user_data["spy"]["speed"]
-        user.dexterity = user_data["spy"]["dexterity"]
-        user.battlescore_update = datetime.datetime.fromtimestamp(
-            user_data["spy"]["timestamp"], tz=datetime.timezone.utc
+        user.strength = spy["strength"]
+        user.defense = spy["defense"]
+        user.speed = spy["speed"]
+        user.dexterity = spy["dexterity"]
+        user.battlescore_update = datetime.datetime.fromtimestamp(spy["timestamp"], tz=datetime.timezone.utc)
+        updated_users.append(user)
+
+    if len(updated_users) != 0:
+        User.bulk_update(
+            updated_users,
+            fields=[
+                User.battlescore,
+                User.strength,
+                User.defense,
+                User.speed,
+                User.dexterity,
+                User.battlescore_update,
+            ],
+            batch_size=100,
         )
-        user.save()
+
+    if faction_id is not None and len(updated_users) != 0:
+        pipeline = rds().pipeline(transaction=False)
+        pipeline.hset(spies_key, mapping={str(user.tid): spies[user.tid]["timestamp"] for user in updated_users})
+        pipeline.expire(spies_key, 86400)
+        pipeline.execute()
 
 
 @celery.shared_task(
@@ -532,6 +606,10 @@ def check_faction_ods(faction_od_data):
     time_limit=5,
 )
 def fetch_attacks_runner():
+    if torn_circuit_open():
+        logger.info("fetch_attacks_runner skipped :: Torn API circuit is open")
+        return
+
     for api_key in (
         TornKey.select().distinct(TornKey.user.faction.tid).join(User).join(Faction).where(TornKey.default == True)
     ):
@@ -554,11 +632,18 @@ def fetch_attacks_runner():
             continue
 
         last_attacks: int = timestamp(faction.last_attacks)
+        aa_key = least_loaded_key(faction.aa_keys)
+
+        if aa_key is None:
+            continue
 
         tornget.signature(
             kwargs={
                 "endpoint": "faction/?selections=basic,attacks",
-                "key": random.choice(faction.aa_keys),
+                "key": aa_key,
+                "priority_class": "retal",
+                "claim_check": True,
+                "projection": ATTACKS_PROJECTION,
             },
             queue="api",
         ).apply_async(
@@ -614,6 +699,8 @@ def fetch_attacks_runner():
     time_limit=5,
 )
 def stat_db_attacks(faction_data: dict, last_attacks: int):
+    faction_data = load_payload(faction_data)
+
     if len(faction_data.get("attacks", [])) == 0:
         return
 
@@ -632,6 +719,8 @@ def stat_db_attacks(faction_data: dict, last_attacks: int):
     if not faction.stats_db_enabled:
         return
 
+    key_pool = KeyPool(faction.aa_keys)
+
     attack: dict
     for attack in faction_data["attacks"].values():
         if attack["result"] in [
@@ -737,8 +826,13 @@ def stat_db_attacks(faction_data: dict, last_attacks: int):
                 preserve=[User.name, User.faction],
             ).execute()
 
+        aa_key = key_pool.get()
+
+        if aa_key is None:
+            continue
+
         try:
-            update_user.delay(tid=opponent_id, key=random.choice(faction.aa_keys)).forget()
+            update_user.delay(tid=opponent_id, key=aa_key).forget()
         except Exception as e:
             logger.exception(e)
             continue
@@ -1062,6 +1156,8 @@ def validate_attack_bonus(attack: dict, faction: Faction, attack_config: ServerA
     time_limit=5,
 )
 def check_attacks(faction_data: dict, last_attacks: int):
+    faction_data = load_payload(faction_data)
+
     if len(faction_data.get("attacks", [])) == 0:
         return
 
@@ -1271,6 +1367,8 @@ def check_attacks(faction_data: dict, last_attacks: int):
     time_limit=5,
 )
 def oc_refresh():
+    oc_calls = []
+
     for api_key in (
         TornKey.select()
         .distinct(TornKey.user.faction.tid)
@@ -1285,17 +1383,23 @@ def oc_refresh():
         elif len(faction.aa_keys) == 0:
             continue
 
-        tornget.signature(
-            kwargs={
+        aa_key = least_loaded_key(faction.aa_keys)
+
+        if aa_key is None:
+            continue
+
+        oc_calls.append(
+            {
                 "endpoint": "faction/?selections=basic,crimes",
-                "key": random.choice(faction.aa_keys),
-            },
-            queue="api",
-        ).apply_async(
-            expires=300,
-            link=oc_refresh_subtask.s(),
+                "key": aa_key,
+                "priority_class": "notifications",
+                "claim_check": True,
+                "merge_target": faction.tid,
+            }
         )
 
+    enqueue_tornget_many(oc_calls, handler=oc_refresh_subtask.s(), merge=True, expires=300)
+
 
 @celery.shared_task(
     name="tasks.faction.oc_refresh_subtask",
@@ -1305,6 +1409,7 @@ def oc_refresh():
 )
 def oc_refresh_subtask(oc_data):
     # TODO: Refactor this to be more readable
+    oc_data = load_payload(oc_data)
 
     if oc_data.get("crimes") is None or isinstance(oc_data["crimes"], list):
         # A faction with no OCs will have an empty list of crimes
@@ -1685,11 +1790,17 @@ def auto_cancel_requests():
         except DoesNotExist:
             continue
 
+        aa_key = least_loaded_key(faction.aa_keys)
+
+        if aa_key is None:
+            continue
+
         tornget.signature(
             kwargs={
                 "endpoint": "faction/?selections=fundsnews,basic",
-                "key": random.choice(faction.aa_keys),
+                "key": aa_key,
                 "pass_error": True,
+                "priority_class": "notifications",
             },
             queue="api",
         ).apply_async(expires=300, link=verify_faction_withdrawals.signature(kwargs={"withdrawals": withdrawals}))
@@ -1940,6 +2051,8 @@ def verify_faction_withdrawals(funds_news: dict, withdrawals):
     time_limit=5,
 )
 def armory_check():
+    armory_calls = []
+
     for api_key in (
         TornKey.select()
         .distinct(TornKey.user.faction.tid)
@@ -1972,22 +2085,23 @@ def armory_check():
         elif len(faction.guild.armory_config[str(faction.tid)].get("items", {})) == 0:
             continue
 
-        tornget.signature(
-            kwargs={
+        aa_key = least_loaded_key(faction.aa_keys)
+
+        if aa_key is None:
+            continue
+
+        armory_calls.append(
+            {
                 "endpoint": "faction/?selections=armor,boosters,drugs,medical,temporary,weapons",
-                "key": random.choice(faction.aa_keys),
-            },
-            queue="api",
-        ).apply_async(
-            expires=300,
-            link=armory_check_subtask.signature(
-                kwargs={
-                    "faction_id": faction.tid,
-                },
-                queue="quick",
-            ),
+                "key": aa_key,
+                "priority_class": "notifications",
+                "handler_kwargs": {"faction_id": faction.tid},
+                "merge_target": faction.tid,
+            }
         )
 
+    enqueue_tornget_many(armory_calls, handler=armory_check_subtask.signature(queue="quick"), merge=True, expires=300)
+
 
 @celery.shared_task(
     name="tasks.faction.armory_check_subtask",
@@ -13,7 +13,6 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
-import random
 import typing
 
 import celery
@@ -24,6 +23,7 @@ from tornium_commons.skyutils import SKYNET_ERROR
 
 from ..api import discordpost, tornget
 from ..guild import verify_member_sub
+from ..keys import default_keys, least_loaded_key
 
 logger = get_task_logger("celery_app")
 
@@ -49,16 +49,10 @@ def on_member_join(guild_id: int, discord_id: int, user_nick: str):
     elif len(guild.admins) == 0:
         return
 
-    admin_keys: typing.List[str] = []
+    admin_key = least_loaded_key(default_keys(guild.admins))
 
-    admin: int
-    for admin in guild.admins:
-        try:
-            admin_keys.append(User.select(User.tid).where(User.tid == admin).get().key)
-        except DoesNotExist:
-            continue
-
-    if len(admin_keys) == 0:
+    if admin_key is None:
+        # No admin has a key or every admin key is unhealthy (e.g. paused)
         return
 
     error_link = {}
@@ -71,7 +65,10 @@ def on_member_join(guild_id: int, discord_id: int, user_nick: str):
     tornget.signature(
         kwargs={
             "endpoint": f"user/{discord_id}?selections=",
-            "key": random.choice(admin_keys),
+            "key": admin_key,
+            "cache": True,
+            "coalesce": True,
+            "priority_class": "notifications",
         }
     ).apply_async(
         link=verify_member_sub.signature(
@@ -32,6 +32,7 @@ from tornium_commons.models import FactionPosition, Server, User
 from tornium_commons.skyutils import SKYNET_ERROR, SKYNET_GOOD, SKYNET_INFO
 
 from .api import discordget, discordpatch, discordpost
+from .keys import KeyPool, default_keys
 from .user import update_user
 
 logger: logging.Logger = get_task_logger("celery_app")
@@ -221,14 +222,7 @@ def verify_users(
     redis_client.set(f"tornium:verify:{guild.sid}:lock", 1, ex=600, nx=True)
 
     if admin_keys is None:
-        admin_keys = []
-
-        admin: int
-        for admin in guild.admins:
-            try:
-                admin_keys.append(User.select(User.tid).where(User.tid == admin).get().key)
-            except DoesNotExist:
-                continue
+        admin_keys = default_keys(guild.admins)
 
     if len(admin_keys) == 0:
         raise ValueError("No admin keys are available to use")
@@ -351,6 +345,7 @@ def verify_users(
     redis_client.incrby(f"tornium:verify:{guild.sid}:member_count", len(guild_members))
     redis_client.incrby(f"tornium:verify:{guild.sid}:member_fetch_runs", 1)
     counter = 0
+    admin_key_pool = KeyPool(admin_keys)
 
     guild_member: dict
     for guild_member in guild_members:
@@ -388,9 +383,15 @@ def verify_users(
             or (datetime.datetime.utcnow() - user.last_refresh).total_seconds() >= 604800  # One week
             or force
         ):
+            admin_key = admin_key_pool.get()
+
+            if admin_key is None:
+                # Every admin key is unhealthy (e.g. paused)
+                continue
+
             update_user.signature(
                 kwargs={
-                    "key": random.choice(admin_keys),  # TODO: replace this with key rotation via counter
+                    "key": admin_key,
                     "discordid": guild_member["user"]["id"],
                 },
                 queue="default",
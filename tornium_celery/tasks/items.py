@@ -14,7 +14,6 @@
 # along with this program.  If not, see <https://www.gnu.org/licenses/>.
 
 import datetime
-import random
 import typing
 
 import celery
@@ -26,6 +25,7 @@ from tornium_commons.models import Item, Notification, Server, User
 from tornium_commons.skyutils import SKYNET_INFO
 
 from .api import tornget
+from .keys import default_keys, least_loaded_key, sampled_key
 from .stakeout_hooks import send_notification
 
 logger = get_task_logger("celery_app")
@@ -38,7 +38,13 @@ logger = get_task_logger("celery_app")
     time_limit=15,
 )
 def update_items(items_data):
-    Item.update_items(torn_get=tornget, key=User.random_key().api_key)
+    key = sampled_key()
+
+    if key is None:
+        logger.info("update_items skipped :: no API key is available")
+        return
+
+    Item.update_items(torn_get=tornget, key=key)
 
     rds().set(
         "tornium:items:last-update",
@@ -77,12 +83,7 @@ def fetch_market():
                     notification.delete_instance()
                     continue
 
-                try:
-                    api_key: typing.Optional[str] = (
-                        User.select(User.tid).where(User.tid == random.choice(guild.admins)).get().key
-                    )
-                except DoesNotExist:
-                    continue
+                api_key: typing.Optional[str] = least_loaded_key(default_keys(guild.admins))
 
             if api_key is None:
                 continue
@@ -91,6 +92,8 @@ def fetch_market():
                 kwargs={
                     "endpoint": f"market/{item_id}?selections=itemmarket,bazaar",
                     "key": api_key,
+                    "priority_class": "notifications",
+                    "projection": ("itemmarket.*.{ID,cost,quantity}", "bazaar.*.{ID,cost,quantity}"),
                 },
                 queue="api",
             ).apply_async(
@@ -0,0 +1,236 @@
+# Copyright (C) 2021-2023 tiksan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import random
+import time
+import typing
+
+import celery
+from peewee import fn
+from tornium_commons import rds
+from tornium_commons.models import TornKey
+
+from .ratelimit import _minute_window_ms, torn_ratelimit_peek
+
+# Health of API keys returning errors caused by the state of the key's owner instead of by the call
+KEY_HEALTH_ERRORS = {
+    2: "invalid",  # Incorrect key
+    10: "jailed",  # Key owner is in federal jail
+    13: "inactive",  # Key disabled due to owner inactivity
+    18: "paused",  # API key paused by owner
+}
+# Seconds until an unhealthy key is probed again by check_api_keys (invalid keys are never probed)
+KEY_HEALTH_RETRY = {
+    "jailed": 21600,
+    "inactive": 3600,
+    "paused": 900,
+}
+
+# Sorted set of unhealthy keys by the timestamp of the key's next probe
+KEY_HEALTH_RETRY_KEY = "tornium:torn-key-health:retry"
+# Seconds the health of invalid keys is kept for (invalid keys are deleted from the database)
+KEY_HEALTH_INVALID_TTL = 86400
+
+
+def unavailable_key(key: str) -> str:
+    return f"tornium:torn-key-unavailable:{key}"
+
+
+def key_health_key(key: str) -> str:
+    return f"tornium:torn-key-health:{key}"
+
+
+def mark_key_unavailable(key: str, seconds: typing.Optional[float] = None):
+    """
+    Skip an API key in key selection for `seconds` (or until the end of the ratelimit's minute).
+    """
+
+    if seconds is None:
+        milliseconds = _minute_window_ms()
+    else:
+        milliseconds = max(int(seconds * 1000), 1)
+
+    rds().set(unavailable_key(key), 1, px=milliseconds)
+
+
+def mark_key_unhealthy(key: str, error_code: int) -> typing.Optional[str]:
+    """
+    Store the health of an API key returning one of `KEY_HEALTH_ERRORS` and return the key's status.
+
+    Unhealthy keys are skipped in key selection until a probe (or any other call) made with the key succeeds.
+    """
+
+    status = KEY_HEALTH_ERRORS.get(error_code)
+
+    if status is None:
+        return None
+
+    now = int(time.time())
+    retry_at = now + int(celery.current_app.conf.get("tornium_torn_key_health_retry", KEY_HEALTH_RETRY).get(status, 0))
+
+    pipeline = rds().pipeline(transaction=False)
+    pipeline.hset(
+        key_health_key(key),
+        mapping={
+            "status": status,
+            "error": error_code,
+            "error_at": now,
+            "retry_at": retry_at if status != "invalid" else 0,
+        },
+    )
+
+    if status == "invalid":
+        # Invalid keys are deleted from the database so they're never selected or probed again
+        pipeline.expire(key_health_key(key), KEY_HEALTH_INVALID_TTL)
+        pipeline.zrem(KEY_HEALTH_RETRY_KEY, key)
+    else:
+        pipeline.zadd(KEY_HEALTH_RETRY_KEY, {key: retry_at})
+
+    pipeline.execute()
+
+    return status
+
+
+def restore_key_health(key: str) -> bool:
+    """
+    Mark an API key as healthy and return whether the key was unhealthy.
+    """
+
+    pipeline = rds().pipeline(transaction=False)
+    pipeline.delete(key_health_key(key))
+    pipeline.zrem(KEY_HEALTH_RETRY_KEY, key)
+    deleted, _ = pipeline.execute()
+
+    return bool(deleted)
+
+
+def key_health(key: str) -> typing.Dict[str, typing.Union[str, int]]:
+    health = {
+        (field.decode("utf-8") if isinstance(field, bytes) else field): (
+            value.decode("utf-8") if isinstance(value, bytes) else value
+        )
+        for field, value in rds().hgetall(key_health_key(key)).items()
+    }
+
+    if len(health) == 0:
+        return {"status": "ok"}
+
+    for field in ("error", "error_at", "retry_at"):
+        if field in health:
+            health[field] = int(health[field])
+
+    return health
+
+
+def unhealthy_keys(keys: typing.Sequence[str]) -> typing.Set[str]:
+    if len(keys) == 0:
+        return set()
+
+    pipeline = rds().pipeline(transaction=False)
+
+    for key in keys:
+        pipeline.zscore(KEY_HEALTH_RETRY_KEY, key)
+
+    return {key for key, score in zip(keys, pipeline.execute()) if score is not None}
+
+
+def claim_due_keys(limit: int = 100, probe_timeout: int = 300) -> typing.List[str]:
+    """
+    Get up to `limit` unhealthy keys that are due to be probed.
+
+    The next probe of each key is pushed back by `probe_timeout` seconds so that a key isn't probed again before the
+    probe's result has been stored.
+    """
+
+    now = int(time.time())
+    redis_client = rds()
+    keys = [
+        key.decode("utf-8") if isinstance(key, bytes) else key
+        for key in redis_client.zrangebyscore(KEY_HEALTH_RETRY_KEY, "-inf", now, start=0, num=limit)
+    ]
+
+    if len(keys) != 0:
+        redis_client.zadd(KEY_HEALTH_RETRY_KEY, {key: now + probe_timeout for key in keys}, xx=True)
+
+    return keys
+
+
+class KeyPool:
+    """
+    Pool of API keys that hands out the key with the most remaining calls.
+
+    The remaining calls of each key are read once when the pool is created, so the calls handed out by the pool are
+    counted locally to spread a runner's calls across the keys instead of using the same key for every call. Unhealthy
+    keys (e.g. paused keys) are never handed out, and no key is handed out once every key is out of calls.
+    """
+
+    def __init__(self, keys: typing.Iterable[typing.Optional[str]]):
+        keys = list(dict.fromkeys(key for key in keys if key not in (None, "")))
+        unhealthy = unhealthy_keys(keys)
+
+        self.keys: typing.List[str] = [key for key in keys if key not in unhealthy]
+        self.budgets: typing.Dict[str, int] = dict(
+            zip(self.keys, torn_ratelimit_peek(self.keys, [unavailable_key(key) for key in self.keys]))
+        )
+
+    def __len__(self):
+        return len(self.keys)
+
+    def get(self) -> typing.Optional[str]:
+        if len(self.keys) == 0:
+            return None
+
+        # Keys are shuffled so that ties don't always go to the same key
+        keys = random.sample(self.keys, len(self.keys))
+        key = max(keys, key=lambda k: self.budgets[k])
+
+        if self.budgets[key] <= 0:
+            # Every key is either out of calls or unavailable, so the call is left to the caller to skip or defer
+            # instead of being made with a key that would be ratelimited
+            return None
+
+        self.budgets[key] -= 1
+        return key
+
+
+def least_loaded_key(keys: typing.Iterable[typing.Optional[str]]) -> typing.Optional[str]:
+    return KeyPool(keys).get()
+
+
+def default_keys(user_ids: typing.Iterable[int]) -> typing.List[str]:
+    """
+    Get the default API keys of the users (e.g. a guild's admins) in a single query.
+    """
+
+    return [
+        key.api_key
+        for key in TornKey.select(TornKey.api_key).where((TornKey.user.in_(list(user_ids))) & (TornKey.default == True))
+    ]
+
+
+def sampled_key(sample_size: int = 5) -> typing.Optional[str]:
+    """
+    Get the least loaded key of a random sample of keys for calls that can be made with any key.
+
+    Only a sample of the keys is compared as reading the remaining calls of every key would be too slow.
+    """
+
+    return least_loaded_key(
+        key.api_key
+        for key in TornKey.select(TornKey.api_key)
+        .where((TornKey.disabled == False) & (TornKey.paused == False))
+        .order_by(fn.Random())
+        .limit(sample_size)
+    )
@@ -0,0 +1,244 @@
+# Copyright (C) 2021-2023 tiksan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import hashlib
+import json
+import typing
+import urllib.parse
+
+from tornium_commons import rds
+
+from ..utils import setting
+from .cache import normalize_endpoint
+from .ratelimit import PRIORITY_CLASSES, _script
+
+# Top-level fields of the response of each selection. Fields of selections not listed here (e.g. basic) are passed
+# to every call of a merged call.
+SELECTION_FIELDS = {
+    "armor": ("armor",),
+    "armorynews": ("armorynews",),
+    "attacknews": ("attacknews",),
+    "attacks": ("attacks",),
+    "attacksfull": ("attacks",),
+    "boosters": ("boosters",),
+    "caches": ("caches",),
+    "cesium": ("cesium",),
+    "chain": ("chain",),
+    "chains": ("chains",),
+    "contributors": ("contributors",),
+    "crimenews": ("crimenews",),
+    "crimes": ("crimes",),
+    "discord": ("discord",),
+    "donations": ("donations",),
+    "drugs": ("drugs",),
+    "fundsnews": ("fundsnews",),
+    "mainnews": ("mainnews",),
+    "medical": ("medical",),
+    "membershipnews": ("membershipnews",),
+    "personalstats": ("personalstats",),
+    "positions": ("positions",),
+    "stocks": ("stocks",),
+    "temporary": ("temporary",),
+    "weapons": ("weapons",),
+}
+
+# Arguments of tornget that can't be merged as they change the response of every selection of the call
+UNMERGEABLE_ARGUMENTS = ("tots", "fromts", "stat", "session", "pass_error")
+
+# Adds an entry to a merge group and marks the group as scheduled if the group isn't already scheduled to be flushed
+#
+# KEYS[1]: list of the entries of the group
+# KEYS[2]: key marking the group as scheduled
+# ARGV[1]: entry
+# ARGV[2]: milliseconds the entries and the mark are kept for
+#
+# Returns 1 if the group has to be scheduled
+_ADD_SCRIPT = """
+redis.call("RPUSH", KEYS[1], ARGV[1])
+redis.call("PEXPIRE", KEYS[1], ARGV[2])
+
+if redis.call("SET", KEYS[2], 1, "NX", "PX", ARGV[2]) then
+    return 1
+end
+
+return 0
+"""
+
+# Removes the flushed entries of a merge group and unmarks the group if no entries were added during the flush
+#
+# KEYS[1]: list of the entries of the group
+# KEYS[2]: key marking the group as scheduled
+# ARGV[1]: number of flushed entries
+# ARGV[2]: milliseconds the entries and the mark are kept for
+#
+# Returns the number of remaining entries
+_FINISH_SCRIPT = """
+redis.call("LTRIM", KEYS[1], ARGV[1], -1)
+local remaining = redis.call("LLEN", KEYS[1])
+
+if remaining == 0 then
+    redis.call("DEL", KEYS[2])
+else
+    redis.call("PEXPIRE", KEYS[2], ARGV[2])
+end
+
+return remaining
+"""
+
+
+class MergeGroup(typing.NamedTuple):
+    entries_key: str
+    scheduled_key: str
+
+
+def _ttl_ms() -> int:
+    # Long enough for the flush to be deferred by the ratelimiter once; lost flushes are re-scheduled by the next
+    # call added to the group after the mark has expired
+    return int((float(setting("tornium_torn_merge_window", 1.5)) + 60) * 1000)
+
+
+def mergeable(call: dict) -> bool:
+    if call.get("key") in (None, ""):
+        return False
+    elif any(call.get(argument) not in (None, 0, "", False) for argument in UNMERGEABLE_ARGUMENTS):
+        return False
+
+    _, _, selections, _ = normalize_endpoint(call["endpoint"], call["key"])
+    return "" not in selections
+
+
+def merge_group(call: dict) -> MergeGroup:
+    """
+    Get the merge group of a call.
+
+    Calls are merged with calls for the same resource, target, and parameters made with the same key. Calls for a
+    resource scoped to the key (e.g. `faction/`) can set `merge_target` (e.g. the faction's ID) to be merged with calls
+    made with other keys of the same target.
+    """
+
+    resource, target, _, extra_params = normalize_endpoint(call["endpoint"], call["key"])
+
+    if call.get("merge_target") is not None:
+        target = f"target-{call['merge_target']}"
+    elif not target.startswith("key-"):
+        # Targets of resources scoped to the key already include the key
+        target += ":key-" + hashlib.sha256(call["key"].encode("utf-8")).hexdigest()[:16]
+
+    group = f"tornium:torn-merge:{resource}:{target}"
+
+    if len(extra_params) != 0:
+        group += ":" + urllib.parse.urlencode(extra_params)
+
+    return MergeGroup(entries_key=group, scheduled_key=f"{group}:scheduled")
+
+
+def add_to_merge(calls: typing.Iterable[dict], handler) -> typing.List[str]:
+    """
+    Add calls to their merge groups and return the groups that have to be scheduled to be flushed.
+    """
+
+    redis_client = rds()
+    pipeline = redis_client.pipeline(transaction=False)
+    groups = []
+    ttl_ms = _ttl_ms()
+
+    for call in calls:
+        group = merge_group(call)
+        groups.append(group.entries_key)
+        entry = {
+            "endpoint": call["endpoint"],
+            "key": call["key"],
+            "handler": dict(handler),
+            "handler_kwargs": call.get("handler_kwargs", {}),
+            "priority_class": call.get("priority_class"),
+            "cache": bool(call.get("cache", False)),
+            "claim_check": bool(call.get("claim_check", False)),
+            "projection": call.get("projection"),
+        }
+
+        _script(redis_client, _ADD_SCRIPT)(
+            keys=[group.entries_key, group.scheduled_key],
+            args=[json.dumps(entry, separators=(",", ":")), ttl_ms],
+            client=pipeline,
+        )
+
+    return list(dict.fromkeys(group for group, scheduled in zip(groups, pipeline.execute()) if int(scheduled)))
+
+
+def pending_entries(group: str) -> typing.List[dict]:
+    max_entries = max(int(setting("tornium_torn_merge_max_entries", 20)), 1)
+    return [json.loads(entry) for entry in rds().lrange(group, 0, max_entries - 1)]
+
+
+def finish_merge(group: str, flushed: int) -> int:
+    redis_client = rds()
+    return int(
+        _script(redis_client, _FINISH_SCRIPT)(
+            keys=[group, f"{group}:scheduled"],
+            args=[flushed, _ttl_ms()],
+            client=redis_client,
+        )
+    )
+
+
+def extend_merge(group: str, seconds: float):
+    rds().pexpire(f"{group}:scheduled", int(seconds * 1000) + _ttl_ms())
+
+
+def merged_call(entries: typing.List[dict]) -> dict:
+    """
+    Get the kwargs of tornget for the call combining the selections of the entries of a merge group.
+    """
+
+    path, _, query = entries[0]["endpoint"].partition("?")
+    extra_params = [(name, value) for name, value in urllib.parse.parse_qsl(query, True) if name != "selections"]
+    selections = set()
+
+    for entry in entries:
+        selections.update(normalize_endpoint(entry["endpoint"], entry["key"])[2])
+
+    endpoint = f"{path}?selections={','.join(sorted(selections))}"
+
+    if len(extra_params) != 0:
+        endpoint += "&" + urllib.parse.urlencode(extra_params)
+
+    return {
+        "endpoint": endpoint,
+        "key": entries[0]["key"],
+        "priority_class": min(
+            (entry["priority_class"] for entry in entries),
+            key=lambda priority_class: (
+                PRIORITY_CLASSES.index(priority_class) if priority_class in PRIORITY_CLASSES else len(PRIORITY_CLASSES)
+            ),
+        ),
+        "cache": all(entry["cache"] for entry in entries),
+    }
+
+
+def slice_response(response: dict, entry: dict, merged_endpoint: str) -> dict:
+    """
+    Get the part of a merged response belonging to the selections of an entry.
+    """
+
+    merged_fields = set()
+    entry_fields = set()
+
+    for selection in normalize_endpoint(merged_endpoint, entry["key"])[2]:
+        merged_fields.update(SELECTION_FIELDS.get(selection, ()))
+
+    for selection in normalize_endpoint(entry["endpoint"], entry["key"])[2]:
+        entry_fields.update(SELECTION_FIELDS.get(selection, ()))
+
+    return {field: value for field, value in response.items() if field not in merged_fields or field in entry_fields}
@@ -0,0 +1,121 @@
+# Copyright (C) 2021-2023 tiksan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import functools
+import typing
+
+# Marks a field that is kept with all of its contents
+_KEEP = None
+_MISSING = object()
+
+# Fields of every response kept regardless of the projection
+ALWAYS_KEPT = ("error",)
+
+
+def _segment_fields(segment: str) -> typing.Tuple[str, ...]:
+    if segment.startswith("{") and segment.endswith("}"):
+        return tuple(field.strip() for field in segment[1:-1].split(",") if field.strip() != "")
+
+    return (segment,)
+
+
+def _insert(tree: dict, segments: typing.Sequence[str]):
+    fields = _segment_fields(segments[0])
+
+    for field in fields:
+        if len(segments) == 1:
+            tree[field] = _KEEP
+        elif field in tree and tree[field] is _KEEP:
+            # The whole field is already kept by a less specific path
+            continue
+        else:
+            _insert(tree.setdefault(field, {}), segments[1:])
+
+
+def _split_path(path: str) -> typing.List[str]:
+    # Paths are only split on dots outside of braces (e.g. `attacks.*.{result,defender_id}`)
+    segments = []
+    depth = 0
+    segment = ""
+
+    for char in path:
+        if char == "{":
+            depth += 1
+        elif char == "}":
+            depth -= 1
+        elif char == "." and depth == 0:
+            segments.append(segment)
+            segment = ""
+            continue
+
+        segment += char
+
+    segments.append(segment)
+    return segments
+
+
+@functools.lru_cache(maxsize=128)
+def compile_projection(paths: typing.Tuple[str, ...]) -> dict:
+    """
+    Compile projection paths into a tree of the fields to keep.
+
+    Paths are dot-separated fields where `*` matches every key of an object (or every item of a list) and `{a,b}`
+    matches multiple fields (e.g. `attacks.*.{result,defender_id}`). A path ending at a field keeps the whole field.
+    """
+
+    tree: dict = {}
+
+    for path in paths:
+        _insert(tree, _split_path(path))
+
+    for field in ALWAYS_KEPT:
+        tree[field] = _KEEP
+
+    return tree
+
+
+def _project(value, tree):
+    if tree is _KEEP:
+        return value
+    elif isinstance(value, list):
+        # Lists are projected item by item with either the wildcard's fields or the fields of the list itself
+        item_tree = tree.get("*", tree)
+        return [_project(item, item_tree) for item in value]
+    elif not isinstance(value, dict):
+        return value
+
+    wildcard_tree = tree.get("*", _MISSING)
+    projected_value = {}
+
+    for field, field_value in value.items():
+        field_tree = tree.get(field, wildcard_tree)
+
+        if field_tree is _MISSING:
+            continue
+
+        projected_value[field] = _project(field_value, field_tree)
+
+    return projected_value
+
+
+def project(response: dict, paths: typing.Optional[typing.Iterable[str]]) -> dict:
+    """
+    Keep only the fields of a Torn API response matching the projection paths (see `compile_projection`).
+    """
+
+    if paths is None:
+        return response
+
+    return _project(response, compile_projection(tuple(paths)))
@@ -0,0 +1,670 @@
+# Copyright (C) 2021-2023 tiksan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import math
+import time
+import typing
+
+import celery
+from tornium_commons import rds
+
+TORN_RATELIMIT = 50  # Calls per API key per minute
+TORNSTATS_RATELIMIT = 15  # Calls per API key per minute
+DISCORD_GLOBAL_RATELIMIT = 50  # Calls per bot per second
+
+# Priority classes of Torn API calls from the highest to the lowest priority with the share of each key's calls per
+# minute reserved for the class
+PRIORITY_CLASSES = ("retal", "notifications", "refresh", "reports")
+PRIORITY_SHARES = {
+    "retal": 0.4,  # Attacks for retaliations and chains
+    "notifications": 0.25,  # OCs, armory, stakeouts, and other notifications
+    "refresh": 0.2,  # Periodic refreshes of users and factions
+    "reports": 0.15,  # Bulk reports
+}
+
+# Checks and decrements the remaining budget of a fixed window in a single round trip so that concurrent workers
+# can't race between the read and the decrement.
+#
+# KEYS[1]: key storing the remaining calls in the window
+# ARGV[1]: calls allowed per window
+# ARGV[2]: milliseconds until the end of the window
+# ARGV[3]: cost of the call
+#
+# Returns {allowed, remaining, milliseconds until reset}
+_FIXED_WINDOW_SCRIPT = """
+local remaining = tonumber(redis.call("GET", KEYS[1]))
+local ttl = redis.call("PTTL", KEYS[1])
+
+if remaining == nil then
+    remaining = tonumber(ARGV[1])
+    ttl = tonumber(ARGV[2])
+    redis.call("SET", KEYS[1], remaining, "PX", ttl)
+elseif ttl < 0 then
+    ttl = tonumber(ARGV[2])
+    redis.call("PEXPIRE", KEYS[1], ttl)
+end
+
+if remaining < tonumber(ARGV[3]) then
+    return {0, remaining, ttl}
+end
+
+remaining = redis.call("DECRBY", KEYS[1], ARGV[3])
+return {1, remaining, ttl}
+"""
+
+# Generic cell rate algorithm (GCRA): each key stores its theoretical arrival time (TAT) so that calls are spread
+# evenly across the window instead of being bunched at the start of every minute.
+#
+# KEYS[1]: key storing the TAT in milliseconds
+# ARGV[1]: emission interval in milliseconds
+# ARGV[2]: number of calls that can be made back-to-back
+# ARGV[3]: cost of the call
+#
+# Returns {allowed, remaining, milliseconds until the TAT, milliseconds until the call would be allowed}
+_GCRA_SCRIPT = """
+if redis.replicate_commands ~= nil then
+    redis.replicate_commands()
+end
+
+local now_parts = redis.call("TIME")
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+local interval = tonumber(ARGV[1])
+local burst_offset = interval * tonumber(ARGV[2])
+local tat = tonumber(redis.call("GET", KEYS[1]))
+
+if tat == nil or tat < now then
+    tat = now
+end
+
+local new_tat = tat + interval * tonumber(ARGV[3])
+local allow_at = new_tat - burst_offset
+
+if allow_at > now then
+    return {0, 0, tat - now, allow_at - now}
+end
+
+redis.call("SET", KEYS[1], new_tat, "PX", math.ceil(new_tat - now))
+return {1, math.floor((now + burst_offset - new_tat) / interval), new_tat - now, 0}
+"""
+
+# Fixed window where part of the window's calls are reserved for higher priority classes. The reservation of a class is
+# reduced by the calls made by that class and decreases as the window elapses so that unused calls of higher priority
+# classes flow down to lower priority classes by the end of the window.
+#
+# The check and the charge of the window are split so that the GCRA script can only charge the window once the GCRA
+# has allowed the call. Both expect the locals `window_key`, `usage_key`, `limit`, `window_ms`, `window_length_ms`,
+# `cost`, `priority`, and `shares` (the calls reserved for each priority class from the highest to the lowest priority).
+_PLANNED_WINDOW_CHECK = """
+local remaining = tonumber(redis.call("GET", window_key))
+local ttl = redis.call("PTTL", window_key)
+
+if remaining == nil then
+    remaining = limit
+    ttl = window_ms
+    redis.call("SET", window_key, remaining, "PX", ttl)
+    redis.call("DEL", usage_key)
+elseif ttl < 0 then
+    ttl = window_ms
+    redis.call("PEXPIRE", window_key, ttl)
+end
+
+local reserved = 0
+
+if priority > 1 then
+    local fields = {}
+
+    for i = 1, priority - 1 do
+        fields[i] = tostring(i)
+    end
+
+    local used = redis.call("HMGET", usage_key, unpack(fields))
+    local window_left = math.min(ttl / window_length_ms, 1)
+
+    for i = 1, priority - 1 do
+        local unused = tonumber(shares[i]) - (tonumber(used[i]) or 0)
+
+        if unused > 0 then
+            reserved = reserved + unused * window_left
+        end
+    end
+
+    reserved = math.ceil(reserved)
+end
+
+local planned_allowed = remaining - cost >= reserved and remaining >= cost
+"""
+
+_PLANNED_WINDOW_CHARGE = """
+remaining = redis.call("DECRBY", window_key, cost)
+redis.call("HINCRBY", usage_key, priority, cost)
+redis.call("PEXPIRE", usage_key, ttl)
+"""
+
+# KEYS[1]: key storing the remaining calls in the window
+# KEYS[2]: hash storing the calls made in the window by each priority class (by the index of the class)
+# ARGV[1]: calls allowed per window
+# ARGV[2]: milliseconds until the end of the window
+# ARGV[3]: length of the window in milliseconds
+# ARGV[4]: cost of the call
+# ARGV[5]: index of the call's priority class (starting at 1 for the highest priority class)
+# ARGV[6...]: calls reserved for each priority class from the highest to the lowest priority
+#
+# Returns {allowed, remaining, milliseconds until reset, calls reserved for higher priority classes}
+_PLANNED_WINDOW_SCRIPT = (
+    """
+local window_key = KEYS[1]
+local usage_key = KEYS[2]
+local limit = tonumber(ARGV[1])
+local window_ms = tonumber(ARGV[2])
+local window_length_ms = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+local priority = tonumber(ARGV[5])
+local shares = {unpack(ARGV, 6)}
+"""
+    + _PLANNED_WINDOW_CHECK
+    + """
+if not planned_allowed then
+    return {0, remaining, ttl, reserved}
+end
+"""
+    + _PLANNED_WINDOW_CHARGE
+    + """
+return {1, remaining, ttl, reserved}
+"""
+)
+
+# GCRA (see `_GCRA_SCRIPT`) where the calls of each priority class are also planned with a separate fixed window (see
+# `_PLANNED_WINDOW_CHECK`) as the GCRA doesn't have the calls remaining in the minute. The planned window is only
+# charged when both the planned window and the GCRA allow the call so that denied and requeued calls don't use the
+# calls of the priority class.
+#
+# KEYS[1]: key storing the TAT in milliseconds
+# KEYS[2]: key storing the remaining calls in the planned window
+# KEYS[3]: hash storing the calls made in the planned window by each priority class (by the index of the class)
+# ARGV[1]: emission interval in milliseconds
+# ARGV[2]: number of calls that can be made back-to-back
+# ARGV[3]: cost of the call
+# ARGV[4]: calls allowed per planned window
+# ARGV[5]: milliseconds until the end of the planned window
+# ARGV[6]: length of the planned window in milliseconds
+# ARGV[7]: index of the call's priority class (starting at 1 for the highest priority class)
+# ARGV[8...]: calls reserved for each priority class from the highest to the lowest priority
+#
+# Returns {allowed, remaining, milliseconds until the TAT or until the planned window resets, calls reserved for higher
+# priority classes, milliseconds until the call would be allowed by the GCRA (or -1 if denied by the planned window)}
+_GCRA_PLANNED_SCRIPT = (
+    """
+if redis.replicate_commands ~= nil then
+    redis.replicate_commands()
+end
+
+local window_key = KEYS[2]
+local usage_key = KEYS[3]
+local limit = tonumber(ARGV[4])
+local window_ms = tonumber(ARGV[5])
+local window_length_ms = tonumber(ARGV[6])
+local cost = tonumber(ARGV[3])
+local priority = tonumber(ARGV[7])
+local shares = {unpack(ARGV, 8)}
+"""
+    + _PLANNED_WINDOW_CHECK
+    + """
+if not planned_allowed then
+    return {0, remaining, ttl, reserved, -1}
+end
+
+local now_parts = redis.call("TIME")
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+local interval = tonumber(ARGV[1])
+local burst_offset = interval * tonumber(ARGV[2])
+local tat = tonumber(redis.call("GET", KEYS[1]))
+
+if tat == nil or tat < now then
+    tat = now
+end
+
+local new_tat = tat + interval * cost
+local allow_at = new_tat - burst_offset
+
+if allow_at > now then
+    return {0, 0, tat - now, reserved, allow_at - now}
+end
+
+redis.call("SET", KEYS[1], new_tat, "PX", math.ceil(new_tat - now))
+"""
+    + _PLANNED_WINDOW_CHARGE
+    + """
+return {1, math.floor((now + burst_offset - new_tat) / interval), new_tat - now, reserved, 0}
+"""
+)
+
+# Discord's global ratelimit is shared by every worker calling the API with the bot token. When Discord responds with
+# a global 429, every call is blocked until Discord's Retry-After has passed.
+#
+# KEYS[1]: key storing the remaining calls in the current second
+# KEYS[2]: key set while the bot is blocked by Discord
+# ARGV[1]: calls allowed per second
+# ARGV[2]: cost of the call
+#
+# Returns {allowed, remaining, milliseconds until the call would be allowed}
+_DISCORD_GLOBAL_SCRIPT = """
+local blocked = redis.call("PTTL", KEYS[2])
+
+if blocked > 0 then
+    return {0, 0, blocked}
+end
+
+local remaining = tonumber(redis.call("GET", KEYS[1]))
+local ttl = redis.call("PTTL", KEYS[1])
+
+if remaining == nil or ttl < 0 then
+    remaining = tonumber(ARGV[1])
+    ttl = 1000
+    redis.call("SET", KEYS[1], remaining, "PX", ttl)
+end
+
+if remaining < tonumber(ARGV[2]) then
+    return {0, remaining, ttl}
+end
+
+remaining = redis.call("DECRBY", KEYS[1], ARGV[2])
+return {1, remaining, 0}
+"""
+
+# Reads the remaining budget of many keys without using any of the budget
+#
+# KEYS: pairs of the key storing the key's ratelimit and the key set while the key is unavailable
+# ARGV[1]: ratelimiter mode (fixed or gcra)
+# ARGV[2]: calls allowed per window
+# ARGV[3]: emission interval in milliseconds (gcra only)
+# ARGV[4]: number of calls that can be made back-to-back (gcra only)
+#
+# Returns the remaining calls of each key (or -1 if the key is unavailable)
+_PEEK_SCRIPT = """
+local mode = ARGV[1]
+local interval = tonumber(ARGV[3])
+local burst_offset = interval * tonumber(ARGV[4])
+local now = 0
+
+if mode == "gcra" then
+    local now_parts = redis.call("TIME")
+    now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+end
+
+local budgets = {}
+
+for i = 1, #KEYS, 2 do
+    if redis.call("EXISTS", KEYS[i + 1]) == 1 then
+        budgets[#budgets + 1] = -1
+    elseif mode == "gcra" then
+        local tat = tonumber(redis.call("GET", KEYS[i]))
+
+        if tat == nil or tat < now then
+            tat = now
+        end
+
+        budgets[#budgets + 1] = math.floor((now + burst_offset - tat) / interval)
+    else
+        local remaining = tonumber(redis.call("GET", KEYS[i]))
+
+        if remaining == nil then
+            remaining = tonumber(ARGV[2])
+        end
+
+        budgets[#budgets + 1] = remaining
+    end
+end
+
+return budgets
+"""
+
+_scripts: typing.Dict[str, typing.Any] = {}
+
+
+class RatelimitResult(typing.NamedTuple):
+    allowed: bool
+    remaining: int
+    reset: float  # Seconds until the budget is reset
+    retry_after: float = 0  # Seconds until the call would be allowed
+
+
+def _script(redis_client, source: str):
+    # Script objects only hold the SHA1 of the script, so they can be shared between clients as long as the
+    # client is passed when the script is called
+    if source not in _scripts:
+        _scripts[source] = redis_client.register_script(source)
+
+    return _scripts[source]
+
+
+def _minute_window_ms() -> int:
+    # Torn's and TornStats' ratelimits reset at the start of each minute
+    return max(60_000 - int(time.time() * 1000) % 60_000, 1)
+
+
+def fixed_window(redis_key: str, limit: int, window_ms: int, cost: int = 1) -> RatelimitResult:
+    redis_client = rds()
+    allowed, remaining, ttl = _script(redis_client, _FIXED_WINDOW_SCRIPT)(
+        keys=[redis_key],
+        args=[limit, window_ms, cost],
+        client=redis_client,
+    )
+
+    return RatelimitResult(
+        allowed=bool(allowed),
+        remaining=int(remaining),
+        reset=int(ttl) / 1000,
+        retry_after=0 if allowed else int(ttl) / 1000,
+    )
+
+
+def _planned_args(
+    limit: int,
+    window_ms: int,
+    window_length_ms: int,
+    shares: typing.Dict[str, float],
+    priority_class: str,
+) -> list:
+    classes = tuple(shares.keys())
+
+    if priority_class not in shares:
+        raise ValueError(f"Unknown priority class {priority_class}")
+
+    return [limit, window_ms, window_length_ms, classes.index(priority_class) + 1] + [
+        math.floor(limit * shares[c]) for c in classes
+    ]
+
+
+def _planned_retry_after(remaining: int, ttl: int, reserved: int, cost: int) -> float:
+    if remaining < cost or reserved == 0:
+        return ttl / 1000
+
+    # The reservation decreases linearly until the end of the window, so the call will be allowed once the
+    # reservation has decreased to the calls remaining after the call
+    return max(ttl - (remaining - cost) / reserved * ttl, 0) / 1000
+
+
+def planned_window(
+    redis_key: str,
+    usage_key: str,
+    limit: int,
+    window_ms: int,
+    window_length_ms: int,
+    shares: typing.Dict[str, float],
+    priority_class: str,
+    cost: int = 1,
+) -> RatelimitResult:
+    limit, window_ms, window_length_ms, priority, *class_shares = _planned_args(
+        limit, window_ms, window_length_ms, shares, priority_class
+    )
+
+    redis_client = rds()
+    allowed, remaining, ttl, reserved = _script(redis_client, _PLANNED_WINDOW_SCRIPT)(
+        keys=[redis_key, usage_key],
+        args=[limit, window_ms, window_length_ms, cost, priority] + class_shares,
+        client=redis_client,
+    )
+    remaining = int(remaining)
+    ttl = int(ttl)
+    reserved = int(reserved)
+
+    return RatelimitResult(
+        allowed=bool(allowed),
+        remaining=remaining,
+        reset=ttl / 1000,
+        retry_after=0.0 if allowed else _planned_retry_after(remaining, ttl, reserved, cost),
+    )
+
+
+def _gcra_params(limit: int, period_ms: int, burst: int) -> typing.Tuple[int, int]:
+    # The emission interval is calculated from the calls outside of the burst so that no more than `limit` calls can
+    # be made in any `period_ms` long sliding window
+    burst = max(min(burst, limit - 1), 1)
+    return math.ceil(period_ms / (limit - burst + 1)), burst
+
+
+def gcra(redis_key: str, limit: int, period_ms: int, burst: int, cost: int = 1) -> RatelimitResult:
+    interval, burst = _gcra_params(limit, period_ms, burst)
+
+    redis_client = rds()
+    allowed, remaining, tat_ms, retry_after_ms = _script(redis_client, _GCRA_SCRIPT)(
+        keys=[redis_key],
+        args=[interval, burst, cost],
+        client=redis_client,
+    )
+
+    return RatelimitResult(
+        allowed=bool(allowed),
+        remaining=int(remaining),
+        reset=float(tat_ms) / 1000,
+        retry_after=float(retry_after_ms) / 1000,
+    )
+
+
+def gcra_planned(
+    redis_key: str,
+    window_key: str,
+    usage_key: str,
+    limit: int,
+    period_ms: int,
+    burst: int,
+    window_ms: int,
+    window_length_ms: int,
+    shares: typing.Dict[str, float],
+    priority_class: str,
+    cost: int = 1,
+) -> RatelimitResult:
+    interval, burst = _gcra_params(limit, period_ms, burst)
+
+    redis_client = rds()
+    allowed, remaining, reset_ms, reserved, retry_after_ms = _script(redis_client, _GCRA_PLANNED_SCRIPT)(
+        keys=[redis_key, window_key, usage_key],
+        args=[interval, burst, cost] + _planned_args(limit, window_ms, window_length_ms, shares, priority_class),
+        client=redis_client,
+    )
+
+    if allowed:
+        retry_after = 0.0
+    elif int(retry_after_ms) < 0:
+        # Denied by the planned window
+        retry_after = _planned_retry_after(int(remaining), int(reset_ms), int(reserved), cost)
+    else:
+        retry_after = float(retry_after_ms) / 1000
+
+    return RatelimitResult(
+        allowed=bool(allowed),
+        remaining=int(remaining),
+        reset=float(reset_ms) / 1000,
+        retry_after=retry_after,
+    )
+
+
+def torn_ratelimit_mode() -> str:
+    return celery.current_app.conf.get("tornium_torn_ratelimit_mode", "fixed")
+
+
+def torn_ratelimit_key(key: str) -> str:
+    if torn_ratelimit_mode() == "gcra":
+        return f"tornium:torn-ratelimit:gcra:{key}"
+
+    return f"tornium:torn-ratelimit:{key}"
+
+
+def _torn_ratelimit_burst() -> int:
+    return int(celery.current_app.conf.get("tornium_torn_ratelimit_burst", 5))
+
+
+def torn_priority_shares() -> typing.Dict[str, float]:
+    shares = celery.current_app.conf.get("tornium_torn_priority_shares", PRIORITY_SHARES)
+    return {priority_class: float(shares.get(priority_class, 0)) for priority_class in PRIORITY_CLASSES}
+
+
+def torn_ratelimit(key: str, cost: int = 1, priority_class: typing.Optional[str] = None) -> RatelimitResult:
+    """
+    Use `cost` calls of the API key's ratelimit.
+
+    When a priority class is provided, the call is only allowed if it doesn't use the calls of the key reserved for
+    higher priority classes (see `_PLANNED_WINDOW_SCRIPT`).
+    """
+
+    if priority_class is not None and torn_ratelimit_mode() == "gcra":
+        # The calls per priority class are planned with a separate fixed window as the GCRA doesn't have the calls
+        # remaining in the minute
+        return gcra_planned(
+            torn_ratelimit_key(key),
+            f"tornium:torn-budget:{key}",
+            f"tornium:torn-budget:classes:{key}",
+            TORN_RATELIMIT,
+            60_000,
+            _torn_ratelimit_burst(),
+            _minute_window_ms(),
+            60_000,
+            torn_priority_shares(),
+            priority_class,
+            cost,
+        )
+    elif priority_class is not None:
+        return planned_window(
+            torn_ratelimit_key(key),
+            f"tornium:torn-budget:classes:{key}",
+            TORN_RATELIMIT,
+            _minute_window_ms(),
+            60_000,
+            torn_priority_shares(),
+            priority_class,
+            cost,
+        )
+    elif torn_ratelimit_mode() == "gcra":
+        return gcra(torn_ratelimit_key(key), TORN_RATELIMIT, 60_000, _torn_ratelimit_burst(), cost)
+
+    return fixed_window(torn_ratelimit_key(key), TORN_RATELIMIT, _minute_window_ms(), cost)
+
+
+def torn_ratelimit_peek(keys: typing.Sequence[str], unavailable_keys: typing.Sequence[str]) -> typing.List[int]:
+    """
+    Get the remaining calls of each key without using any of the keys' budgets.
+
+    Keys whose matching Redis key in `unavailable_keys` exists are returned as -1.
+    """
+
+    if len(keys) == 0:
+        return []
+
+    interval, burst = _gcra_params(TORN_RATELIMIT, 60_000, _torn_ratelimit_burst())
+    redis_keys = []
+
+    for key, unavailable_key in zip(keys, unavailable_keys):
+        redis_keys.append(torn_ratelimit_key(key))
+        redis_keys.append(unavailable_key)
+
+    redis_client = rds()
+    return [
+        int(remaining)
+        for remaining in _script(redis_client, _PEEK_SCRIPT)(
+            keys=redis_keys,
+            args=[torn_ratelimit_mode(), TORN_RATELIMIT, interval, burst],
+            client=redis_client,
+        )
+    ]
+
+
+def tornstats_ratelimit(key: str, cost: int = 1) -> RatelimitResult:
+    return fixed_window(f"tornium:ts-ratelimit:{key}", TORNSTATS_RATELIMIT, _minute_window_ms(), cost)
+
+
+def discord_global_ratelimit(cost: int = 1) -> RatelimitResult:
+    redis_client = rds()
+    allowed, remaining, retry_after_ms = _script(redis_client, _DISCORD_GLOBAL_SCRIPT)(
+        keys=["tornium:discord-ratelimit:global", "tornium:discord-ratelimit:global-blocked"],
+        args=[int(celery.current_app.conf.get("tornium_discord_global_ratelimit", DISCORD_GLOBAL_RATELIMIT)), cost],
+        client=redis_client,
+    )
+
+    return RatelimitResult(
+        allowed=bool(allowed),
+        remaining=int(remaining),
+        reset=int(retry_after_ms) / 1000,
+        retry_after=int(retry_after_ms) / 1000,
+    )
+
+
+def discord_global_block(retry_after: float):
+    # Blocks are only extended so that an outdated Retry-After from a slow response can't shorten a newer block
+    retry_after_ms = max(int(retry_after * 1000), 1)
+    redis_client = rds()
+
+    if redis_client.pttl("tornium:discord-ratelimit:global-blocked") < retry_after_ms:
+        redis_client.set("tornium:discord-ratelimit:global-blocked", 1, px=retry_after_ms)
+
+
+def discord_route_key(method: str, endpoint: str) -> str:
+    return f"tornium:discord-reset:{method}|{endpoint.split('?')[0]}"
+
+
+def discord_route_reset(method: str, endpoint: str, headers) -> typing.Optional[float]:
+    """
+    Store when the bucket of a route resets from the headers of a Discord response.
+
+    Returns the seconds until the bucket resets (if provided by Discord).
+    """
+
+    try:
+        reset_after = float(headers["X-RateLimit-Reset-After"])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+    if reset_after <= 0:
+        return reset_after
+
+    rds().set(
+        discord_route_key(method, endpoint),
+        int(time.time() * 1000 + reset_after * 1000),
+        px=int(reset_after * 1000) + 1,
+    )
+    return reset_after
+
+
+def discord_route_reset_after(method: str, endpoint: str) -> typing.Optional[float]:
+    # Seconds until the bucket of a route resets (if known)
+    reset_at = rds().get(discord_route_key(method, endpoint))
+
+    if reset_at is None:
+        return None
+
+    return max(int(reset_at) / 1000 - time.time(), 0)
+
+
+def record_discord_retry(countdown: float, backoff_countdown: float, informed: bool):
+    """
+    Record a retry of a Discord API call against the random backoff that would have been used instead.
+
+    A retry scheduled by the random backoff before the bucket resets would have been ratelimited again, so these are
+    counted as retries avoided. Seconds saved is the time the random backoff would have waited past the reset.
+    """
+
+    pipeline = rds().pipeline(transaction=False)
+
+    if not informed:
+        pipeline.hincrby("tornium:discord-retry:metrics", "uninformed")
+    else:
+        pipeline.hincrby("tornium:discord-retry:metrics", "informed")
+
+        if backoff_countdown < countdown:
+            pipeline.hincrby("tornium:discord-retry:metrics", "retries_avoided")
+            pipeline.hincrbyfloat("tornium:discord-retry:metrics", "seconds_early", countdown - backoff_countdown)
+        else:
+            pipeline.hincrbyfloat("tornium:discord-retry:metrics", "seconds_saved", backoff_countdown - countdown)
+
+    pipeline.execute()
@@ -134,6 +134,7 @@ def enqueue_member_ps(faction_data: dict, api_keys: tuple, rid: str):
             kwargs={
                 "endpoint": f"user/{member_id}?selections=personalstats&stat={requested_stats}&timestamp={from_ts}",
                 "key": api_keys[call_count % len(api_keys)],
+                "priority_class": "reports",
             }
         ).apply_async(
             countdown=60 * (call_count // (len(api_keys) * 25)),
@@ -156,6 +157,7 @@ def enqueue_member_ps(faction_data: dict, api_keys: tuple, rid: str):
             kwargs={
                 "endpoint": f"user/{member_id}?selections=personalstats&stat={requested_stats}&timestamp={report.end_timestamp}",
                 "key": api_keys[call_count % len(api_keys)],
+                "priority_class": "reports",
             }
         ).apply_async(
             countdown=60 * (call_count // (len(api_keys) * 25) + 1),
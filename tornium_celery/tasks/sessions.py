@@ -0,0 +1,216 @@
+# Copyright (C) 2021-2023 tiksan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import os
+import threading
+import time
+import typing
+
+import requests
+from celery.concurrency import get_implementation
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown
+from celery.utils.log import get_task_logger
+from requests.adapters import HTTPAdapter
+
+from ..utils import setting
+
+logger = get_task_logger("celery_app")
+
+# One pool per upstream API so that a burst against one API can't exhaust the connections of another
+SESSION_NAMES = ("torn", "discord", "tornstats")
+
+_lock = threading.Lock()
+_pid: typing.Optional[int] = None
+_sessions: typing.Dict[str, requests.Session] = {}
+_last_used: typing.Dict[str, float] = {}
+_green_concurrency = 0  # Number of concurrent tasks when the worker runs tasks on greenlets
+_closed_stats: typing.Dict[str, typing.Dict[str, int]] = {
+    name: {"requests": 0, "connections": 0} for name in SESSION_NAMES
+}
+
+
+def _pool_counts(session: requests.Session) -> typing.Tuple[int, int]:
+    # urllib3 tracks the number of requests made and the number of connections opened per host pool, so the
+    # difference is the number of requests that re-used a kept-alive connection
+    requests_made = 0
+    connections_made = 0
+
+    # The same adapter is mounted for both http:// and https://
+    for adapter in {id(adapter): adapter for adapter in session.adapters.values()}.values():
+        pool_manager = getattr(adapter, "poolmanager", None)
+
+        if pool_manager is None:
+            continue
+
+        for pool_key in pool_manager.pools.keys():
+            pool = pool_manager.pools.get(pool_key)
+
+            if pool is None:
+                continue
+
+            requests_made += pool.num_requests
+            connections_made += pool.num_connections
+
+    return requests_made, connections_made
+
+
+def _close(name: str):
+    session = _sessions.pop(name, None)
+    _last_used.pop(name, None)
+
+    if session is None:
+        return
+
+    requests_made, connections_made = _pool_counts(session)
+    _closed_stats[name]["requests"] += requests_made
+    _closed_stats[name]["connections"] += connections_made
+    session.close()
+
+
+def _create(name: str) -> requests.Session:
+    # Every greenlet of a gevent/eventlet worker could be making a call at once, so the pool needs to hold a
+    # connection per greenlet for the connections to be kept alive
+    pool_size = max(int(setting("tornium_http_pool_size", 10)), _green_concurrency)
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, pool_block=False)
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    return session
+
+
+def get_session(name: str) -> requests.Session:
+    """
+    Get the keep-alive session for an upstream API for the current worker process.
+
+    Sessions are created lazily so that sockets are never shared between a prefork parent and its children. A
+    session that has been idle for longer than the configured idle timeout is closed and re-created as the upstream
+    will have most likely closed the connections anyways.
+    """
+
+    global _pid
+
+    if name not in SESSION_NAMES:
+        raise ValueError(f"Unknown session {name}")
+
+    now = time.monotonic()
+    idle_timeout = float(setting("tornium_http_pool_idle_timeout", 60))
+
+    with _lock:
+        if _pid != os.getpid():
+            # Connections inherited from the parent process must not be used by the forked process
+            _sessions.clear()
+            _last_used.clear()
+            _pid = os.getpid()
+
+        if name in _sessions and now - _last_used[name] > idle_timeout:
+            _close(name)
+
+        if name not in _sessions:
+            _sessions[name] = _create(name)
+
+        _last_used[name] = now
+        return _sessions[name]
+
+
+def torn_session() -> requests.Session:
+    return get_session("torn")
+
+
+def discord_session() -> requests.Session:
+    return get_session("discord")
+
+
+def tornstats_session() -> requests.Session:
+    return get_session("tornstats")
+
+
+def close_sessions():
+    with _lock:
+        for name in tuple(_sessions.keys()):
+            _close(name)
+
+
+def connection_stats() -> typing.Dict[str, typing.Dict[str, int]]:
+    """
+    Get the number of requests made, connections opened, and connections re-used per session in this process.
+    """
+
+    stats = {}
+
+    with _lock:
+        for name in SESSION_NAMES:
+            requests_made = _closed_stats[name]["requests"]
+            connections_made = _closed_stats[name]["connections"]
+
+            if name in _sessions:
+                session_requests, session_connections = _pool_counts(_sessions[name])
+                requests_made += session_requests
+                connections_made += session_connections
+
+            stats[name] = {
+                "requests": requests_made,
+                "connections": connections_made,
+                "reused": max(requests_made - connections_made, 0),
+            }
+
+    return stats
+
+
+@worker_init.connect
+def configure_green_worker(sender=None, *args, **kwargs):
+    global _green_concurrency
+
+    # API workers can be run with a green pool (e.g. `celery -A tornium_celery worker -Q api -P gevent -c 100`) to
+    # make many API calls concurrently from a single process
+    if sender is None:
+        return
+
+    # The pool's class is only resolved from its name after this signal
+    pool_cls = get_implementation(sender.pool_cls)
+
+    if not getattr(pool_cls, "is_green", False):
+        return
+
+    with _lock:
+        _green_concurrency = int(sender.concurrency or 0)
+
+        for name in tuple(_sessions.keys()):
+            _close(name)
+
+    logger.info(f"HTTP sessions sized for {_green_concurrency} concurrent green tasks")
+
+
+@worker_process_init.connect
+def reset_sessions(*args, **kwargs):
+    global _pid
+
+    with _lock:
+        _sessions.clear()
+        _last_used.clear()
+        _pid = os.getpid()
+
+        for name in SESSION_NAMES:
+            _closed_stats[name] = {"requests": 0, "connections": 0}
+
+
+@worker_process_shutdown.connect
+def log_connection_stats(*args, **kwargs):
+    for name, stats in connection_stats().items():
+        logger.info(
+            f"HTTP session {name} :: {stats['requests']} requests :: {stats['connections']} connections opened :: "
+            f"{stats['reused']} connections reused"
+        )
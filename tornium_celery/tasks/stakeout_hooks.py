@@ -29,7 +29,8 @@ from tornium_commons.formatters import remove_html, str_matches, torn_timestamp
 from tornium_commons.models import Faction, Notification, Server, User
 from tornium_commons.skyutils import SKYNET_ERROR, SKYNET_GOOD, SKYNET_INFO
 
-from .api import discordpost, tornget
+from .api import discordpost, enqueue_tornget_many, tornget
+from .keys import default_keys, least_loaded_key
 
 logger = get_task_logger("celery_app")
 
@@ -108,6 +109,8 @@ def first_landing(duration):
     time_limit=10,
 )
 def run_user_stakeouts():
+    stakeout_calls = []
+
     notification: Notification
     for notification in (
         Notification.select().join(User).where((Notification.n_type == 1) & (Notification.enabled == True))
@@ -123,25 +126,24 @@ def run_user_stakeouts():
                 notification.delete_instance()
                 continue
 
-            try:
-                key_user: typing.Optional[User] = User.select().where(User.tid == random.choice(guild.admins)).first()
-            except DoesNotExist:
-                continue
-
-            key = key_user.key
+            key = least_loaded_key(default_keys(guild.admins))
         else:
             key = notification.invoker.key
 
         if key is None:
             continue
 
-        tornget.signature(
-            kwargs={
+        stakeout_calls.append(
+            {
                 "endpoint": f"user/{notification.target}?selections=",
                 "key": key,
-            },
-            queue="api",
-        ).apply_async(expires=300, link=user_hook.s())
+                "cache": True,
+                "coalesce": True,
+                "priority_class": "notifications",
+            }
+        )
+
+    enqueue_tornget_many(stakeout_calls, handler=user_hook.s(), expires=300)
 
 
 @celery.shared_task(
@@ -485,14 +487,7 @@ def run_faction_stakeouts():
             if guild is None or len(guild.admins) == 0:
                 continue
 
-            key_user: typing.Optional[User] = (
-                User.select(User.tid).where(User.tid == random.choice(guild.admins)).first()
-            )
-
-            if key_user is None:
-                continue
-
-            key = key_user.key
+            key = least_loaded_key(default_keys(guild.admins))
         else:
             key = invoker.key
 
@@ -503,6 +498,9 @@ def run_faction_stakeouts():
             kwargs={
                 "endpoint": f"faction/{notification.target}?selections=",
                 "key": key,
+                "cache": True,
+                "coalesce": True,
+                "priority_class": "notifications",
             },
             queue="api",
         ).apply_async(expires=300, link=faction_hook.s())
@@ -26,6 +26,8 @@ from tornium_commons.models import Notification, StockTick, TornKey
 from tornium_commons.skyutils import SKYNET_ERROR, SKYNET_GOOD, SKYNET_INFO
 
 from .api import discordpost, tornget
+from .circuit import torn_circuit_open
+from .keys import sampled_key
 from .misc import send_dm
 
 logger = get_task_logger("celery_app")
@@ -62,6 +64,10 @@ def _get_stocks_tick(
     time_limit=5,
 )
 def stocks_prefetch():
+    if torn_circuit_open():
+        logger.info("stocks_prefetch skipped :: Torn API circuit is open")
+        return
+
     stocks_timestamp = datetime.datetime.utcnow().replace(second=5, microsecond=0, tzinfo=datetime.timezone.utc)
 
     if int(time.time()) % 60 >= 5:
@@ -69,10 +75,16 @@ def stocks_prefetch():
     else:
         kwargs = {"eta": stocks_timestamp}
 
+    key = sampled_key()
+
+    if key is None:
+        logger.info("stocks_prefetch skipped :: no API key is available")
+        return
+
     return tornget.signature(
         kwargs={
             "endpoint": "torn/?selections=stocks",
-            "key": TornKey.random_key().api_key,
+            "key": key,
         },
         queue="api",
     ).apply_async(
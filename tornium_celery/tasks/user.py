@@ -35,7 +35,8 @@ from tornium_commons.models import (
     User,
 )
 
-from .api import tornget
+from .api import enqueue_tornget_many, tornget
+from .keys import claim_due_keys
 
 logger = get_task_logger("celery_app")
 
@@ -118,6 +119,8 @@ def update_user(self: celery.Task, key: str, tid: int = 0, discordid: int = 0, r
             kwargs={
                 "endpoint": f"user/{user_id}?selections=profile,discord,personalstats",
                 "key": user.key if user is not None and user.key not in (None, "") else key,
+                "cache": True,
+                "coalesce": True,
             },
             queue="api",
         )
@@ -455,24 +458,24 @@ def update_user_other(user_data):
     time_limit=5,
 )
 def refresh_users():
+    user_calls = []
+
     for api_key in TornKey.select(TornKey.user).join(User).distinct(TornKey.user).where(TornKey.default == True):
         try:
             api_key = User.select(User.tid).where(User.tid == api_key.user_id).get().key
         except DoesNotExist:
             continue
 
-        tornget.signature(
-            kwargs={
+        user_calls.append(
+            {
                 "endpoint": "user/?selections=profile,discord,personalstats,battlestats",
                 "key": api_key,
-            },
-            queue="api",
-        ).apply_async(
-            expires=300,
-            link=update_user_self.signature(kwargs={"key": api_key}),
-            ignore_result=True,
+                "handler_kwargs": {"key": api_key},
+            }
         )
 
+    enqueue_tornget_many(user_calls, handler=update_user_self.s(), expires=300)
+
 
 @celery.shared_task(
     name="tasks.user.fetch_attacks_user_runner",
@@ -684,17 +687,30 @@ def stat_db_attacks_user(user_data):
 )
 def check_api_keys():
     for key in TornKey.select().where((TornKey.user.is_null(True)) | (TornKey.access_level.is_null(True))):
+        # The results of tornget are ignored by default (see tornium_celery.results) but the results of the chord's
+        # header have to be stored until the chord's body is run
         celery.chord(
             [
                 tornget.signature(
-                    kwargs={"endpoint": "key/?selections=info", "key": key.api_key, "pass_error": True}, queue="api"
+                    kwargs={"endpoint": "key/?selections=info", "key": key.api_key, "pass_error": True},
+                    queue="api",
+                    ignore_result=False,
                 ),
                 tornget.signature(
-                    kwargs={"endpoint": "user/?selections=basic", "key": key.api_key, "pass_error": True}, queue="api"
+                    kwargs={"endpoint": "user/?selections=basic", "key": key.api_key, "pass_error": True},
+                    queue="api",
+                    ignore_result=False,
                 ),
             ]
         )(check_api_key_sub.signature(kwargs={"guid": key.guid}))
 
+    # Jailed, inactive, and paused keys are probed once they're due; tornget restores the key when the call succeeds
+    # and pushes back the next probe when the call fails
+    probe_calls = [{"endpoint": "user/?selections=basic", "key": key, "pass_error": True} for key in claim_due_keys()]
+
+    if len(probe_calls) != 0:
+        enqueue_tornget_many(probe_calls, expires=60)
+
     for key_user in (
         TornKey.select(TornKey.user)
         .join(User)
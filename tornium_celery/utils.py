@@ -0,0 +1,51 @@
+# Copyright (C) 2021-2023 tiksan
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU Affero General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+import importlib.util
+import json
+import typing
+
+import celery
+
+
+def module_loaded(module: str) -> bool:
+    try:
+        return bool(importlib.util.find_spec(module))
+    except (ValueError, ModuleNotFoundError):
+        return False
+
+
+ORJSON_LOADED = module_loaded("orjson")
+
+if ORJSON_LOADED:
+    import orjson
+
+
+def setting(name: str, default):
+    return celery.current_app.conf.get(name, default)
+
+
+def json_loads(content: typing.Union[str, bytes]):
+    if ORJSON_LOADED:
+        return orjson.loads(content)
+
+    return json.loads(content)
+
+
+def json_dumps(payload) -> typing.Union[str, bytes]:
+    if ORJSON_LOADED:
+        return orjson.dumps(payload)
+
+    return json.dumps(payload, separators=(",", ":"))